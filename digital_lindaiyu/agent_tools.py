@@ -4,11 +4,17 @@ from __future__ import annotations
 
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 from langchain_core.documents import Document
 
-from .rag import retrieve_documents
+from .cache import LRUCache, normalize_query
+from .config import get_retrieval_config
+from .context_packer import pack_documents
+from .embeddings import wait_for_embeddings
+from .rag import index_version, retrieval_available, retrieve_documents
 
 
 SEARCH_KNOWLEDGE_TOOL: dict[str, Any] = {
@@ -41,52 +47,193 @@ SEARCH_KNOWLEDGE_TOOL: dict[str, Any] = {
 
 def available_tools(vector_store) -> list[dict[str, Any]]:
     """Return tools available for the current runtime."""
-    if vector_store is None:
+    if not retrieval_available(vector_store):
         return []
     return [SEARCH_KNOWLEDGE_TOOL]
 
 
-def run_tool(name: str, arguments: dict[str, Any], vector_store) -> str:
+def run_tool(
+    name: str,
+    arguments: dict[str, Any],
+    vector_store,
+    query_embedding: list[float] | None = None,
+) -> str:
     """Run a tool call and return a JSON string for the model."""
     if name == "search_knowledge_base":
-        return _search_knowledge_base(arguments, vector_store)
+        return _search_knowledge_base(arguments, vector_store, query_embedding)
     return json.dumps(
         {"ok": False, "error": f"未知工具: {name}"}, ensure_ascii=False
     )
 
 
-def _search_knowledge_base(arguments: dict[str, Any], vector_store) -> str:
-    query = str(arguments.get("query") or "").strip()
-    if not query:
-        return json.dumps(
-            {"ok": False, "error": "query 不能为空"}, ensure_ascii=False
+def run_tools(
+    calls: list[tuple[str, dict[str, Any]]],
+    vector_store,
+) -> list[str]:
+    """Run all tool calls of one model round concurrently.
+
+    Query embeddings for every uncached search are computed in a single
+    batched call first; results are returned in the original call order.
+    """
+    if len(calls) <= 1:
+        return [run_tool(name, args, vector_store) for name, args in calls]
+    query_embeddings = _batch_query_embeddings(calls, vector_store)
+    executor = _tool_executor()
+    futures = [
+        executor.submit(
+            run_tool,
+            name,
+            args,
+            vector_store,
+            query_embeddings.get(str(args.get("query") or "").strip()),
         )
+        for name, args in calls
+    ]
+    return [future.result() for future in futures]
+
+
+def _batch_query_embeddings(
+    calls: list[tuple[str, dict[str, Any]]],
+    vector_store,
+) -> dict[str, list[float]]:
+    if vector_store is None or get_retrieval_config().mode == "lexical":
+        return {}
+    embeddings = getattr(vector_store, "embeddings", None)
+    if embeddings is None or not wait_for_embeddings(embeddings, timeout=0):
+        # Model still loading: let each call decide via retrieve_documents.
+        return {}
+    cache = _result_cache()
+    queries: list[str] = []
+    for name, args in calls:
+        if name != "search_knowledge_base":
+            continue
+        query = str(args.get("query") or "").strip()
+        if not query or query in queries:
+            continue
+        if cache is not None and cache.peek(
+            (index_version(), normalize_query(query), _top_k_arg(args))
+        ) is not None:
+            continue
+        queries.append(query)
+    if not queries:
+        return {}
+    try:
+        embed = getattr(embeddings, "embed_queries", None) or embeddings.embed_documents
+        return dict(zip(queries, embed(queries)))
+    except Exception:
+        # 批量失败就让各调用自行嵌入（检索层还有 BM25 兜底）
+        return {}
+
+
+_TOOL_EXECUTOR: ThreadPoolExecutor | None = None
+
+
+def _tool_executor() -> ThreadPoolExecutor:
+    global _TOOL_EXECUTOR
+    if _TOOL_EXECUTOR is None:
+        with _RESULT_CACHE_LOCK:
+            if _TOOL_EXECUTOR is None:
+                _TOOL_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=6, thread_name_prefix="tool-call"
+                )
+    return _TOOL_EXECUTOR
+
+
+def _top_k_arg(arguments: dict[str, Any]) -> int:
     try:
         top_k = int(arguments.get("top_k") or os.getenv("DIGITAL_LDY_TOP_K", "3"))
     except (TypeError, ValueError):
         top_k = 3
+    return max(1, min(6, top_k))
+
+
+def _search_knowledge_base(
+    arguments: dict[str, Any],
+    vector_store,
+    query_embedding: list[float] | None = None,
+) -> str:
+    query = str(arguments.get("query") or "").strip()
+    if not query:
+        return json.dumps(
+            {"ok": False, "error": "query 不能为空"}, ensure_ascii=False
+        )
+    top_k = _top_k_arg(arguments)
+
+    cache = _result_cache()
+    key = (index_version(), normalize_query(query), top_k)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    docs = retrieve_documents(
+        vector_store, query, top_k=top_k, query_embedding=query_embedding
+    )
+    result = _search_payload(query, docs)
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+def prime_search_cache(query: str, top_k: int, docs: list[Document]) -> None:
+    """用已检索好的文档预先填充工具结果缓存（供输入预取使用）。"""
+    cache = _result_cache()
+    query = query.strip()
+    if cache is None or not query:
+        return
     top_k = max(1, min(6, top_k))
+    key = (index_version(), normalize_query(query), top_k)
+    if cache.peek(key) is None:
+        cache.put(key, _search_payload(query, docs[:top_k]))
+
 
-    docs = retrieve_documents(vector_store, query, top_k=top_k)
+def _search_payload(query: str, docs: list[Document]) -> str:
+    # Adjacent chunks are merged and overlaps dropped, so one result may cover
+    # several hits; "rank" is the best retrieval rank inside it.
+    spans = pack_documents(
+        docs, get_retrieval_config().context_tokens, compact=True
+    )
     return json.dumps(
         {
             "ok": True,
             "query": query,
-            "count": len(docs),
-            "results": [_doc_to_payload(doc, i + 1) for i, doc in enumerate(docs)],
+            "count": len(spans),
+            "results": [
+                {"rank": span.rank, "source": span.source, "text": span.text}
+                for span in spans
+            ],
         },
         ensure_ascii=False,
     )
 
 
-def _doc_to_payload(doc: Document, rank: int) -> dict[str, Any]:
-    source = str(doc.metadata.get("source") or "unknown").replace("\\", "/")
-    text = _compact_text(doc.page_content, max_chars=760)
-    return {"rank": rank, "source": source, "text": text}
-
+# 已完成的工具结果缓存：键含知识库版本戳，load_knowledge_base 一改索引即整体失效。
+_RESULT_CACHE: LRUCache[str] | None = None
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def _result_cache() -> LRUCache[str] | None:
+    global _RESULT_CACHE
+    if _RESULT_CACHE is None:
+        with _RESULT_CACHE_LOCK:
+            if _RESULT_CACHE is None:
+                cfg = get_retrieval_config()
+                if cfg.tool_cache_size <= 0:
+                    return None
+                _RESULT_CACHE = LRUCache(
+                    maxsize=cfg.tool_cache_size, ttl=cfg.tool_cache_ttl
+                )
+    return _RESULT_CACHE
+
+
+def describe_cache_stats() -> str | None:
+    """工具结果缓存的命中率摘要，供引擎日志使用；未启用时返回 None。"""
+    cache = _RESULT_CACHE
+    if cache is None:
+        return None
+    total = cache.hits + cache.misses
+    return (
+        f"检索结果缓存命中率 {cache.hit_rate:.0%}（{cache.hits}/{total}，"
+        f"缓存 {len(cache)} 条）"
+    )
 
-def _compact_text(text: str, max_chars: int) -> str:
-    one_line = " ".join(text.split())
-    if len(one_line) <= max_chars:
-        return one_line
-    return one_line[: max_chars - 1].rstrip() + "…"
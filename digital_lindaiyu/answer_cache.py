@@ -0,0 +1,155 @@
+"""以参考问答为种子的语义答案缓存。
+
+``参考回答.txt`` 里的问答对本就是林黛玉口吻的精选回答。把其中的问题
+嵌入成一个小矩阵，用户消息与某个问题的余弦相似度不低于阈值时，
+``ChatEngine.stream`` 直接把对应回答流式输出，不调用 LLM——常见问题
+毫秒级作答、零费用。
+
+查询向量走 ``CachedEmbeddings`` 的查询缓存（输入预取已经算过的草稿直接命中），
+问题矩阵在第一次查询、嵌入模型就绪时才构建；模型仍在后台加载时只做
+归一化后的字面匹配，不阻塞对话。
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from .cache import normalize_query
+from .embeddings import wait_for_embeddings
+from .reference_qa import ReferencePair, load_reference_pairs
+
+logger = logging.getLogger(__name__)
+
+# 太短的消息（"嗯""好"）语义太弱，不参与匹配
+_MIN_QUERY_CHARS = 2
+
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*[。！？!?\n]+|[^。！？!?\n]+")
+
+
+@dataclass(frozen=True)
+class AnswerHit:
+    pair: ReferencePair
+    score: float
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    """按句末标点切分，保留标点；用于把缓存回答分片流式输出。"""
+    for match in _SENTENCE_RE.finditer(text or ""):
+        if match.group().strip():
+            yield match.group()
+
+
+class SemanticAnswerCache:
+    """问题向量索引：``lookup`` 返回最相近且达到阈值的参考问答。"""
+
+    def __init__(
+        self,
+        embeddings,
+        pairs: List[ReferencePair],
+        threshold: float = 0.92,
+    ) -> None:
+        self.embeddings = embeddings
+        self.pairs = list(pairs)
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._exact = {normalize_query(p.question): i for i, p in enumerate(self.pairs)}
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    # ------------------------------ 查询 ------------------------------ #
+
+    def lookup(self, query: str) -> Optional[AnswerHit]:
+        hit = self._match(query)
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return hit
+
+    def _match(self, query: str) -> Optional[AnswerHit]:
+        key = normalize_query(query)
+        if len(key) < _MIN_QUERY_CHARS or not self.pairs:
+            return None
+        idx = self._exact.get(key)
+        if idx is not None:
+            return AnswerHit(self.pairs[idx], 1.0)
+
+        matrix = self._question_matrix()
+        if matrix is None:
+            return None
+        try:
+            vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        except Exception as e:
+            logger.warning("参考回答缓存嵌入查询失败: %s", e)
+            return None
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            return None
+        scores = matrix @ (vector / norm)
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < self.threshold:
+            return None
+        return AnswerHit(self.pairs[best], score)
+
+    def _question_matrix(self) -> Optional[np.ndarray]:
+        if self._matrix is not None:
+            return self._matrix
+        if self.embeddings is None or not wait_for_embeddings(self.embeddings, timeout=0):
+            return None
+        with self._lock:
+            if self._matrix is not None:
+                return self._matrix
+            questions = [p.question for p in self.pairs]
+            # 与 embed_query 同一条路径，问题向量与查询向量才可比
+            embed = getattr(self.embeddings, "embed_queries", None)
+            try:
+                vectors = (
+                    embed(questions)
+                    if embed is not None
+                    else [self.embeddings.embed_query(q) for q in questions]
+                )
+            except Exception as e:
+                logger.warning("构建参考回答缓存失败: %s", e)
+                return None
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._matrix = matrix / norms
+            return self._matrix
+
+    # ------------------------------ 统计 ------------------------------ #
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe_stats(self) -> str:
+        return (
+            f"参考回答缓存: 命中 {self.hits}/{self.hits + self.misses}"
+            f"（{self.hit_rate:.0%}），阈值 {self.threshold:.2f}"
+        )
+
+
+def build_answer_cache(embeddings, threshold: float) -> Optional[SemanticAnswerCache]:
+    """读取参考问答并建缓存；文件缺失或为空时返回 None。"""
+    try:
+        pairs = load_reference_pairs()
+    except Exception as e:
+        logger.warning("读取参考回答失败，不启用答案缓存: %s", e)
+        return None
+    if not pairs:
+        return None
+    return SemanticAnswerCache(embeddings, pairs, threshold=threshold)
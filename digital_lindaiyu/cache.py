@@ -0,0 +1,81 @@
+"""线程安全的 LRU 缓存（可选 TTL）与缓存键归一化工具。"""
+
+from __future__ import annotations
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[V]):
+    """容量受限的 LRU；``ttl`` 秒后条目视为过期（``None`` 表示永不过期）。"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                stored_at, value = entry  # type: ignore[misc]
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """读取但不计数、不调整 LRU 顺序。"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            stored_at, value = entry  # type: ignore[misc]
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                return default
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_TRAILING_PUNCT = " \t\r\n。．.，,！!？?；;：:…~～、"
+
+
+def normalize_query(text: str) -> str:
+    """缓存键用的查询归一化：NFKC、压缩空白、去掉首尾空白与句末标点。
+
+    "宝玉是谁？" 与 " 宝玉是谁 " 视为同一查询。
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = " ".join(text.split())
+    return text.strip(_TRAILING_PUNCT)
@@ -1,14 +1,32 @@
 """链路：检索 → 生成。
 
-`ChatEngine` 是纯 Python 接口，通过回调（chunk / log / context）
-向上层（Qt UI 或 CLI）汇报状态，不依赖 PySide6。
+`ChatEngine` 是纯 Python 接口，不依赖 PySide6：
+
+- ``astream``：协程接口，逐个产出 ``ChatEvent``（片段 / 整句 / 完成）。
+  LLM 走异步客户端，检索、工具等阻塞调用放进线程池，一个进程的一个事件循环
+  就能同时服务许多会话，不必每个会话占一个线程；
+- ``stream``：同步接口，通过回调（chunk / sentence）汇报，供 Qt 的
+  ``ChatWorker`` 与 CLI 使用；内部把 ``astream`` 交给常驻的后台事件循环执行。
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import queue
+import threading
 import uuid
-from typing import Annotated, Callable, Iterable, List, Optional, Sequence, TypedDict
+from dataclasses import dataclass
+from typing import (
+    Annotated,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    TypedDict,
+)
 
 from .logging_config import (
     configure_quiet_dependencies,
@@ -23,23 +41,42 @@ from langchain_core.messages import (
     AIMessage,
     BaseMessage,
     HumanMessage,
+    RemoveMessage,
     SystemMessage,
 )
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
 
+from .answer_cache import SemanticAnswerCache, build_answer_cache, iter_sentences
 from .config import (
     AgentConfig,
     ChatModelConfig,
     env_flag,
     get_agent_config,
+    get_answer_cache_config,
     get_chat_model_config,
+    get_conversation_config,
+    get_retrieval_config,
 )
+from .conversation_store import get_agent_histories, get_checkpointer, turn_start
 from .deepseek_agent import DeepSeekToolAgent
+from .embeddings import wait_for_embeddings
+from .history_window import window_start
+from .hot_reload import IndexReloader
+from .llm_usage import TurnUsage, UsageLog
 from .persona import load_system_prompt, offline_response
-from .rag import build_vector_store, format_context, retrieve_documents
+from .prefetch import RetrievalPrefetcher
+from .prompt_layout import agent_system_prompt, rag_system_prompt, with_context
+from .rag import (
+    build_vector_store,
+    bump_index_version,
+    format_context,
+    retrieval_available,
+    retrieve_documents,
+)
+from .tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +103,76 @@ def _noop(_: str) -> None:  # pragma: no cover
     pass
 
 
+@dataclass(frozen=True)
+class ChatEvent:
+    """``astream`` 产出的事件。
+
+    kind 为 "chunk"（LLM 输出片段，用于实时显示）、"sentence"（检测到句末
+    标点后的整句，用于按句送 TTS）或 "done"（最后一个事件，text 为完整回复）。
+    """
+
+    kind: str
+    text: str
+
+
+_END = object()
+
+
+class _Turn:
+    """一轮对话的逐轮状态：事件队列与切句缓冲。
+
+    原先这些状态挂在 ``ChatEngine`` 实例上，同一时刻只能跑一轮；
+    现在每轮一个对象，经 LangGraph 的 ``configurable`` 传给节点。
+    """
+
+    def __init__(self, thread_id: str) -> None:
+        self.thread_id = thread_id
+        self.events: "asyncio.Queue[object]" = asyncio.Queue()
+        self.sentence_buffer = ""
+        self.usage: Optional[TurnUsage] = None
+
+    def chunk(self, piece: str) -> None:
+        self.events.put_nowait(ChatEvent("chunk", piece))
+
+    def sentence(self, text: str) -> None:
+        self.events.put_nowait(ChatEvent("sentence", text))
+
+    def feed(self, piece: str) -> None:
+        """输出一个片段，攒到句末标点时切出整句。"""
+        self.chunk(piece)
+        self.sentence_buffer += piece
+        if any(p in piece for p in "。！？.!?"):
+            self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        text = self.sentence_buffer.strip()
+        if not text:
+            return
+        if force or any(p in text for p in "。！？.!?"):
+            self.sentence(text)
+            self.sentence_buffer = ""
+
+    def close(self) -> None:
+        self.events.put_nowait(_END)
+
+
+# 同步 stream() 共用的事件循环，在守护线程里常驻
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="ChatEngineLoop", daemon=True
+            ).start()
+            _loop = loop
+        return _loop
+
+
 # --------------------------------------------------------------------------- #
 # Chat engine
 # --------------------------------------------------------------------------- #
@@ -77,9 +184,6 @@ class ChatEngine:
     所有副作用都通过传入回调暴露，方便 Qt 信号桥接和 CLI 流式打印。
     """
 
-    # 跨实例复用 checkpointer，保证同一 thread_id 的多轮对话历史
-    _memory = MemorySaver()
-
     def __init__(
         self,
         config: Optional[ChatModelConfig] = None,
@@ -89,13 +193,20 @@ class ChatEngine:
         self.log = log
         self.config = config or get_chat_model_config()
         self.agent_config = agent_config or get_agent_config()
+        # 跨实例复用 checkpointer，保证同一 thread_id 的多轮对话历史；
+        # 默认存进 SQLite，重启后接着聊
+        self.conversation_config = get_conversation_config()
+        self._memory = get_checkpointer(self.conversation_config)
         self.llm: Optional[ChatOpenAI] = None
+        self.usage_log = UsageLog()
         if self.config.is_available:
             self.llm = ChatOpenAI(
                 api_key=self.config.api_key,
                 model=self.config.model,
                 base_url=self.config.base_url,
                 streaming=True,
+                # 最后一个分片带回 usage（含上下文缓存命中的 token 数）
+                stream_usage=True,
             )
             self.log(f"初始化 LLM: {self.config.model}")
         else:
@@ -103,7 +214,43 @@ class ChatEngine:
 
         self.vector_store = build_vector_store()
         if self.vector_store is None:
-            self.log("向量库不可用，将跳过 RAG 检索。")
+            if retrieval_available(None):
+                self.log("向量库不可用，检索将回退到词法索引。")
+            else:
+                self.log("向量库不可用，将跳过 RAG 检索。")
+        elif not wait_for_embeddings(
+            getattr(self.vector_store, "embeddings", None), timeout=0
+        ):
+            self.log("嵌入模型在后台加载中，就绪前检索将退回词法索引。")
+
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        answer_cfg = get_answer_cache_config()
+        if answer_cfg.enabled:
+            self.answer_cache = build_answer_cache(
+                getattr(self.vector_store, "embeddings", None), answer_cfg.threshold
+            )
+            if self.answer_cache is not None:
+                self.log(f"已载入 {len(self.answer_cache)} 条参考回答作为答案缓存。")
+
+        self.prefetcher: Optional[RetrievalPrefetcher] = None
+        if env_flag("DIGITAL_LDY_PREFETCH", True) and retrieval_available(
+            self.vector_store
+        ):
+            self.prefetcher = RetrievalPrefetcher(
+                self.vector_store, top_k=self._top_k
+            )
+
+        # load_kb（含 --watch）写出新一代索引后，后台换入，无需重启
+        self.reloader: Optional[IndexReloader] = None
+        reload_interval = get_retrieval_config().reload_interval
+        if reload_interval > 0 and retrieval_available(self.vector_store):
+            self.reloader = IndexReloader(
+                self.vector_store,
+                interval=reload_interval,
+                on_reload=lambda version: self.log(
+                    f"知识库已更新，已换入新一代索引（{version}）。"
+                ),
+            )
 
         self.tool_agent: Optional[DeepSeekToolAgent] = None
         if self.config.is_available and self.agent_config.enable_tool_calls:
@@ -113,6 +260,8 @@ class ChatEngine:
                     agent_config=self.agent_config,
                     vector_store=self.vector_store,
                     log=self.log,
+                    histories=get_agent_histories(self.conversation_config),
+                    conversation_config=self.conversation_config,
                 )
                 if self.tool_agent.enabled:
                     self.log("已启用 DeepSeek 多轮工具调用。")
@@ -138,16 +287,24 @@ class ChatEngine:
                 return msg.content
         return ""
 
-    def _node_retrieve(self, state: ChatState) -> dict:
+    async def _node_retrieve(self, state: ChatState) -> dict:
         query = self._latest_user_query(state)
         if not query:
             return {"context": []}
-        if self.vector_store is None:
-            return {"context": []}
+        # 向量检索是阻塞调用（嵌入接口 / numpy），放到线程池里
+        return {"context": await asyncio.to_thread(self._retrieve, query)}
+
+    def _retrieve(self, query: str) -> List[Document]:
         top_k = self._top_k()
-        docs = retrieve_documents(self.vector_store, query, top_k=top_k)
-        self.log(f"检索到 {len(docs)} 篇相关文档。")
-        return {"context": docs}
+        docs = None
+        if self.prefetcher is not None:
+            docs = self.prefetcher.take(query, top_k)
+        if docs is not None:
+            self.log(f"命中输入预取，检索到 {len(docs)} 篇相关文档。")
+        else:
+            docs = retrieve_documents(self.vector_store, query, top_k=top_k)
+            self.log(f"检索到 {len(docs)} 篇相关文档。")
+        return docs
 
     @staticmethod
     def _top_k() -> int:
@@ -158,48 +315,71 @@ class ChatEngine:
         except ValueError:
             return 3
 
-    def _node_generate(self, state: ChatState) -> dict:
+    async def _node_generate(self, state: ChatState, config: RunnableConfig) -> dict:
+        turn: _Turn = config["configurable"].get("chat_turn") or _Turn("")
         context_text = format_context(state["context"])
-        system_prompt = load_system_prompt()
-        # 仅保留 Human/AI 历史，避免重复注入 system
+        # 仅保留 Human/AI 历史，避免重复注入 system；超出轮数上限的旧消息从状态里删掉
+        start = turn_start(
+            state["messages"],
+            self.conversation_config.max_turns,
+            lambda m: isinstance(m, HumanMessage),
+        )
+        expired = [
+            RemoveMessage(id=m.id) for m in state["messages"][:start] if m.id
+        ]
         history = [
-            m for m in state["messages"] if not isinstance(m, SystemMessage)
+            m for m in state["messages"][start:] if not isinstance(m, SystemMessage)
+        ]
+        # 提示词里只放 token 预算内的最近几轮
+        history = history[
+            window_start(
+                history,
+                self.conversation_config.history_tokens,
+                lambda m: isinstance(m, HumanMessage),
+                lambda m: count_tokens(str(m.content)) + 4,
+            ) :
         ]
+        # 稳定前缀（人设 + 历史）在前，本轮检索上下文附在最后一条用户消息后，
+        # 只进本轮请求，不写回 state，下一轮的前缀仍与这一轮相同
+        if history and isinstance(history[-1], HumanMessage):
+            history[-1] = HumanMessage(
+                content=with_context(str(history[-1].content), context_text)
+            )
         messages: List[BaseMessage] = [
-            SystemMessage(
-                content=(
-                    f"{system_prompt}\n\n上下文信息如下:\n{context_text}\n\n"
-                    "请记住用户的话题并保持人物口吻。"
-                )
-            ),
+            SystemMessage(content=rag_system_prompt(load_system_prompt())),
             *history,
         ]
 
-        # 流式回调由调用方在 stream() 中处理；
+        # 片段与整句经 turn 的事件队列交给 astream() 的调用方；
         # 这里负责把最终消息写入 graph state（供 checkpointer 持久化）。
         if self.llm is None:
             response = offline_response(
                 self._latest_user_query(state), context_text
             )
-            self._on_chunk(response)
-            self._flush_sentence_buffer(force=True)
-            return {"messages": [AIMessage(content=response)]}
+            turn.feed(response)
+            turn.flush(force=True)
+            return {"messages": [*expired, AIMessage(content=response)]}
 
         response_text = ""
+        usage = turn.usage
+        t0 = usage.request_started() if usage is not None else 0.0
+        reported = None
         try:
-            for chunk in self.llm.stream(messages):
+            async for chunk in self.llm.astream(messages):
+                reported = chunk.usage_metadata or reported
                 piece = chunk.content or ""
                 if not piece:
                     continue
+                if usage is not None:
+                    usage.first_token(t0)
                 response_text += piece
-                self._on_chunk(piece)
-                self._sentence_buffer += piece
-                if any(p in piece for p in "。！？.!?"):
-                    self._flush_sentence_buffer()
-            self._flush_sentence_buffer(force=True)
+                turn.feed(piece)
+            turn.flush(force=True)
         except Exception as e:
             self.log(f"LLM 生成时出错: {e}")
             response_text = response_text or f"生成回答时出错: {e}"
+        if usage is not None:
+            usage.request_finished(t0, reported)
 
         # 可选：将 AI 回复写回向量库（默认关闭，防止污染检索）
         if (
@@ -207,24 +387,51 @@ class ChatEngine:
             and env_flag("DIGITAL_LDY_STORE_AI_RESPONSE", False)
             and response_text
         ):
-            try:
-                self.vector_store.add_texts(
-                    texts=[response_text],
-                    metadatas=[
-                        {
-                            "type": "ai_response",
-                            "user_query": self._latest_user_query(state)[:200],
-                        }
-                    ],
-                    ids=[f"ai_response_{uuid.uuid4().hex}"],
-                )
-            except Exception as e:
-                self.log(f"存储 AI 回复时出错: {e}")
+            await asyncio.to_thread(
+                self._store_ai_response, self._latest_user_query(state), response_text
+            )
+
+        return {"messages": [*expired, AIMessage(content=response_text)]}
 
-        return {"messages": [AIMessage(content=response_text)]}
+    def _store_ai_response(self, user_query: str, response_text: str) -> None:
+        try:
+            self.vector_store.add_texts(
+                texts=[response_text],
+                metadatas=[{"type": "ai_response", "user_query": user_query[:200]}],
+                ids=[f"ai_response_{uuid.uuid4().hex}"],
+            )
+            bump_index_version()
+        except Exception as e:
+            self.log(f"存储 AI 回复时出错: {e}")
 
     # --------------------------- public API --------------------------- #
 
+    def prefetch(self, draft: str) -> None:
+        """用户输入草稿变化时调用：后台预热查询向量与检索缓存，立即返回。"""
+        if self.prefetcher is not None:
+            self.prefetcher.submit(draft)
+
+    async def astream(
+        self, user_message: str, thread_id: str = "default"
+    ) -> AsyncIterator[ChatEvent]:
+        """异步流式处理一条用户消息，逐个产出 ``ChatEvent``，最后一个是 "done"。
+
+        可在同一事件循环里并发调用（不同 thread_id）；调用方提前退出迭代时，
+        本轮生成随之取消。同一 thread_id 的多轮需由调用方串行。
+        """
+        turn = _Turn(thread_id)
+        task = asyncio.ensure_future(self._arun_turn(user_message, turn))
+        try:
+            while True:
+                event = await turn.events.get()
+                if event is _END:
+                    break
+                yield event
+            yield ChatEvent("done", await task)
+        finally:
+            if not task.done():
+                task.cancel()
+
     def stream(
         self,
         user_message: str,
@@ -232,61 +439,151 @@ class ChatEngine:
         on_chunk: ChunkFn = _noop,
         on_sentence: SentenceFn = _noop,
     ) -> str:
-        """以流式方式处理一条用户消息，返回完整回复字符串。
+        """以流式方式处理一条用户消息，返回完整回复字符串（阻塞）。
+
+        ``astream`` 的同步包装：协程跑在共用的后台事件循环里，
+        回调仍在调用方线程触发。
 
         Parameters
         ----------
         on_chunk    : 每收到 LLM 输出片段时触发（用于 UI 实时显示）
         on_sentence : 检测到句末标点时触发（用于按句送 TTS）
         """
-        self._on_chunk = on_chunk or _noop
-        self._on_sentence = on_sentence or _noop
-        self._sentence_buffer = ""
+        events: "queue.Queue[object]" = queue.Queue()
 
-        if self.tool_agent is not None and self.tool_agent.enabled:
+        async def pump() -> None:
             try:
-                return self.tool_agent.stream(
-                    user_message=user_message,
-                    thread_id=thread_id,
-                    system_prompt=self._build_agent_system_prompt(),
-                    on_chunk=self._on_chunk,
-                    on_sentence=self._on_sentence,
-                )
-            except Exception as e:
-                self.log(f"DeepSeek 工具链出错，回退普通 RAG: {e}")
-                self._sentence_buffer = ""
-
-        config = {"configurable": {"thread_id": thread_id}}
-        initial: ChatState = {
-            "messages": [HumanMessage(content=user_message)],
-            "context": [],
-        }
-        final_state = self.graph.invoke(initial, config)
-
-        # 取最后一条 AIMessage 作为完整回复
-        for msg in reversed(final_state["messages"]):
-            if isinstance(msg, AIMessage):
-                return msg.content
-        return ""
-
-    def _build_agent_system_prompt(self) -> str:
-        base_prompt = load_system_prompt()
-        return (
-            f"{base_prompt}\n\n"
-            "# 可用工具说明 #\n"
-            "你可以调用 search_knowledge_base 在本地知识库中查找人物、情节、诗词、过往对话和风格样例。"
-            "凡用户询问《红楼梦》情节、人物关系、诗词、林黛玉身世、潇湘馆生活，"
-            "或你觉得需要更贴合原著与知识库材料时，应先调用此工具；普通寒暄可不调用。\n\n"
-            "# 回答要求 #\n"
-            "工具结果只作你的内在参照，不要像论文一样罗列来源。"
-            "最终回复要像林黛玉自然开口：先有情绪与场景，再给回答；"
-            "可点到诗意意象，但不要堆砌辞藻；可轻嗔、含蓄、敏感，却不要机械拒绝。"
-        )
-
-    def _flush_sentence_buffer(self, force: bool = False) -> None:
-        text = self._sentence_buffer.strip()
-        if not text:
+                async for event in self.astream(user_message, thread_id):
+                    events.put(event)
+            except BaseException as e:  # 连同取消一起转交给调用方线程
+                events.put(e)
+                raise
+            finally:
+                events.put(_END)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), _background_loop())
+        response = ""
+        try:
+            while True:
+                event = events.get()
+                if event is _END:
+                    break
+                if isinstance(event, BaseException):
+                    raise event
+                if event.kind == "chunk":
+                    (on_chunk or _noop)(event.text)
+                elif event.kind == "sentence":
+                    (on_sentence or _noop)(event.text)
+                else:
+                    response = event.text
+        finally:
+            future.cancel()
+        return response
+
+    def close(self) -> None:
+        """停止后台预取、索引换入与历史摘要线程；界面关闭、服务退出时调用。"""
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.reloader is not None:
+            self.reloader.close()
+        if self.tool_agent is not None:
+            self.tool_agent.close()
+
+    async def _arun_turn(self, user_message: str, turn: _Turn) -> str:
+        try:
+            cached = await self._astream_cached_answer(user_message, turn)
+            if cached is not None:
+                return cached
+
+            thread_id = turn.thread_id
+            if self.tool_agent is not None and self.tool_agent.enabled:
+                turn.usage = self.usage_log.begin(thread_id, "agent")
+                try:
+                    response = await self.tool_agent.astream(
+                        user_message=user_message,
+                        thread_id=thread_id,
+                        system_prompt=agent_system_prompt(load_system_prompt()),
+                        on_chunk=turn.chunk,
+                        on_sentence=turn.sentence,
+                        usage=turn.usage,
+                    )
+                    self._finish_usage(turn)
+                    self._log_cache_stats()
+                    return response
+                except Exception as e:
+                    self._finish_usage(turn)
+                    self.log(f"DeepSeek 工具链出错，回退普通 RAG: {e}")
+                    turn.sentence_buffer = ""
+
+            # 本轮对象放进 configurable（非基本类型不会写进 checkpoint 元数据）
+            config = {"configurable": {"thread_id": thread_id, "chat_turn": turn}}
+            initial: ChatState = {
+                "messages": [HumanMessage(content=user_message)],
+                "context": [],
+            }
+            turn.usage = self.usage_log.begin(thread_id, "rag")
+            try:
+                final_state = await self.graph.ainvoke(initial, config)
+            finally:
+                self._finish_usage(turn)
+            self._log_cache_stats()
+
+            # 取最后一条 AIMessage 作为完整回复
+            for msg in reversed(final_state["messages"]):
+                if isinstance(msg, AIMessage):
+                    return msg.content
+            return ""
+        finally:
+            turn.close()
+
+    async def _astream_cached_answer(self, user_message: str, turn: _Turn) -> Optional[str]:
+        """命中参考回答时按句流式输出并写入对话历史，返回回答；未命中返回 None。"""
+        if self.answer_cache is None:
+            return None
+        hit = await asyncio.to_thread(self.answer_cache.lookup, user_message)
+        if hit is None:
+            return None
+        self.log(f"命中参考回答（相似度 {hit.score:.3f}），跳过 LLM。")
+        answer = hit.pair.answer
+        for piece in iter_sentences(answer):
+            turn.chunk(piece)
+            turn.sentence_buffer += piece
+            turn.flush()
+        turn.flush(force=True)
+
+        # 两条链路各有各的历史，都补上这一轮，后续追问才接得上
+        if self.tool_agent is not None:
+            await asyncio.to_thread(
+                self.tool_agent.record_turn, turn.thread_id, user_message, answer
+            )
+        try:
+            await self.graph.aupdate_state(
+                {"configurable": {"thread_id": turn.thread_id}},
+                {
+                    "messages": [
+                        HumanMessage(content=user_message),
+                        AIMessage(content=answer),
+                    ]
+                },
+                as_node="generate",
+            )
+        except Exception as e:
+            self.log(f"写入对话历史失败: {e}")
+        self._log_cache_stats()
+        return answer
+
+    def _log_cache_stats(self) -> None:
+        embeddings = getattr(self.vector_store, "embeddings", None)
+        describe = getattr(embeddings, "describe_stats", None)
+        if describe is not None:
+            self.log(describe())
+        if self.answer_cache is not None:
+            self.log(self.answer_cache.describe_stats())
+
+    def _finish_usage(self, turn: _Turn) -> None:
+        """记录本轮 LLM 用量并打一行日志（提示词、缓存命中、首字延迟）。"""
+        usage, turn.usage = turn.usage, None
+        if usage is None or not usage.requests:
             return
-        if force or any(p in text for p in "。！？.!?"):
-            self._on_sentence(text)
-            self._sentence_buffer = ""
+        self.usage_log.finish(usage)
+        self.log(usage.describe())
@@ -35,6 +35,22 @@ def env_flag(name: str, default: bool = True) -> bool:
     return value.lower() not in {"0", "false", "no", "off", "disabled"}
 
 
+def _int_env(name: str, default: int) -> int:
+    """读取整数；未设置或不是合法整数时返回 ``default``。"""
+    try:
+        return int(_clean_env(name) or default)
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    """读取浮点数；未设置或不是合法数字时返回 ``default``。"""
+    try:
+        return float(_clean_env(name) or default)
+    except ValueError:
+        return default
+
+
 # --------------------------------------------------------------------------- #
 # Chat LLM
 # --------------------------------------------------------------------------- #
@@ -90,17 +106,8 @@ class AgentConfig:
 
 
 def get_agent_config() -> AgentConfig:
-    try:
-        max_tool_rounds = int(_clean_env("DIGITAL_LDY_MAX_TOOL_ROUNDS") or "4")
-    except ValueError:
-        max_tool_rounds = 4
-    max_tool_rounds = max(1, min(8, max_tool_rounds))
-
-    try:
-        stream_delay_ms = int(_clean_env("DIGITAL_LDY_STREAM_DELAY_MS") or "10")
-    except ValueError:
-        stream_delay_ms = 10
-    stream_delay_ms = max(0, min(80, stream_delay_ms))
+    max_tool_rounds = max(1, min(8, _int_env("DIGITAL_LDY_MAX_TOOL_ROUNDS", 4)))
+    stream_delay_ms = max(0, min(80, _int_env("DIGITAL_LDY_STREAM_DELAY_MS", 10)))
 
     effort = (_clean_env("DEEPSEEK_REASONING_EFFORT") or "high").lower()
     if effort not in {"high", "max"}:
@@ -115,6 +122,114 @@ def get_agent_config() -> AgentConfig:
     )
 
 
+# --------------------------------------------------------------------------- #
+# 参考回答缓存
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True)
+class AnswerCacheConfig:
+    """用户消息与 ``参考回答.txt`` 中某个问题足够相近时，直接给出精选回答、跳过 LLM。
+
+    threshold 是问题向量的余弦相似度下限；越高越保守，误命中越少。
+    """
+
+    enabled: bool = True
+    threshold: float = 0.92
+
+
+def get_answer_cache_config() -> AnswerCacheConfig:
+    threshold = _float_env("DIGITAL_LDY_ANSWER_CACHE_THRESHOLD", 0.92)
+    return AnswerCacheConfig(
+        enabled=env_flag("DIGITAL_LDY_ANSWER_CACHE", True),
+        threshold=max(0.0, min(1.0, threshold)),
+    )
+
+
+# --------------------------------------------------------------------------- #
+# 对话历史
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True)
+class ConversationConfig:
+    """LangGraph checkpointer 与 DeepSeek 工具链的对话历史存储。
+
+    persist 为 True 时存进 path 处的 SQLite（WAL），重启后同一 thread_id 接着聊；
+    写入在后台线程每隔 flush_interval 秒合批落盘，不占流式输出的时间。
+    内存里最多保留 cache_threads 个会话，其余在下次访问时再从磁盘读入；
+    每个会话只保留最近 max_turns 轮（以用户消息计），0 表示不截断。
+
+    每轮送进提示词的历史不超过 history_tokens（0 不限）：最近几轮原样保留，
+    更早的轮次在回复结束后由后台线程折叠进不超过 summary_tokens 的滚动摘要
+    （summarize 关闭时直接省略）。
+    """
+
+    persist: bool = True
+    path: str = "./knowledge_base/conversations.sqlite3"
+    max_turns: int = 50
+    cache_threads: int = 32
+    flush_interval: float = 0.5
+    history_tokens: int = 3000
+    summarize: bool = True
+    summary_tokens: int = 400
+
+
+def get_conversation_config() -> ConversationConfig:
+    return ConversationConfig(
+        persist=env_flag("DIGITAL_LDY_CONVERSATION_PERSIST", True),
+        path=_clean_env("DIGITAL_LDY_CONVERSATION_PATH")
+        or "./knowledge_base/conversations.sqlite3",
+        max_turns=max(0, _int_env("DIGITAL_LDY_CONVERSATION_MAX_TURNS", 50)),
+        cache_threads=max(1, _int_env("DIGITAL_LDY_CONVERSATION_CACHE_THREADS", 32)),
+        flush_interval=max(
+            0.05, _float_env("DIGITAL_LDY_CONVERSATION_FLUSH_INTERVAL", 0.5)
+        ),
+        history_tokens=max(0, _int_env("DIGITAL_LDY_HISTORY_TOKENS", 3000)),
+        summarize=env_flag("DIGITAL_LDY_HISTORY_SUMMARY", True),
+        summary_tokens=max(50, _int_env("DIGITAL_LDY_HISTORY_SUMMARY_TOKENS", 400)),
+    )
+
+
+# --------------------------------------------------------------------------- #
+# 无界面 HTTP / SSE 服务
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """``scripts/serve.py`` 的 HTTP / SSE 服务（自助终端、网页前端）。
+
+    同时生成的轮次不超过 max_concurrent，其余最多 max_queue 个排队等待
+    queue_timeout 秒，超出即返回 503；同一 thread_id 同时只能有一轮。
+    客户端读得太慢时，写缓冲超过 send_buffer 字节就暂停发送，
+    send_timeout 秒仍写不出去则断开连接并取消这一轮。
+    tts 为 True 且配置了 TTS 后端时，逐句合成语音并推送音频链接。
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8765
+    max_concurrent: int = 16
+    max_queue: int = 64
+    queue_timeout: float = 10.0
+    send_timeout: float = 15.0
+    send_buffer: int = 64 * 1024
+    tts: bool = True
+
+
+def get_server_config() -> ServerConfig:
+    return ServerConfig(
+        host=_clean_env("DIGITAL_LDY_SERVER_HOST") or "127.0.0.1",
+        port=_int_env("DIGITAL_LDY_SERVER_PORT", 8765),
+        max_concurrent=max(1, _int_env("DIGITAL_LDY_SERVER_MAX_CONCURRENT", 16)),
+        max_queue=max(0, _int_env("DIGITAL_LDY_SERVER_MAX_QUEUE", 64)),
+        queue_timeout=max(0.1, _float_env("DIGITAL_LDY_SERVER_QUEUE_TIMEOUT", 10.0)),
+        send_timeout=max(0.1, _float_env("DIGITAL_LDY_SERVER_SEND_TIMEOUT", 15.0)),
+        send_buffer=max(1024, _int_env("DIGITAL_LDY_SERVER_SEND_BUFFER", 64 * 1024)),
+        tts=env_flag("DIGITAL_LDY_SERVER_TTS", True),
+    )
+
+
 # --------------------------------------------------------------------------- #
 # 通用：DashScope
 # --------------------------------------------------------------------------- #
@@ -144,10 +259,21 @@ class EmbeddingConfig:
       - "dashscope" : 使用 DashScope text-embedding-vX（需要 API key）
       - "fastembed" : 本地 ONNX 模型（首次会下载 ~90MB）
       - "auto"      : 有 DashScope key 走云端，否则走本地
+
+    DashScope 客户端最多 concurrency 个请求同时在途，每秒不超过 rps 个请求
+    （0 不限），可重试的失败（连接错误、429、5xx）重试 max_retries 次。
     """
 
     backend: str
     model: str
+    cache_enabled: bool = True   # 查询向量两级缓存（内存 LRU + 磁盘 SQLite）
+    cache_path: str = "./knowledge_base/embedding_cache.sqlite3"
+    cache_size: int = 2048       # 内存 LRU 条数
+    background_load: bool = True  # 后台线程加载并预热模型
+    chunk_store_enabled: bool = True  # 块向量按 (模型, 文本 md5) 持久复用，存于 cache_path
+    concurrency: int = 4
+    rps: float = 10.0
+    max_retries: int = 3
 
 
 def get_embedding_config() -> EmbeddingConfig:
@@ -158,7 +284,164 @@ def get_embedding_config() -> EmbeddingConfig:
         model = _clean_env("DASHSCOPE_EMBEDDING_MODEL") or "text-embedding-v3"
     else:
         model = _clean_env("FASTEMBED_MODEL") or "BAAI/bge-small-zh-v1.5"
-    return EmbeddingConfig(backend=backend, model=model)
+    return EmbeddingConfig(
+        backend=backend,
+        model=model,
+        cache_enabled=env_flag("DIGITAL_LDY_EMBED_CACHE", True),
+        cache_path=_clean_env("DIGITAL_LDY_EMBED_CACHE_PATH")
+        or "./knowledge_base/embedding_cache.sqlite3",
+        cache_size=max(1, _int_env("DIGITAL_LDY_EMBED_CACHE_SIZE", 2048)),
+        background_load=env_flag("DIGITAL_LDY_EMBED_BACKGROUND", True),
+        chunk_store_enabled=env_flag("DIGITAL_LDY_CHUNK_EMBED_STORE", True),
+        concurrency=max(1, _int_env("DASHSCOPE_EMBED_CONCURRENCY", 4)),
+        rps=max(0.0, _float_env("DASHSCOPE_EMBED_RPS", 10.0)),
+        max_retries=max(0, _int_env("DASHSCOPE_EMBED_RETRIES", 3)),
+    )
+
+
+# --------------------------------------------------------------------------- #
+# Vector store
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    """向量库后端与检索模式。
+
+    vector_backend:
+      - "numpy"  : 进程内 float32 矩阵 + 精确 top-k（知识库只有几百块时最快）
+      - "chroma" : 持久化 Chroma（SQLite）
+      - "snapshot": 只读、内存映射的单文件索引快照（``knowledge_base/index.snapshot``，适合打包）
+      - "auto"   : 已有 Chroma 库而没有 numpy 索引时沿用 Chroma；只有快照时用快照；否则用 numpy
+
+    mode:
+      - "hybrid"  : 稠密 + 二元组 BM25，倒数排名融合（RRF）
+      - "dense"   : 只用向量检索
+      - "lexical" : 只用 BM25
+      任何模式下嵌入后端不可用时都会回退到 BM25。
+
+    embed_wait_timeout: 后台加载的嵌入模型尚未就绪时，检索最多等待的秒数；
+      超时则本次只用 BM25。
+
+    context_tokens: 每次检索注入提示词（system 上下文或工具结果）的 token 预算，
+      相邻块合并、重叠去重后按排名装填；0 表示不限。
+
+    reload_interval: 运行中的对话引擎每隔多少秒检查一次索引版本，
+      变了就在后台载入新一代索引并原子换入；0 表示不热加载。
+    """
+
+    vector_backend: str
+    mode: str = "hybrid"
+    tool_cache_size: int = 256       # 工具检索结果 LRU 条数，0 表示关闭
+    tool_cache_ttl: float = 600.0    # 秒
+    context_tokens: int = 1500
+    embed_wait_timeout: float = 1.0
+    reload_interval: float = 2.0
+
+
+def get_retrieval_config() -> RetrievalConfig:
+    backend = (_clean_env("VECTOR_BACKEND") or "auto").lower()
+    if backend not in {"auto", "numpy", "chroma", "snapshot"}:
+        backend = "auto"
+    mode = (_clean_env("DIGITAL_LDY_RETRIEVAL_MODE") or "hybrid").lower()
+    if mode not in {"hybrid", "dense", "lexical"}:
+        mode = "hybrid"
+    return RetrievalConfig(
+        vector_backend=backend,
+        mode=mode,
+        tool_cache_size=max(0, _int_env("DIGITAL_LDY_TOOL_CACHE_SIZE", 256)),
+        tool_cache_ttl=max(1.0, _float_env("DIGITAL_LDY_TOOL_CACHE_TTL", 600.0)),
+        context_tokens=max(0, _int_env("DIGITAL_LDY_CONTEXT_TOKENS", 1500)),
+        embed_wait_timeout=max(0.0, _float_env("DIGITAL_LDY_EMBED_WAIT", 1.0)),
+        reload_interval=max(0.0, _float_env("DIGITAL_LDY_INDEX_RELOAD_INTERVAL", 2.0)),
+    )
+
+
+@dataclass(frozen=True)
+class QuantizationConfig:
+    """numpy 索引的降维 / 量化（只影响检索，写入与落盘的仍是完整 float32 向量）。
+
+    codes:
+      - "none"   : 不量化，直接在 float32 矩阵上精确检索
+      - "int8"   : 每维一个缩放系数的 int8 编码，内存为 float32 的 1/4
+      - "binary" : 每维 1 bit 的符号编码，内存为 1/32，按汉明距离粗排
+
+    dims 为 0 时不降维，否则先投影到前 dims 维（projection="truncate"）
+    或语料的主成分上（projection="pca"）再编码。量化后粗排在紧凑编码上
+    取 k × rescore 个候选，再用内存映射的 float32 向量精排；rescore 为 0
+    时按编码取默认值（int8 4 倍、binary 10 倍）。
+    """
+
+    codes: str = "none"
+    dims: int = 0
+    projection: str = "truncate"
+    rescore: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.codes != "none"
+
+
+def get_quantization_config() -> QuantizationConfig:
+    codes = (_clean_env("DIGITAL_LDY_VECTOR_CODES") or "none").lower()
+    if codes not in {"none", "int8", "binary"}:
+        codes = "none"
+    projection = (_clean_env("DIGITAL_LDY_VECTOR_PROJECTION") or "truncate").lower()
+    if projection not in {"truncate", "pca"}:
+        projection = "truncate"
+    return QuantizationConfig(
+        codes=codes,
+        dims=max(0, _int_env("DIGITAL_LDY_VECTOR_DIMS", 0)),
+        projection=projection,
+        rescore=max(0, _int_env("DIGITAL_LDY_VECTOR_RESCORE", 0)),
+    )
+
+
+# --------------------------------------------------------------------------- #
+# 知识库入库
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True)
+class IngestConfig:
+    """入库流水线：流式读取（加载 + 切分）→ 嵌入（并发 + 限速）→ 单写入线程。
+
+    embed_concurrency / embed_batch_size / embed_rps 为 0 时按嵌入后端取默认值：
+    DashScope 客户端自己并发、限速（见 ``EmbeddingConfig``），流水线两路送批即可；
+    FastEmbed 是本地 ONNX，单路大批量更划算。
+
+    大文件按 segment_chars 分段读入；每写满 checkpoint_chunks 块或每隔
+    checkpoint_seconds 秒（在文件边界上）保存一次检查点，0 表示不按该条件保存。
+    嵌入失败的批次按指数退避重试 embed_retries 次，仍失败则逐条嵌入。
+    """
+
+    load_workers: int = 4
+    split_workers: int = 0        # 0：按 CPU 核数；语料很小时在线程内直接切分
+    embed_concurrency: int = 0
+    embed_batch_size: int = 0
+    embed_rps: float = 0.0        # 每秒嵌入请求数上限
+    queue_size: int = 8           # 各级队列容量（背压）
+    segment_chars: int = 200_000  # 每段读入的字符数上限（在空行处断开）
+    checkpoint_chunks: int = 2000
+    checkpoint_seconds: float = 60.0
+    embed_retries: int = 2        # 嵌入失败后的重试次数，之后整批改为逐条嵌入
+
+
+def get_ingest_config() -> IngestConfig:
+    return IngestConfig(
+        load_workers=max(1, _int_env("DIGITAL_LDY_INGEST_LOAD_WORKERS", 4)),
+        split_workers=max(0, _int_env("DIGITAL_LDY_INGEST_SPLIT_WORKERS", 0)),
+        embed_concurrency=max(0, _int_env("DIGITAL_LDY_INGEST_EMBED_CONCURRENCY", 0)),
+        embed_batch_size=max(0, _int_env("DIGITAL_LDY_INGEST_EMBED_BATCH", 0)),
+        embed_rps=max(0.0, _float_env("DIGITAL_LDY_INGEST_EMBED_RPS", 0.0)),
+        queue_size=max(1, _int_env("DIGITAL_LDY_INGEST_QUEUE_SIZE", 8)),
+        segment_chars=max(10_000, _int_env("DIGITAL_LDY_INGEST_SEGMENT_CHARS", 200_000)),
+        checkpoint_chunks=max(0, _int_env("DIGITAL_LDY_INGEST_CHECKPOINT_CHUNKS", 2000)),
+        checkpoint_seconds=max(
+            0.0, _float_env("DIGITAL_LDY_INGEST_CHECKPOINT_SECONDS", 60.0)
+        ),
+        embed_retries=max(0, _int_env("DIGITAL_LDY_INGEST_EMBED_RETRIES", 2)),
+    )
 
 
 # --------------------------------------------------------------------------- #
@@ -239,16 +522,6 @@ def get_gpt_sovits_config() -> GPTSoVITSConfig:
         default_python = _sys.executable
     python_exe = _clean_env("GPT_SOVITS_PYTHON") or default_python
 
-    try:
-        port = int(_clean_env("GPT_SOVITS_PORT") or "9880")
-    except ValueError:
-        port = 9880
-
-    try:
-        startup_timeout = int(_clean_env("GPT_SOVITS_STARTUP_TIMEOUT") or "60")
-    except ValueError:
-        startup_timeout = 60
-
     default_ffmpeg = os.path.join(project_dir, "runtime", "ffmpeg", "bin")
     ffmpeg_bin = _clean_env("GPT_SOVITS_FFMPEG_BIN") or (
         default_ffmpeg if os.path.isdir(default_ffmpeg) else None
@@ -258,7 +531,7 @@ def get_gpt_sovits_config() -> GPTSoVITSConfig:
         project_dir=project_dir,
         python_exe=python_exe,
         host=_clean_env("GPT_SOVITS_HOST") or "127.0.0.1",
-        port=port,
+        port=_int_env("GPT_SOVITS_PORT", 9880),
         config_file=_clean_env("GPT_SOVITS_CONFIG")
         or "GPT_SoVITS/configs/tts_infer.yaml",
         gpt_weights=_clean_env("GPT_SOVITS_GPT_WEIGHTS")
@@ -271,5 +544,5 @@ def get_gpt_sovits_config() -> GPTSoVITSConfig:
         prompt_lang=_clean_env("GPT_SOVITS_PROMPT_LANG") or "zh",
         auto_start=env_flag("GPT_SOVITS_AUTO_START", True),
         ffmpeg_bin=ffmpeg_bin,
-        startup_timeout=startup_timeout,
+        startup_timeout=_int_env("GPT_SOVITS_STARTUP_TIMEOUT", 60),
     )
@@ -0,0 +1,211 @@
+"""按 token 预算打包检索结果。
+
+切分器用 500/50 的重叠窗口，同一源文件相邻的两块常常一起命中，
+直接拼接会把重叠的几十个字重复送进提示词；而固定字符截断又可能
+把排在后面的命中整段挤掉。这里按排名依次处理命中：
+
+1. 与已选内容（去空白后）完全包含的块视为重复，直接丢弃；
+2. 同一源文件中 ``chunk_index`` 相邻的块合并成一段，去掉首尾重叠；
+3. 按排名累加 token，超出预算的那一块截断到剩余额度，此后的块跳过。
+
+token 数优先取入库时写进 metadata 的 ``tokens``，旧索引没有时现算。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from .tokens import count_tokens, truncate_to_tokens
+
+# 非相邻块之间只有足够长的首尾重叠才算重复
+_MIN_LOOSE_OVERLAP = 16
+# 切分器重叠 50 字；留足余量，同时限制逐位比较的开销
+_MAX_OVERLAP = 200
+# 剩余预算太少时不再截断塞入（半句话对模型没有帮助）
+_MIN_TRUNCATED_TOKENS = 32
+
+ELLIPSIS = "…"
+
+
+@dataclass
+class PackedSpan:
+    """打包后的一段上下文：来自同一源文件的一个或多个相邻块。"""
+
+    source: str
+    rank: int                      # 段内最靠前的命中排名（从 1 开始）
+    text: str
+    tokens: int
+    chunk_ids: List[str] = field(default_factory=list)
+    first_index: Optional[int] = None
+    last_index: Optional[int] = None
+    truncated: bool = False
+
+
+def _compact(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _overlap(left: str, right: str, min_chars: int = 1) -> int:
+    """``left`` 的后缀与 ``right`` 的前缀最长相同部分的长度。"""
+    upper = min(len(left), len(right), _MAX_OVERLAP)
+    for k in range(upper, min_chars - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def _chunk_index(doc: Document) -> Optional[int]:
+    value = doc.metadata.get("chunk_index")
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _doc_tokens(doc: Document, text: str) -> int:
+    # 入库时按原文计的 token 数；压缩空白后只会更少，可作上界
+    value = doc.metadata.get("tokens")
+    if isinstance(value, int) and value >= 0:
+        return value
+    return count_tokens(text)
+
+
+def pack_documents(
+    docs: Sequence[Document],
+    max_tokens: int,
+    compact: bool = False,
+) -> List[PackedSpan]:
+    """按排名把 ``docs`` 装进 ``max_tokens`` 的预算（<=0 表示不限）。
+
+    ``compact=True`` 时先把空白压成单个空格（工具 JSON 用）。
+    返回的段按最靠前的命中排名排序。
+    """
+    spans: List[PackedSpan] = []
+    used = 0
+    budget = max_tokens if max_tokens > 0 else None
+
+    for rank, doc in enumerate(docs, start=1):
+        if budget is not None and budget - used <= 0:
+            break
+        raw = doc.page_content or ""
+        text = _compact(raw) if compact else raw.strip()
+        if not text:
+            continue
+        probe = text if compact else _compact(text)
+        if any(probe in _compact(span.text) for span in spans):
+            continue
+
+        source = str(doc.metadata.get("source") or "unknown").replace("\\", "/")
+        index = _chunk_index(doc)
+        doc_id = doc.id or ""
+
+        target, position, trimmed = _attach(spans, source, index, text)
+        if trimmed is None:
+            continue
+        cost = (
+            _doc_tokens(doc, text) if trimmed == text else count_tokens(trimmed)
+        )
+        truncated = False
+        if budget is not None and used + cost > budget:
+            remaining = budget - used
+            if remaining < _MIN_TRUNCATED_TOKENS or position == "before":
+                continue
+            trimmed = truncate_to_tokens(trimmed, remaining - 1).rstrip() + ELLIPSIS
+            cost = remaining
+            truncated = True
+        used += cost
+
+        if target is None:
+            spans.append(
+                PackedSpan(
+                    source=source,
+                    rank=rank,
+                    text=trimmed,
+                    tokens=cost,
+                    chunk_ids=[doc_id],
+                    first_index=index,
+                    last_index=index,
+                    truncated=truncated,
+                )
+            )
+            continue
+
+        target.tokens += cost
+        target.truncated = target.truncated or truncated
+        if position == "after":
+            target.text += trimmed
+            target.chunk_ids.append(doc_id)
+            if index is not None:
+                target.last_index = index
+            _bridge(spans, target)
+        else:
+            target.text = trimmed + target.text
+            target.chunk_ids.insert(0, doc_id)
+            if index is not None:
+                target.first_index = index
+
+    spans.sort(key=lambda span: span.rank)
+    return spans
+
+
+def _attach(spans: List[PackedSpan], source: str, index: Optional[int], text: str):
+    """找到可以与当前块合并的段。
+
+    返回 ``(span, "after"|"before"|None, 去掉重叠后的文本)``；
+    文本为 None 表示新内容全被已有段覆盖。
+    """
+    for span in spans:
+        if span.source != source or span.truncated:
+            continue
+        adjacent_after = (
+            index is not None and span.last_index is not None
+            and index == span.last_index + 1
+        )
+        adjacent_before = (
+            index is not None and span.first_index is not None
+            and index == span.first_index - 1
+        )
+        min_chars = 1 if adjacent_after else _MIN_LOOSE_OVERLAP
+        k = _overlap(span.text, text, min_chars)
+        if adjacent_after or (index is None and k):
+            rest = text[k:]
+            if not rest.strip():
+                return span, None, None
+            return span, "after", rest if k else "\n" + rest
+        min_chars = 1 if adjacent_before else _MIN_LOOSE_OVERLAP
+        k = _overlap(text, span.text, min_chars)
+        if adjacent_before or (index is None and k):
+            head = text[: len(text) - k]
+            if not head.strip():
+                return span, None, None
+            return span, "before", head if k else head + "\n"
+    return None, None, text
+
+
+def _bridge(spans: List[PackedSpan], span: PackedSpan) -> None:
+    """当前段尾部与另一段头部相邻时把两段连起来。"""
+    if span.last_index is None or span.truncated:
+        return
+    for other in spans:
+        if (
+            other is not span
+            and other.source == span.source
+            and other.first_index == span.last_index + 1
+        ):
+            k = _overlap(span.text, other.text)
+            rest = other.text[k:] if k else "\n" + other.text
+            span.text += rest
+            span.tokens += other.tokens - (count_tokens(other.text[:k]) if k else 0)
+            span.chunk_ids.extend(other.chunk_ids)
+            span.last_index = other.last_index
+            span.truncated = other.truncated
+            span.rank = min(span.rank, other.rank)
+            spans.remove(other)
+            return
+
+
+def packed_tokens(spans: Sequence[PackedSpan]) -> int:
+    return sum(span.tokens for span in spans)
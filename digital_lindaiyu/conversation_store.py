@@ -0,0 +1,517 @@
+"""持久化的对话历史：SQLite（WAL）+ 后台合批写入 + 按需载入。
+
+对话历史原先只在进程内存里：LangGraph 链路用 ``MemorySaver``，DeepSeek
+工具链路用 ``DeepSeekToolAgent.histories`` 字典，重启即丢，长时间运行也只增不减。
+这里把两条链路的历史存进同一个 SQLite 文件：
+
+- ``ConversationStore``：写入只进内存里的待写表（同键覆盖），后台线程每隔
+  ``flush_interval`` 秒在一个事务里落盘，流式输出不等磁盘；
+- ``PersistentSaver``：``InMemorySaver`` 的子类，某个 thread_id 第一次被访问时
+  才从磁盘读入；每个命名空间只保留最新一个 checkpoint 及其引用的通道值；
+- ``ConversationHistories``：DeepSeek 工具链的 OpenAI 格式消息列表。
+
+两者都在内存里按 LRU 只保留 ``cache_threads`` 个会话（换出的会话已在磁盘或
+待写表里），并把每个会话截到最近 ``max_turns`` 轮。未完成步骤的 pending
+writes 只留在内存：下一轮对话总是从最新 checkpoint 重新开始，用不到它们。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+from .config import ConversationConfig, get_conversation_config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS checkpoints ("
+    "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,"
+    " parent_id TEXT, type TEXT NOT NULL, checkpoint BLOB NOT NULL,"
+    " metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, updated REAL NOT NULL,"
+    " PRIMARY KEY (thread_id, checkpoint_ns))",
+    "CREATE TABLE IF NOT EXISTS checkpoint_blobs ("
+    "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL,"
+    " version TEXT NOT NULL, type TEXT NOT NULL, blob BLOB NOT NULL,"
+    " PRIMARY KEY (thread_id, checkpoint_ns, channel))",
+    "CREATE TABLE IF NOT EXISTS agent_histories ("
+    "thread_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS history_summaries ("
+    "thread_id TEXT PRIMARY KEY, summary TEXT NOT NULL, updated REAL NOT NULL)",
+)
+
+# 待写表的键 → 对应的 SQL；值为 None 表示删除
+_UPSERT = {
+    "checkpoint": "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "blob": "INSERT OR REPLACE INTO checkpoint_blobs VALUES (?, ?, ?, ?, ?, ?)",
+    "history": "INSERT OR REPLACE INTO agent_histories VALUES (?, ?, ?)",
+    "summary": "INSERT OR REPLACE INTO history_summaries VALUES (?, ?, ?)",
+}
+_DELETE_THREAD = (
+    "DELETE FROM checkpoints WHERE thread_id = ?",
+    "DELETE FROM checkpoint_blobs WHERE thread_id = ?",
+    "DELETE FROM agent_histories WHERE thread_id = ?",
+    "DELETE FROM history_summaries WHERE thread_id = ?",
+)
+
+# (checkpoint_ns, checkpoint_id, parent_id, checkpoint, metadata, {channel: (version, blob)})
+CheckpointRecord = Tuple[
+    str, str, Optional[str], Tuple[str, bytes], Tuple[str, bytes], Dict[str, Tuple[Any, Tuple[str, bytes]]]
+]
+
+
+def turn_start(messages: Sequence[Any], max_turns: int, is_user: Callable[[Any], bool]) -> int:
+    """只保留最近 max_turns 轮时应从哪条消息开始；从用户消息处截断，工具调用不会被拆开。"""
+    if max_turns <= 0:
+        return 0
+    seen = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if is_user(messages[i]):
+            seen += 1
+            if seen == max_turns:
+                return i
+    return 0
+
+
+class ConversationStore:
+    """对话历史的 SQLite 存储；写入先进待写表，由后台线程合批提交。"""
+
+    def __init__(self, path: str, flush_interval: float = 0.5) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self.rows_written = 0
+        self._pending: "OrderedDict[tuple, Optional[tuple]]" = OrderedDict()
+        self._lock = threading.Lock()        # 保护 _pending
+        self._db_lock = threading.Lock()     # 串行化对连接的使用
+        self._wakeup = threading.Event()
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+        self._thread = threading.Thread(
+            target=self._loop, name="ConversationWriter", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ------------------------------ 写入 ------------------------------ #
+
+    def _enqueue(self, key: tuple, row: Optional[tuple]) -> None:
+        with self._lock:
+            # 同键覆盖，并移到队尾，保证与删除标记的先后顺序
+            self._pending.pop(key, None)
+            self._pending[key] = row
+        self._wakeup.set()
+
+    def save_checkpoint(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str,
+        parent_id: Optional[str],
+        checkpoint: Tuple[str, bytes],
+        metadata: Tuple[str, bytes],
+        blobs: Dict[str, Tuple[Any, Tuple[str, bytes]]],
+    ) -> None:
+        now = time.time()
+        for channel, (version, (kind, blob)) in blobs.items():
+            self._enqueue(
+                ("blob", thread_id, checkpoint_ns, channel),
+                (thread_id, checkpoint_ns, channel, json.dumps(version), kind, blob),
+            )
+        self._enqueue(
+            ("checkpoint", thread_id, checkpoint_ns),
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                parent_id,
+                checkpoint[0],
+                checkpoint[1],
+                metadata[0],
+                metadata[1],
+                now,
+            ),
+        )
+
+    def save_history(self, thread_id: str, messages: List[dict]) -> None:
+        payload = json.dumps(messages, ensure_ascii=False)
+        self._enqueue(("history", thread_id), (thread_id, payload, time.time()))
+
+    def save_summary(self, thread_id: str, summary: str) -> None:
+        self._enqueue(("summary", thread_id), (thread_id, summary, time.time()))
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._pending if k[1] == thread_id]:
+                del self._pending[key]
+            self._pending[("delete", thread_id)] = None
+        self._wakeup.set()
+
+    def _loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait()
+            if self._closed:
+                break
+            # 攒一小段时间再提交，一轮对话的多次 put 合成一个事务
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:  # noqa: BLE001
+                logger.warning("写入对话历史失败，稍后重试: %s", e)
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        """把待写表提交到磁盘；返回写入（含删除）的行数。"""
+        with self._db_lock:
+            with self._lock:
+                batch = list(self._pending.items())
+                self._pending.clear()
+            if not batch:
+                return 0
+            try:
+                with self._conn:
+                    for key, row in batch:
+                        if key[0] == "delete":
+                            for statement in _DELETE_THREAD:
+                                self._conn.execute(statement, (key[1],))
+                        else:
+                            self._conn.execute(_UPSERT[key[0]], row)
+            except Exception:
+                # 放回待写表（后来的同键写入优先），下次再试
+                with self._lock:
+                    restored = OrderedDict(batch)
+                    restored.update(self._pending)
+                    self._pending = restored
+                raise
+            self.flushes += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+    # ------------------------------ 读取 ------------------------------ #
+
+    def _query(self, sql: str, args: tuple) -> list:
+        # 先落盘这个会话尚未提交的写入，读到的才是最新状态
+        with self._lock:
+            dirty = any(key[1] == args[0] for key in self._pending)
+        if dirty:
+            self.flush()
+        with self._db_lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def load_checkpoints(self, thread_id: str) -> List[CheckpointRecord]:
+        rows = self._query(
+            "SELECT checkpoint_ns, checkpoint_id, parent_id, type, checkpoint,"
+            " metadata_type, metadata FROM checkpoints WHERE thread_id = ?",
+            (thread_id,),
+        )
+        if not rows:
+            return []
+        blobs: Dict[str, Dict[str, Tuple[Any, Tuple[str, bytes]]]] = {}
+        for ns, channel, version, kind, blob in self._query(
+            "SELECT checkpoint_ns, channel, version, type, blob"
+            " FROM checkpoint_blobs WHERE thread_id = ?",
+            (thread_id,),
+        ):
+            blobs.setdefault(ns, {})[channel] = (json.loads(version), (kind, bytes(blob)))
+        return [
+            (ns, cid, parent, (kind, bytes(data)), (mkind, bytes(meta)), blobs.get(ns, {}))
+            for ns, cid, parent, kind, data, mkind, meta in rows
+        ]
+
+    def load_history(self, thread_id: str) -> Optional[List[dict]]:
+        rows = self._query(
+            "SELECT messages FROM agent_histories WHERE thread_id = ?", (thread_id,)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def load_summary(self, thread_id: str) -> str:
+        rows = self._query(
+            "SELECT summary FROM history_summaries WHERE thread_id = ?", (thread_id,)
+        )
+        return rows[0][0] if rows else ""
+
+    def thread_ids(self) -> List[str]:
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT thread_id FROM checkpoints UNION SELECT thread_id FROM agent_histories"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception as e:  # noqa: BLE001
+            logger.warning("关闭时写入对话历史失败: %s", e)
+        with self._db_lock:
+            self._conn.close()
+
+
+class PersistentSaver(InMemorySaver):
+    """按需从 ``ConversationStore`` 载入会话的 LangGraph checkpointer。
+
+    读写仍走 ``InMemorySaver`` 的内存结构；每次 ``put`` 后把新 checkpoint 交给
+    存储排队落盘，并删掉同一命名空间里更旧的 checkpoint 与不再引用的通道值。
+    """
+
+    def __init__(self, store: ConversationStore, cache_threads: int = 32) -> None:
+        super().__init__()
+        self.store = store
+        self.cache_threads = cache_threads
+        self._loaded: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self, thread_id: str) -> None:
+        with self._lock:
+            if thread_id in self._loaded:
+                self._loaded.move_to_end(thread_id)
+                return
+            try:
+                records = self.store.load_checkpoints(thread_id)
+            except Exception as e:  # noqa: BLE001
+                logger.warning("读取对话历史失败，本会话从空白开始: %s", e)
+                records = []
+            for ns, cid, parent, checkpoint, metadata, blobs in records:
+                self.storage[thread_id][ns][cid] = (checkpoint, metadata, parent)
+                for channel, (version, blob) in blobs.items():
+                    self.blobs[(thread_id, ns, channel, version)] = blob
+            self._loaded[thread_id] = None
+            while len(self._loaded) > self.cache_threads:
+                evicted, _ = self._loaded.popitem(last=False)
+                self._forget(evicted)
+
+    def _forget(self, thread_id: str) -> None:
+        """只从内存里丢掉会话；磁盘 / 待写表里的数据不动。"""
+        super().delete_thread(thread_id)
+
+    def get_tuple(self, config):
+        self._ensure_loaded(config["configurable"]["thread_id"])
+        with self._lock:
+            return super().get_tuple(config)
+
+    async def aget_tuple(self, config):
+        # 首次访问某个会话要读 SQLite，放到线程池里做，不阻塞事件循环
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id not in self._loaded:
+            await asyncio.to_thread(self._ensure_loaded, thread_id)
+        return self.get_tuple(config)
+
+    def list(self, config, **kwargs) -> Iterator:
+        # config 为 None 时只列出当前在内存里的会话
+        if config is not None:
+            self._ensure_loaded(config["configurable"]["thread_id"])
+        with self._lock:
+            items = list(super().list(config, **kwargs))
+        return iter(items)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        self._ensure_loaded(thread_id)
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            saved, meta, parent = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            self.store.save_checkpoint(
+                thread_id,
+                checkpoint_ns,
+                checkpoint["id"],
+                parent,
+                saved,
+                meta,
+                {
+                    channel: (version, self.blobs[(thread_id, checkpoint_ns, channel, version)])
+                    for channel, version in new_versions.items()
+                },
+            )
+            self._prune(thread_id, checkpoint_ns, checkpoint["id"], checkpoint["channel_versions"])
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path: str = "") -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, latest: str, versions: dict) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for cid in [c for c in checkpoints if c != latest]:
+            del checkpoints[cid]
+            self.writes.pop((thread_id, checkpoint_ns, cid), None)
+        for key in [
+            k
+            for k in self.blobs
+            if k[0] == thread_id and k[1] == checkpoint_ns and versions.get(k[2]) != k[3]
+        ]:
+            del self.blobs[key]
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._loaded.pop(thread_id, None)
+        self.store.delete_thread(thread_id)
+
+
+class _Thread:
+    __slots__ = ("messages", "summary")
+
+    def __init__(self, messages: List[dict], summary: str = "") -> None:
+        self.messages = messages
+        self.summary = summary
+
+
+class ConversationHistories:
+    """DeepSeek 工具链的逐会话消息列表与滚动摘要：内存 LRU + 可选的磁盘存储。
+
+    没有 store 时等同于原来的字典（不换出会话），仍按 max_turns 截断。
+    ``fold`` 把已摘要的旧消息从列表头部移走，摘要单独保存。
+    """
+
+    def __init__(
+        self,
+        store: Optional[ConversationStore] = None,
+        max_turns: int = 0,
+        cache_threads: int = 32,
+    ) -> None:
+        self.store = store
+        self.max_turns = max_turns
+        self.cache_threads = cache_threads
+        self._cache: "OrderedDict[str, _Thread]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _thread(self, thread_id: str) -> _Thread:
+        with self._lock:
+            entry = self._cache.get(thread_id)
+            if entry is not None:
+                self._cache.move_to_end(thread_id)
+                return entry
+        entry = _Thread([])
+        if self.store is not None:
+            try:
+                entry = _Thread(
+                    self.store.load_history(thread_id) or [],
+                    self.store.load_summary(thread_id),
+                )
+            except Exception as e:  # noqa: BLE001
+                logger.warning("读取对话历史失败，本会话从空白开始: %s", e)
+        with self._lock:
+            # 读盘期间别的线程可能已经写入，以内存里的为准
+            current = self._cache.get(thread_id)
+            if current is not None:
+                return current
+            self._cache[thread_id] = entry
+            if self.store is not None:
+                while len(self._cache) > self.cache_threads:
+                    self._cache.popitem(last=False)
+        return entry
+
+    def get(self, thread_id: str) -> List[dict]:
+        """会话的消息列表副本；第一次访问时从磁盘读入。"""
+        return list(self._thread(thread_id).messages)
+
+    def get_summary(self, thread_id: str) -> str:
+        return self._thread(thread_id).summary
+
+    def set(self, thread_id: str, messages: List[dict]) -> None:
+        start = turn_start(messages, self.max_turns, lambda m: m.get("role") == "user")
+        messages = list(messages[start:])
+        with self._lock:
+            self._thread(thread_id).messages = messages
+        if self.store is not None:
+            self.store.save_history(thread_id, messages)
+
+    def extend(self, thread_id: str, messages: List[dict]) -> None:
+        with self._lock:
+            self.set(thread_id, self.get(thread_id) + list(messages))
+
+    def fold(self, thread_id: str, prefix: List[dict], summary: str) -> bool:
+        """列表仍以 prefix 开头时把它换成摘要；期间历史被改写过则放弃，返回是否折叠。"""
+        with self._lock:
+            entry = self._thread(thread_id)
+            if entry.messages[: len(prefix)] != prefix:
+                return False
+            entry.summary = summary
+            self.set(thread_id, entry.messages[len(prefix) :])
+        if self.store is not None:
+            self.store.save_summary(thread_id, summary)
+        return True
+
+    def delete(self, thread_id: str) -> None:
+        with self._lock:
+            self._cache.pop(thread_id, None)
+        if self.store is not None:
+            self.store.delete_thread(thread_id)
+
+
+# ------------------------------ 工厂 ------------------------------ #
+
+_SHARED: Dict[str, Any] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def _shared(name: str, build: Callable[[], Any]) -> Any:
+    with _SHARED_LOCK:
+        if name not in _SHARED:
+            _SHARED[name] = build()
+        return _SHARED[name]
+
+
+def open_conversation_store(
+    config: Optional[ConversationConfig] = None,
+) -> Optional[ConversationStore]:
+    """进程内共享的对话存储；关闭持久化或打开失败时返回 None。"""
+    config = config or get_conversation_config()
+    if not config.persist:
+        return None
+
+    def build() -> Optional[ConversationStore]:
+        try:
+            return ConversationStore(config.path, flush_interval=config.flush_interval)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("打开对话历史存储失败，历史仅保存在内存: %s", e)
+            return None
+
+    return _shared(f"store:{os.path.abspath(config.path)}", build)
+
+
+def get_checkpointer(config: Optional[ConversationConfig] = None) -> BaseCheckpointSaver:
+    """跨 ``ChatEngine`` 实例共享的 checkpointer。"""
+    config = config or get_conversation_config()
+    store = open_conversation_store(config)
+    if store is None:
+        return _shared("checkpointer:memory", InMemorySaver)
+    return _shared(
+        f"checkpointer:{store.path}",
+        lambda: PersistentSaver(store, cache_threads=config.cache_threads),
+    )
+
+
+def get_agent_histories(config: Optional[ConversationConfig] = None) -> ConversationHistories:
+    """跨 ``DeepSeekToolAgent`` 实例共享的工具链历史。"""
+    config = config or get_conversation_config()
+    store = open_conversation_store(config)
+    return _shared(
+        f"histories:{store.path if store else 'memory'}",
+        lambda: ConversationHistories(
+            store, max_turns=config.max_turns, cache_threads=config.cache_threads
+        ),
+    )
@@ -1,15 +1,32 @@
-"""DeepSeek native multi-turn tool-call loop."""
+"""DeepSeek native multi-turn tool-call loop (asyncio)."""
 
 from __future__ import annotations
 
+import asyncio
 import json
+import weakref
 from dataclasses import dataclass
 from typing import Any, Callable
 
-from openai import OpenAI
-
-from .agent_tools import available_tools, run_tool
-from .config import AgentConfig, ChatModelConfig
+from openai import AsyncOpenAI, OpenAI
+
+from .agent_tools import available_tools, describe_cache_stats, run_tools
+from .config import (
+    AgentConfig,
+    ChatModelConfig,
+    ConversationConfig,
+    get_conversation_config,
+)
+from .conversation_store import ConversationHistories
+from .history_window import (
+    SUMMARY_PROMPT,
+    HistorySummarizer,
+    HistoryWindow,
+    build_window,
+    format_transcript,
+)
+from .llm_usage import TurnUsage
+from .prompt_layout import summary_message
 
 LogFn = Callable[[str], None]
 ChunkFn = Callable[[str], None]
@@ -38,13 +55,35 @@ class DeepSeekToolAgent:
         agent_config: AgentConfig,
         vector_store,
         log: LogFn,
+        histories: ConversationHistories | None = None,
+        conversation_config: ConversationConfig | None = None,
     ) -> None:
         self.config = config
         self.agent_config = agent_config
         self.vector_store = vector_store
         self.log = log
+        # Sync client for the background summarizer; streaming uses one
+        # AsyncOpenAI client per event loop (its connection pool is loop-bound).
         self.client = OpenAI(api_key=config.api_key, base_url=config.base_url)
-        self.histories: dict[str, list[dict[str, Any]]] = {}
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # Per-thread OpenAI-format messages; persisted and trimmed when a store is given.
+        self.histories = histories or ConversationHistories()
+        self.conversation_config = conversation_config or get_conversation_config()
+        # Older turns beyond the history budget are folded into a rolling summary
+        # in the background once a reply has finished streaming.
+        self.summarizer: HistorySummarizer | None = None
+        if self.conversation_config.summarize and self.conversation_config.history_tokens:
+            self.summarizer = HistorySummarizer(
+                self.histories,
+                self._summarize,
+                budget=self.conversation_config.history_tokens,
+                summary_tokens=self.conversation_config.summary_tokens,
+            )
+
+    def close(self) -> None:
+        """Stop the background summarizer; pending summaries are dropped."""
+        if self.summarizer is not None:
+            self.summarizer.close()
 
     @property
     def enabled(self) -> bool:
@@ -54,55 +93,126 @@ class DeepSeekToolAgent:
             and bool(available_tools(self.vector_store))
         )
 
-    def stream(
+    async def astream(
         self,
         user_message: str,
         thread_id: str,
         system_prompt: str,
         on_chunk: ChunkFn,
         on_sentence: SentenceFn,
+        usage: TurnUsage | None = None,
     ) -> str:
-        history = self.histories.setdefault(thread_id, [])
-        turn_messages = [
-            {"role": "system", "content": system_prompt},
-            *history,
-            {"role": "user", "content": user_message},
-        ]
-        result = self._run_tool_loop(turn_messages, on_chunk, on_sentence)
-        # Store history without the per-turn system message.
-        self.histories[thread_id] = result.messages[1:]
+        """Run one turn on the running event loop.
+
+        Model requests are awaited on the async client; history I/O and tool
+        execution go to the default executor, so many turns can share a loop.
+        """
+        window, summary = await asyncio.to_thread(self._load_window, thread_id)
+        if window.omitted:
+            self.log(
+                f"历史超出 {self.conversation_config.history_tokens} token 预算，"
+                f"本轮省略最早的 {window.omitted} 轮。"
+            )
+        # Stable prefix first (system prompt, summary, history) so the provider's
+        # context cache can reuse it; only this turn's messages are new.
+        prefix = [{"role": "system", "content": system_prompt}]
+        if summary:
+            prefix.append(summary_message(summary))
+        prefix.extend(window.messages)
+        turn_messages = [*prefix, {"role": "user", "content": user_message}]
+        result = await self._run_tool_loop(turn_messages, on_chunk, on_sentence, usage)
+        # Append only this turn: the stored history may have been folded meanwhile.
+        await asyncio.to_thread(
+            self._save_turn,
+            thread_id,
+            [_without_reasoning(m) for m in result.messages[len(prefix) :]],
+        )
         return result.content
 
+    def _load_window(self, thread_id: str) -> tuple[HistoryWindow, str]:
+        window = build_window(
+            self.histories.get(thread_id), self.conversation_config.history_tokens
+        )
+        return window, self.histories.get_summary(thread_id)
+
+    def _save_turn(self, thread_id: str, messages: list[dict[str, Any]]) -> None:
+        self.histories.extend(thread_id, messages)
+        if self.summarizer is not None:
+            self.summarizer.schedule(thread_id)
+
+    def _async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(api_key=self.config.api_key, base_url=self.config.base_url)
+            self._async_clients[loop] = client
+        return client
+
+    def record_turn(self, thread_id: str, user_message: str, answer: str) -> None:
+        """Append a turn answered outside the tool loop (e.g. from a cache)."""
+        self.histories.extend(
+            thread_id,
+            [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": answer},
+            ],
+        )
+
+    def _summarize(self, summary: str, messages: list[dict[str, Any]]) -> str:
+        """Merge old turns into the rolling summary (runs off the streaming path)."""
+        response = self.client.chat.completions.create(
+            model=self.config.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": (
+                        f"已有摘要：\n{summary or '（无）'}\n\n"
+                        f"新增对话：\n{format_transcript(messages)}"
+                    ),
+                },
+            ],
+            max_tokens=self.conversation_config.summary_tokens * 2,
+            stream=False,
+        )
+        choices = getattr(response, "choices", None) or []
+        if not choices:
+            return ""
+        return str(choices[0].message.content or "").strip()
+
     # -------------------------- tool loop -------------------------- #
 
-    def _run_tool_loop(
+    async def _run_tool_loop(
         self,
         messages: list[dict[str, Any]],
         on_chunk: ChunkFn,
         on_sentence: SentenceFn,
+        usage: TurnUsage | None = None,
     ) -> AgentTurnResult:
         tools = available_tools(self.vector_store)
         made_tool_call = False
         for sub_turn in range(1, self.agent_config.max_tool_rounds + 1):
             if made_tool_call:
                 self.log("工具结果已返回，继续请求模型。")
-            streamed = self._stream_assistant_message(
+            streamed = await self._stream_assistant_message(
                 messages,
                 tools=tools,
                 on_chunk=on_chunk,
                 on_sentence=on_sentence,
+                usage=usage,
             )
             message = streamed.message
 
             tool_calls = message.get("tool_calls") or []
             if not tool_calls:
-                message = self._continue_if_truncated(
+                message = await self._continue_if_truncated(
                     messages=messages,
                     message=message,
                     finish_reason=streamed.finish_reason,
                     pending_sentence=streamed.pending_sentence,
                     on_chunk=on_chunk,
                     on_sentence=on_sentence,
+                    usage=usage,
                 )
                 messages.append(message)
                 content = str(message.get("content") or "").strip()
@@ -111,6 +221,7 @@ class DeepSeekToolAgent:
             messages.append(message)
             made_tool_call = True
             self.log(f"DeepSeek 请求工具调用（第 {sub_turn} 轮，共 {len(tool_calls)} 个）。")
+            calls = []
             for tool_call in tool_calls:
                 tool_name, arguments = _extract_tool_call(tool_call)
                 short_query = str(arguments.get("query") or "")[:40]
@@ -118,7 +229,11 @@ class DeepSeekToolAgent:
                     self.log(f"调用工具: {tool_name}({short_query}...)")
                 else:
                     self.log(f"调用工具: {tool_name}")
-                tool_result = run_tool(tool_name, arguments, self.vector_store)
+                calls.append((tool_name, arguments))
+            # 同一轮的多个调用并发执行，结果按 tool_call_id 原顺序回填；
+            # 检索是阻塞的，放到线程池里跑，不占事件循环
+            tool_results = await asyncio.to_thread(run_tools, calls, self.vector_store)
+            for tool_call, tool_result in zip(tool_calls, tool_results):
                 messages.append(
                     {
                         "role": "tool",
@@ -126,6 +241,9 @@ class DeepSeekToolAgent:
                         "content": tool_result,
                     }
                 )
+            cache_stats = describe_cache_stats()
+            if cache_stats:
+                self.log(cache_stats)
 
         self.log("工具调用达到最大轮数，要求模型基于已有工具结果作答。")
         final_messages = [
@@ -135,19 +253,21 @@ class DeepSeekToolAgent:
                 "content": "请基于以上工具结果，直接以林黛玉的口吻给出最终回复。",
             },
         ]
-        streamed = self._stream_assistant_message(
+        streamed = await self._stream_assistant_message(
             final_messages,
             tools=[],
             on_chunk=on_chunk,
             on_sentence=on_sentence,
+            usage=usage,
         )
-        message = self._continue_if_truncated(
+        message = await self._continue_if_truncated(
             messages=final_messages,
             message=streamed.message,
             finish_reason=streamed.finish_reason,
             pending_sentence=streamed.pending_sentence,
             on_chunk=on_chunk,
             on_sentence=on_sentence,
+            usage=usage,
         )
         messages.extend(final_messages[len(messages) :])
         messages.append(message)
@@ -155,18 +275,21 @@ class DeepSeekToolAgent:
             content=str(message.get("content") or "").strip(), messages=messages
         )
 
-    def _stream_assistant_message(
+    async def _stream_assistant_message(
         self,
         messages: list[dict[str, Any]],
         tools: list[dict[str, Any]],
         on_chunk: ChunkFn,
         on_sentence: SentenceFn,
         initial_sentence_buffer: str = "",
+        usage: TurnUsage | None = None,
     ) -> StreamedAssistantMessage:
         kwargs: dict[str, Any] = {
             "model": self.config.model,
             "messages": messages,
             "stream": True,
+            # The final chunk then carries usage, incl. context-cache hit/miss tokens.
+            "stream_options": {"include_usage": True},
         }
         if tools:
             kwargs["tools"] = tools
@@ -176,8 +299,8 @@ class DeepSeekToolAgent:
             kwargs["extra_body"] = {"thinking": {"type": "enabled"}}
 
         try:
-            return self._consume_stream(
-                kwargs, on_chunk, on_sentence, initial_sentence_buffer
+            return await self._consume_stream(
+                kwargs, on_chunk, on_sentence, initial_sentence_buffer, usage
             )
         except Exception:
             if not self.agent_config.enable_thinking:
@@ -185,11 +308,11 @@ class DeepSeekToolAgent:
             kwargs.pop("reasoning_effort", None)
             kwargs.pop("extra_body", None)
             self.log("当前模型未接受 thinking 参数，已自动关闭思考参数重试。")
-            return self._consume_stream(
-                kwargs, on_chunk, on_sentence, initial_sentence_buffer
+            return await self._consume_stream(
+                kwargs, on_chunk, on_sentence, initial_sentence_buffer, usage
             )
 
-    def _continue_if_truncated(
+    async def _continue_if_truncated(
         self,
         messages: list[dict[str, Any]],
         message: dict[str, Any],
@@ -197,6 +320,7 @@ class DeepSeekToolAgent:
         pending_sentence: str,
         on_chunk: ChunkFn,
         on_sentence: SentenceFn,
+        usage: TurnUsage | None = None,
     ) -> dict[str, Any]:
         combined = dict(message)
         combined_content = str(combined.get("content") or "")
@@ -214,12 +338,13 @@ class DeepSeekToolAgent:
                     "content": "请从刚才中断处自然接着说，不要重复已经说过的内容。",
                 },
             ]
-            streamed = self._stream_assistant_message(
+            streamed = await self._stream_assistant_message(
                 continuation_messages,
                 tools=[],
                 on_chunk=on_chunk,
                 on_sentence=on_sentence,
                 initial_sentence_buffer=pending_sentence,
+                usage=usage,
             )
             continuation = streamed.message
             next_content = str(continuation.get("content") or "")
@@ -238,12 +363,13 @@ class DeepSeekToolAgent:
             on_sentence(pending_sentence.strip())
         return _json_safe(combined)
 
-    def _consume_stream(
+    async def _consume_stream(
         self,
         kwargs: dict[str, Any],
         on_chunk: ChunkFn,
         on_sentence: SentenceFn,
         initial_sentence_buffer: str = "",
+        usage: TurnUsage | None = None,
     ) -> StreamedAssistantMessage:
         content_parts: list[str] = []
         reasoning_parts: list[str] = []
@@ -251,8 +377,11 @@ class DeepSeekToolAgent:
         sentence_buffer = initial_sentence_buffer
         finish_reason: str | None = None
 
-        response = self.client.chat.completions.create(**kwargs)
-        for chunk in response:
+        t0 = usage.request_started() if usage is not None else 0.0
+        reported = None
+        response = await self._async_client().chat.completions.create(**kwargs)
+        async for chunk in response:
+            reported = getattr(chunk, "usage", None) or reported
             choices = getattr(chunk, "choices", None) or []
             if not choices:
                 continue
@@ -267,6 +396,8 @@ class DeepSeekToolAgent:
                 reasoning_parts.append(str(reasoning_piece))
 
             piece = _delta_get(delta, "content")
+            if usage is not None and (piece or reasoning_piece):
+                usage.first_token(t0)
             if piece:
                 text_piece = str(piece)
                 content_parts.append(text_piece)
@@ -281,6 +412,8 @@ class DeepSeekToolAgent:
             for tool_call in _delta_tool_calls(delta):
                 _merge_tool_call_delta(tool_call_parts, tool_call)
 
+        if usage is not None:
+            usage.request_finished(t0, reported)
         pending_sentence = sentence_buffer if finish_reason == "length" else ""
         flushed = sentence_buffer.strip()
         if flushed and finish_reason != "length":
@@ -306,6 +439,11 @@ class DeepSeekToolAgent:
         )
 
 
+def _without_reasoning(message: dict[str, Any]) -> dict[str, Any]:
+    # Reasoning is never resent in later turns, so it is not worth storing.
+    return {k: v for k, v in message.items() if k != "reasoning_content"}
+
+
 def _extract_tool_call(tool_call: dict[str, Any]) -> tuple[str, dict[str, Any]]:
     function = tool_call.get("function") or {}
     name = str(function.get("name") or "")
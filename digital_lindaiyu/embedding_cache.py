@@ -0,0 +1,272 @@
+"""嵌入向量缓存：查询向量两级缓存 + 按内容寻址的块向量库。
+
+``search_knowledge_base`` 工具和 ``ChatEngine._node_retrieve`` 每次都要
+``embed_query``：FastEmbed 是一次 ONNX 前向，DashScope 是一次网络往返。
+模型在工具轮次和多轮对话之间经常反复问几乎相同的问题，
+因此用 (后端, 模型, 归一化文本) 作键缓存查询向量，重启后依然有效。
+
+入库时的块向量则按 (后端, 模型, 文本 md5) 存进同一个 SQLite 文件的另一张表：
+``--rebuild`` 或调整切分参数后，文本没变的块直接复用旧向量，只有新文本才真正嵌入。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .cache import LRUCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(text: str) -> str:
+    """块文本的 md5（十六进制）；``knowledge._stable_id`` 取其前 10 位。"""
+    return hashlib.md5(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class VectorDiskCache:
+    """把 key → float32 向量存进 SQLite 的小工具；多线程、多进程安全。"""
+
+    def __init__(self, path: str, table: str = "query_embeddings") -> None:
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        # SQLite 默认单条语句最多 999 个参数
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            marks = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM {self.table} WHERE key IN ({marks})",
+                    batch,
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        rows = []
+        for key, vector in items.items():
+            arr = np.asarray(vector, dtype=np.float32)
+            rows.append((key, int(arr.shape[0]), arr.tobytes()))
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, dim, vector) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()
+        return int(count)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """包一层任意 ``Embeddings``：``embed_query`` 先查内存，再查磁盘，最后才真算。
+
+    ``embed_documents`` 走按内容寻址的块向量库（``chunk_store=True`` 时），
+    与查询缓存互不干扰；``query_cache=False`` 时查询直接透传。
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        backend: str,
+        model: str,
+        cache_path: Optional[str] = None,
+        memory_size: int = 2048,
+        query_cache: bool = True,
+        chunk_store: bool = False,
+    ) -> None:
+        self.inner = inner
+        self.backend = backend
+        self.model = model
+        self.query_cache = query_cache
+        self._memory: LRUCache[List[float]] = LRUCache(maxsize=memory_size)
+        self._disk: Optional[VectorDiskCache] = None
+        self._chunks: Optional[VectorDiskCache] = None
+        if cache_path and query_cache:
+            try:
+                self._disk = VectorDiskCache(cache_path)
+            except Exception as e:
+                logger.warning("打开查询向量磁盘缓存失败，仅使用内存缓存: %s", e)
+        if cache_path and chunk_store:
+            try:
+                self._chunks = VectorDiskCache(cache_path, table="chunk_embeddings")
+            except Exception as e:
+                logger.warning("打开块向量库失败，入库时将全部重新嵌入: %s", e)
+        self.disk_hits = 0
+        self.misses = 0
+        self.chunk_hits = 0
+        self.chunk_misses = 0
+        self._stats_lock = threading.Lock()
+
+    def cache_key(self, text: str) -> str:
+        normalized = normalize_query(text)
+        raw = f"{self.backend}\0{self.model}\0{normalized}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def chunk_key(self, text: str) -> str:
+        return f"{self.backend}:{self.model}:{content_digest(text)}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self._chunks is None:
+            return self.inner.embed_documents(texts)
+        keys = [self.chunk_key(t) for t in texts]
+        try:
+            found = self._chunks.get_many(keys)
+        except Exception as e:
+            logger.warning("读取块向量库失败: %s", e)
+            found = {}
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        with self._stats_lock:
+            self.chunk_hits += len(texts) - len(pending)
+            self.chunk_misses += len(pending)
+        if pending:
+            vectors = self.inner.embed_documents(list(pending.values()))
+            computed = {key: list(v) for key, v in zip(pending, vectors)}
+            try:
+                self._chunks.put_many(computed)
+            except Exception as e:
+                logger.warning("写入块向量库失败: %s", e)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        if not self.query_cache:
+            return self.inner.embed_query(text)
+        key = self.cache_key(text)
+        vector = self._memory.get(key)
+        if vector is not None:
+            return vector
+
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(key)
+            except Exception as e:
+                logger.warning("读取查询向量缓存失败: %s", e)
+                vector = None
+            if vector is not None:
+                with self._stats_lock:
+                    self.disk_hits += 1
+                self._memory.put(key, vector)
+                return vector
+
+        with self._stats_lock:
+            self.misses += 1
+        # 用归一化后的文本求向量，保证缓存值与键一一对应
+        vector = list(self.inner.embed_query(normalize_query(text) or text))
+        self._memory.put(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk.put_many({key: vector})
+            except Exception as e:
+                logger.warning("写入查询向量缓存失败: %s", e)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量版 ``embed_query``：未命中的查询合并成一次 ``embed_documents``。"""
+        if not self.query_cache:
+            return self.inner.embed_documents(list(texts))
+        keys = [self.cache_key(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        for key in dict.fromkeys(keys):
+            vector = self._memory.get(key)
+            if vector is not None:
+                found[key] = vector
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing and self._disk is not None:
+            try:
+                from_disk = self._disk.get_many(missing)
+            except Exception as e:
+                logger.warning("读取查询向量缓存失败: %s", e)
+                from_disk = {}
+            with self._stats_lock:
+                self.disk_hits += len(from_disk)
+            for key, vector in from_disk.items():
+                self._memory.put(key, vector)
+            found.update(from_disk)
+
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = normalize_query(text) or text
+        if pending:
+            with self._stats_lock:
+                self.misses += len(pending)
+            vectors = self.inner.embed_documents(list(pending.values()))
+            computed = {key: list(v) for key, v in zip(pending, vectors)}
+            for key, vector in computed.items():
+                self._memory.put(key, vector)
+            if self._disk is not None:
+                try:
+                    self._disk.put_many(computed)
+                except Exception as e:
+                    logger.warning("写入查询向量缓存失败: %s", e)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def is_cached(self, text: str) -> bool:
+        """查询向量是否已在内存层（不计入命中统计）。"""
+        return self._memory.peek(self.cache_key(text)) is not None
+
+    def stats(self) -> Dict[str, int]:
+        memory_hits = self._memory.hits
+        return {
+            "memory_hits": memory_hits,
+            "disk_hits": self.disk_hits,
+            "hits": memory_hits + self.disk_hits,
+            "misses": self.misses,
+            "chunk_hits": self.chunk_hits,
+            "chunk_misses": self.chunk_misses,
+        }
+
+    def describe_chunk_stats(self) -> str:
+        return (
+            f"块向量库：复用 {self.chunk_hits} 块，新嵌入 {self.chunk_misses} 块"
+        )
+
+    def describe_stats(self) -> str:
+        s = self.stats()
+        return (
+            f"查询向量缓存：命中 {s['hits']}（内存 {s['memory_hits']} / "
+            f"磁盘 {s['disk_hits']}），未命中 {s['misses']}"
+        )
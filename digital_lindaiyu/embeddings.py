@@ -3,14 +3,25 @@
 - DashScope: 云端 text-embedding-v3 / v2（高质量，需 API key）
 - FastEmbed: 本地 ONNX 模型（默认 BGE-small-zh-v1.5，无需 key）
 
-通过 ``get_embeddings()`` 工厂统一获取 langchain `Embeddings` 实现。
+通过 ``get_embeddings()`` 工厂统一获取 langchain `Embeddings` 实现；
+工厂默认在后台线程加载并预热模型（见 ``BackgroundEmbeddings``），
+再包一层查询向量缓存（见 ``embedding_cache``）。
 """
 
 from __future__ import annotations
 
+import logging
 import os
-from http import HTTPStatus
-from typing import List, Optional
+import random
+import threading
+import time
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+)
+from functools import partial
+from typing import Callable, List, Optional
 
 from langchain_core.embeddings import Embeddings
 
@@ -20,6 +31,9 @@ from .config import (
     get_dashscope_base_url,
     get_embedding_config,
 )
+from .throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
 
 
 # --------------------------------------------------------------------------- #
@@ -27,42 +41,111 @@ from .config import (
 # --------------------------------------------------------------------------- #
 
 
-_DASHSCOPE_MAX_BATCH = 25
+# 单次请求的条数上限：v1 / v2 为 25，v3 及之后为 10
+_DASHSCOPE_MAX_BATCH = {"text-embedding-v1": 25, "text-embedding-v2": 25}
+_DASHSCOPE_DEFAULT_BATCH = 10
+
+# 重试退避：第 n 次重试在 [0, min(上限, 基数·2^n)] 内均匀取值（full jitter）
+_BACKOFF_BASE = 0.5
+_BACKOFF_MAX = 8.0
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and status >= 500
 
 
 class DashScopeEmbeddings(Embeddings):
-    """通过官方 dashscope SDK 调用 text-embedding 系列模型。"""
+    """通过 DashScope 的 OpenAI 兼容接口调用 text-embedding 系列模型。
+
+    - 复用同一个 ``openai.OpenAI`` 客户端（httpx 连接池），不再每次请求新建连接；
+    - 多于一批的输入拆开后最多 ``concurrency`` 批同时在途，结果按原顺序拼回；
+    - 每个请求先从令牌桶取令牌（``rps``），吞吐由配额决定而不是往返延迟；
+    - 连接错误、429 与 5xx 按指数退避 + 随机抖动重试 ``max_retries`` 次，
+      只有重试用尽才把错误抛给调用方。
+    """
 
     def __init__(
         self,
         api_key: Optional[str] = None,
         model: str = "text-embedding-v3",
         base_url: Optional[str] = None,
+        concurrency: int = 4,
+        rps: float = 10.0,
+        max_retries: int = 3,
+        timeout: float = 30.0,
     ) -> None:
-        import dashscope  # 延迟导入
+        from openai import OpenAI  # 延迟导入
 
-        self._dashscope = dashscope
         self.model = model
         self.api_key = api_key or get_dashscope_api_key()
         if not self.api_key:
             raise RuntimeError("未设置 DASHSCOPE_API_KEY，无法使用 DashScope 嵌入。")
-        dashscope.api_key = self.api_key
-        # base_url 仅在使用 OpenAI 兼容接口时有意义，这里保留作配置项
         self.base_url = base_url or get_dashscope_base_url()
+        self.batch_size = _DASHSCOPE_MAX_BATCH.get(model, _DASHSCOPE_DEFAULT_BATCH)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.retries = 0
+        # 重试由下面自己做（带抖动、计数），关掉 SDK 内置的
+        self._client = OpenAI(
+            api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=timeout
+        )
+        self._bucket = TokenBucket(rps, burst=self.concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="dashscope-embed"
+                )
+            return self._executor
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self._bucket.acquire()
+            try:
+                resp = self._client.embeddings.create(
+                    model=self.model, input=batch, encoding_format="float"
+                )
+                return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise RuntimeError(f"DashScope 嵌入失败: {e}") from e
+                delay = _retry_after(e) or random.uniform(
+                    0, min(_BACKOFF_MAX, _BACKOFF_BASE * 2**attempt)
+                )
+                with self._lock:
+                    self.retries += 1
+                logger.debug("DashScope 嵌入出错，%.2fs 后重试: %s", delay, e)
+                time.sleep(delay)
+        raise AssertionError("unreachable")
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [
+            texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) <= 1:
+            # 单条查询直接在调用线程里发，省一次线程切换
+            return self._embed_batch(batches[0]) if batches else []
         out: List[List[float]] = []
-        for i in range(0, len(texts), _DASHSCOPE_MAX_BATCH):
-            batch = texts[i : i + _DASHSCOPE_MAX_BATCH]
-            resp = self._dashscope.TextEmbedding.call(
-                model=self.model,
-                input=batch,
-                api_key=self.api_key,
-            )
-            if resp.status_code != HTTPStatus.OK:
-                raise RuntimeError(f"DashScope 嵌入失败: {resp}")
-            for emb in resp.output["embeddings"]:
-                out.append(emb["embedding"])
+        # map 按提交顺序返回，某批重试用尽时在这里抛出
+        for vectors in self._pool().map(self._embed_batch, batches):
+            out.extend(vectors)
         return out
 
     def embed_query(self, text: str) -> List[float]:
@@ -96,16 +179,131 @@ class FastEmbedEmbeddings(Embeddings):
         return self.embed_documents([text])[0]
 
 
+# --------------------------------------------------------------------------- #
+# 后台加载
+# --------------------------------------------------------------------------- #
+
+
+class BackgroundEmbeddings(Embeddings):
+    """在后台线程构造并预热内部模型，构造函数立即返回。
+
+    ``ready`` 是模型就绪（或加载失败）时完成的 Future；
+    加载完成前调用 ``embed_*`` 会阻塞等待，加载失败则抛出原异常。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Embeddings],
+        warmup_text: Optional[str] = None,
+        name: str = "embeddings",
+    ) -> None:
+        self.ready: "Future[Embeddings]" = Future()
+        self._factory = factory
+        self._warmup_text = warmup_text
+        self._thread = threading.Thread(
+            target=self._load, name=f"EmbeddingLoader-{name}", daemon=True
+        )
+        self._thread.start()
+
+    def _load(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            inner = self._factory()
+            if self._warmup_text:
+                # 首次推理要建 ONNX 会话、分配内存，放在后台做掉
+                inner.embed_query(self._warmup_text)
+        except BaseException as e:  # noqa: BLE001
+            logger.warning("嵌入模型加载失败: %s", e)
+            self.ready.set_exception(e)
+            return
+        logger.info("嵌入模型已就绪（加载 + 预热 %.2fs）", time.perf_counter() - t0)
+        self.ready.set_result(inner)
+
+    @property
+    def inner(self) -> Embeddings:
+        return self.ready.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+
+def wait_for_embeddings(
+    embeddings: Optional[Embeddings], timeout: Optional[float] = None
+) -> bool:
+    """等待（可能包在缓存层里的）后台嵌入模型就绪。
+
+    超时或加载失败返回 False；没有后台加载的实例直接返回 True。
+    """
+    while embeddings is not None:
+        ready = getattr(embeddings, "ready", None)
+        if isinstance(ready, Future):
+            try:
+                ready.result(timeout=timeout)
+                return True
+            except FutureTimeoutError:
+                return False
+            except Exception:
+                return False
+        # 只沿缓存层往里找；BackgroundEmbeddings.inner 会阻塞，上面已处理
+        embeddings = getattr(embeddings, "inner", None)
+    return True
+
+
 # --------------------------------------------------------------------------- #
 # 工厂
 # --------------------------------------------------------------------------- #
 
 
-def get_embeddings(config: Optional[EmbeddingConfig] = None) -> Embeddings:
-    """根据配置返回合适的 Embeddings 实例。"""
+def get_embeddings(
+    config: Optional[EmbeddingConfig] = None,
+    background: Optional[bool] = None,
+) -> Embeddings:
+    """根据配置返回合适的 Embeddings 实例。
+
+    ``background``（默认取 ``DIGITAL_LDY_EMBED_BACKGROUND``）为真时模型在
+    后台线程加载并预热，调用方立即拿到实例；入库等马上要用模型的场景
+    可传 ``False`` 同步加载。默认外面再包一层 ``CachedEmbeddings``：
+    查询向量的内存 + 磁盘缓存（``DIGITAL_LDY_EMBED_CACHE=0`` 关闭），
+    以及按内容寻址的块向量库（``DIGITAL_LDY_CHUNK_EMBED_STORE=0`` 关闭）。
+    """
     cfg = config or get_embedding_config()
+    if background is None:
+        background = cfg.background_load
     if cfg.backend == "dashscope":
-        return DashScopeEmbeddings(model=cfg.model)
-    if cfg.backend == "fastembed":
-        return FastEmbedEmbeddings(model=cfg.model)
-    raise ValueError(f"未知的嵌入后端: {cfg.backend}")
+        factory: Callable[[], Embeddings] = partial(
+            DashScopeEmbeddings,
+            model=cfg.model,
+            concurrency=cfg.concurrency,
+            rps=cfg.rps,
+            max_retries=cfg.max_retries,
+        )
+        # 云端模型没有本地会话可预热，不在启动时白花一次 API 调用
+        warmup_text = None
+    elif cfg.backend == "fastembed":
+        factory = partial(FastEmbedEmbeddings, model=cfg.model)
+        warmup_text = "林黛玉"
+    else:
+        raise ValueError(f"未知的嵌入后端: {cfg.backend}")
+    if background:
+        inner: Embeddings = BackgroundEmbeddings(
+            factory, warmup_text=warmup_text, name=cfg.backend
+        )
+    else:
+        inner = factory()
+    if not (cfg.cache_enabled or cfg.chunk_store_enabled):
+        return inner
+
+    from .embedding_cache import CachedEmbeddings
+
+    return CachedEmbeddings(
+        inner,
+        backend=cfg.backend,
+        model=cfg.model,
+        cache_path=cfg.cache_path,
+        memory_size=cfg.cache_size,
+        query_cache=cfg.cache_enabled,
+        chunk_store=cfg.chunk_store_enabled,
+    )
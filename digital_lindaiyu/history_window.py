@@ -0,0 +1,228 @@
+"""按 token 预算组装多轮历史，较早的轮次折叠进滚动摘要。
+
+``DeepSeekToolAgent`` 原先每轮都把整段历史原样重发，连同早已用过的工具结果
+和 ``reasoning_content``，聊得越久提示词越长、首字越慢。这里：
+
+- ``build_window``：从最近一轮往前取，直到用完 ``history_tokens`` 预算；
+  每轮只留用户消息与最终回答，用过的工具调用与结果、``reasoning_content``
+  一律不再发送。一轮的写法与它的位置无关，发送过一次之后就逐字节不变，
+  后续请求才能命中服务端的前缀缓存（见 ``prompt_layout``）；
+- ``HistorySummarizer``：回复结束后在后台线程检查历史是否超出预算，超出就把
+  最旧的若干轮连同已有摘要交给模型压成新摘要，再从历史头部移走（见
+  ``ConversationHistories.fold``）。一次折叠到预算的一半，不必每轮都调用模型。
+
+摘要作为单独一条系统消息紧跟人设，因此每轮的提示词 ≈ 人设 + 摘要 + 预算内的近几轮，
+与会话总长度无关。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence
+
+from .tokens import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的角色、分隔符等固定开销（粗略）
+_MESSAGE_OVERHEAD = 4
+# 交给摘要模型时每条消息最多保留的 token 数
+_TRANSCRIPT_MESSAGE_TOKENS = 600
+
+SUMMARY_PROMPT = (
+    "你负责为一段角色扮演对话维护滚动摘要。请把「已有摘要」与「新增对话」合并成一段新的摘要："
+    "用第三人称、简洁的中文记下用户的身份与偏好、聊过的话题、双方的约定与未了的问题，"
+    "以及林黛玉当时的情绪与态度；删去寒暄与重复，不要编造对话中没有的内容，直接输出摘要正文。"
+)
+
+
+def split_turns(messages: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """按用户消息把 OpenAI 格式的消息列表切成轮次。"""
+    turns: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_turn(turn: Sequence[Dict[str, Any]], keep_tools: bool = False) -> List[Dict[str, Any]]:
+    """去掉 ``reasoning_content``；keep_tools 为 False 时只留用户消息与最终回答。"""
+    compacted = []
+    for message in turn:
+        if not keep_tools and (message.get("role") == "tool" or message.get("tool_calls")):
+            continue
+        compacted.append({k: v for k, v in message.items() if k != "reasoning_content"})
+    return compacted
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    tokens = _MESSAGE_OVERHEAD + count_tokens(str(message.get("content") or ""))
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or {}
+        tokens += count_tokens(str(function.get("name") or ""))
+        tokens += count_tokens(str(function.get("arguments") or ""))
+    return tokens
+
+
+def turn_tokens(turn: Sequence[Dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in turn)
+
+
+def window_start(
+    messages: Sequence[Any],
+    budget: int,
+    is_user: Callable[[Any], bool],
+    tokens: Callable[[Any], int],
+) -> int:
+    """任意消息类型版的 ``build_window``：返回窗口第一条消息的下标；至少保留最近一轮。"""
+    starts = [i for i, m in enumerate(messages) if i == 0 or is_user(m)]
+    if budget <= 0 or not starts:
+        return 0
+    bounds = [*starts, len(messages)]
+    costs = [sum(tokens(m) for m in messages[a:b]) for a, b in zip(bounds, bounds[1:])]
+    return starts[_stable_start(costs, budget)]
+
+
+@dataclass
+class HistoryWindow:
+    """一轮请求实际携带的历史。"""
+
+    messages: List[Dict[str, Any]]
+    tokens: int
+    turns: int        # 原样保留的轮数
+    omitted: int      # 超出预算、尚未折叠进摘要而省略的轮数
+
+
+def _compacted_turns(history: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    return [compact_turn(t) for t in split_turns(history)]
+
+
+def _kept_from(costs: Sequence[int], budget: int) -> int:
+    """从最新一轮往前累加，返回预算内最早一轮的下标；至少保留最近一轮。"""
+    if budget <= 0:
+        return 0
+    used = 0
+    for i in range(len(costs) - 1, -1, -1):
+        used += costs[i]
+        if used > budget and i < len(costs) - 1:
+            return i + 1
+    return 0
+
+
+def _stable_start(costs: Sequence[int], budget: int) -> int:
+    """超出预算时窗口的起点：只落在累计 token 每跨过半个预算的轮次上。
+
+    若每轮都恰好丢掉最旧的一轮，提示词前缀每轮都变，前缀缓存全部失效；
+    这样窗口在半个预算到一个预算之间伸缩，起点约每半个预算才前移一次。
+    """
+    total = sum(costs)
+    if budget <= 0 or total <= budget:
+        return 0
+    half = max(1, budget // 2)
+    before = 0
+    for i, cost in enumerate(costs):
+        if i and (before - costs[i - 1]) // half != before // half and total - before <= budget:
+            return i
+        before += cost
+    return _kept_from(costs, budget)
+
+
+def build_window(history: Sequence[Dict[str, Any]], budget: int) -> HistoryWindow:
+    turns = _compacted_turns(history)
+    costs = [turn_tokens(t) for t in turns]
+    start = _stable_start(costs, budget)
+    return HistoryWindow(
+        messages=[m for turn in turns[start:] for m in turn],
+        tokens=sum(costs[start:]),
+        turns=len(turns) - start,
+        omitted=start,
+    )
+
+
+def fold_point(history: Sequence[Dict[str, Any]], budget: int) -> int:
+    """超出预算时应折叠掉的消息条数（从头部算起，落在轮次边界）；未超出返回 0。"""
+    if budget <= 0:
+        return 0
+    turns = split_turns(history)
+    costs = [turn_tokens(t) for t in _compacted_turns(history)]
+    if sum(costs) <= budget or len(turns) < 2:
+        return 0
+    # 一次折叠到预算的一半，留出余量，避免每轮都触发摘要
+    keep = _kept_from(costs, budget // 2)
+    return sum(len(t) for t in turns[: max(1, keep)])
+
+
+def format_transcript(messages: Sequence[Dict[str, Any]]) -> str:
+    """把旧轮次排成给摘要模型看的对话记录（不含工具调用）。"""
+    lines = []
+    for message in compact_turn(messages):
+        content = str(message.get("content") or "").strip()
+        if not content:
+            continue
+        speaker = "用户" if message.get("role") == "user" else "林黛玉"
+        lines.append(f"{speaker}：{truncate_to_tokens(content, _TRANSCRIPT_MESSAGE_TOKENS)}")
+    return "\n".join(lines)
+
+
+class HistorySummarizer:
+    """回复结束后在单个后台线程里折叠超出预算的旧轮次；同一会话不会排队两次。
+
+    summarize(已有摘要, 旧消息) 返回新摘要；失败或返回空串时保留原历史，
+    下一轮再试（其间 ``build_window`` 照常按预算省略旧轮次）。
+    """
+
+    def __init__(
+        self,
+        histories,
+        summarize: Callable[[str, List[Dict[str, Any]]], str],
+        budget: int,
+        summary_tokens: int = 400,
+    ) -> None:
+        self.histories = histories
+        self.summarize = summarize
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.folds = 0
+        self._scheduled: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="HistorySummary")
+
+    def schedule(self, thread_id: str):
+        """需要折叠时提交后台任务并返回 Future，否则返回 None。"""
+        if fold_point(self.histories.get(thread_id), self.budget) == 0:
+            return None
+        with self._lock:
+            if thread_id in self._scheduled:
+                return None
+            self._scheduled.add(thread_id)
+        return self._executor.submit(self._run, thread_id)
+
+    def _run(self, thread_id: str) -> bool:
+        try:
+            history = self.histories.get(thread_id)
+            cut = fold_point(history, self.budget)
+            if cut == 0:
+                return False
+            prefix = history[:cut]
+            summary = self.summarize(self.histories.get_summary(thread_id), prefix)
+            summary = truncate_to_tokens((summary or "").strip(), self.summary_tokens)
+            if not summary:
+                return False
+            folded = self.histories.fold(thread_id, prefix, summary)
+            if folded:
+                self.folds += 1
+                logger.info("已把 %d 条旧消息折叠进对话摘要（%s）", cut, thread_id)
+            return folded
+        except Exception as e:  # noqa: BLE001
+            logger.warning("生成对话摘要失败，旧轮次暂按预算省略: %s", e)
+            return False
+        finally:
+            with self._lock:
+                self._scheduled.discard(thread_id)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
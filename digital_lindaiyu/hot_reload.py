@@ -0,0 +1,93 @@
+"""把 ``load_kb`` 写出的新一代索引热加载进运行中的对话引擎。
+
+``load_knowledge_base`` 每次改动索引后都会换 ``INDEX_VERSION``。这里的
+后台线程定期 stat 这个版本戳（按 mtime 缓存，一次检查只是一次 ``stat``），
+变了就在线程里读入新一代词法索引与 numpy 向量索引，读完后各用一次
+赋值换入：
+
+- 检索线程从不持锁，进行中的查询继续读它拿到的旧快照；
+- 新一代读完之前一直用旧索引，不会读到写了一半的文件；
+- 依赖版本戳的缓存（工具检索结果、输入预取）随之自动失效。
+
+Chroma 后端的 HNSW 索引由 chromadb 在进程内缓存，无法这样换入，
+只热加载词法索引，向量部分需重启后生效。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from .rag import (
+    VECTOR_DIR,
+    hold_lexical_index,
+    index_version,
+    refresh_lexical_index,
+    release_lexical_index,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IndexReloader:
+    """后台轮询索引版本戳，变化时载入新一代索引并原子换入。"""
+
+    def __init__(
+        self,
+        vector_store,
+        persist_directory: str = VECTOR_DIR,
+        interval: float = 2.0,
+        on_reload: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.vector_store = vector_store
+        self.persist_directory = persist_directory
+        self.interval = interval
+        self.on_reload = on_reload
+        self.version = index_version(persist_directory)
+        self.reloads = 0
+        self._warned_unsupported = False
+        self._stop = threading.Event()
+        # 从现在起到 close() 词法索引由本线程刷新，检索线程不再自己同步重读
+        hold_lexical_index(persist_directory)
+        refresh_lexical_index(persist_directory)
+        self._thread = threading.Thread(
+            target=self._loop, name="IndexReloader", daemon=True
+        )
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:  # noqa: BLE001
+                logger.warning("热加载索引失败，继续使用旧索引: %s", e)
+
+    def check(self) -> bool:
+        """版本戳变了就重新载入；返回是否发生了换入。"""
+        version = index_version(self.persist_directory)
+        if not version or version == self.version:
+            return False
+        t0 = time.perf_counter()
+        refresh_lexical_index(self.persist_directory)
+        reload = getattr(self.vector_store, "reload", None)
+        if reload is not None:
+            reload()
+        elif self.vector_store is not None and not self._warned_unsupported:
+            logger.warning("当前向量库后端不支持热加载，向量检索需重启后才能用上新索引。")
+            self._warned_unsupported = True
+        self.version = version
+        self.reloads += 1
+        logger.info(
+            "已换入新一代索引 %s（%.0f ms）", version, (time.perf_counter() - t0) * 1000
+        )
+        if self.on_reload is not None:
+            self.on_reload(version)
+        return True
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        release_lexical_index(self.persist_directory)
@@ -0,0 +1,316 @@
+"""单文件、可内存映射的只读索引快照。
+
+numpy 索引是一个目录（``gen-*/vectors.npy`` + ``chunks.json``），Chroma 是
+SQLite 目录，启动时都要整体读入或打开。快照把向量、块文本、metadata 与
+token 数打进一个文件，用 ``mmap`` 映射后直接在映射上检索：
+
+- 向量矩阵用 ``np.frombuffer`` 零拷贝映射，一次矩阵乘出 top-k；
+- 文本 / id / metadata 按偏移表定位，只解码命中的那几条；
+- 只有真正被访问过的页才会常驻内存，启动几乎不花时间，
+  适合随 PyInstaller 打包（路径经 ``resources.get_resource`` 解析 ``_MEIPASS``）。
+
+文件布局（小端）::
+
+    头部 64 字节   magic "LDYSNAP1" | 版本 u32 | 块数 u32 | 维度 u32 | 段数 u32
+    段表          每段 (偏移 u64, 长度 u64)，顺序见 ``_SECTIONS``
+    各段          每段起点按 64 字节对齐
+      vectors       float32 (n, dim)，行向量已 L2 归一化
+      *_offsets     uint64 (n + 1)，对应 blob 内第 i 条的起止
+      ids / texts / metas   UTF-8 blob（metadata 为逐条 JSON）
+      tokens        int32 (n)
+
+快照只读；由 ``scripts/index_snapshot.py export`` 从现有索引导出，
+``import`` 可再还原成可写的 numpy 索引。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .resources import get_resource
+from .tokens import count_tokens
+from .vector_index import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "index.snapshot"
+
+
+class ReadOnlyIndexError(PermissionError):
+    """试图写入只读的索引快照。"""
+
+
+_MAGIC = b"LDYSNAP1"
+_VERSION = 1
+_HEADER = struct.Struct("<8sIIII")
+_HEADER_SIZE = 64
+_ENTRY = struct.Struct("<QQ")
+_ALIGN = 64
+_SECTIONS = (
+    "vectors",
+    "id_offsets",
+    "ids",
+    "text_offsets",
+    "texts",
+    "meta_offsets",
+    "metas",
+    "tokens",
+)
+
+
+def snapshot_path(persist_directory: str) -> str:
+    """``<persist_directory>/index.snapshot``；相对路径在打包后解析到 ``_MEIPASS``。"""
+    return get_resource(os.path.join(persist_directory, SNAPSHOT_FILE))
+
+
+# ------------------------------ 写入 ------------------------------ #
+
+
+def _blob(items: Sequence[bytes]) -> Tuple[np.ndarray, bytes]:
+    offsets = np.zeros(len(items) + 1, dtype="<u8")
+    if items:
+        offsets[1:] = np.cumsum([len(b) for b in items])
+    return offsets, b"".join(items)
+
+
+def write_snapshot(
+    path: str,
+    ids: Sequence[str],
+    texts: Sequence[str],
+    metadatas: Sequence[dict],
+    vectors,
+) -> int:
+    """把一组块写成快照文件（先写临时文件再替换）；返回文件字节数。"""
+    matrix = np.asarray(vectors, dtype="<f4")
+    n = len(ids)
+    if matrix.size == 0:
+        matrix = matrix.reshape(n, 0)
+    if matrix.ndim != 2 or matrix.shape[0] != n or not (n == len(texts) == len(metadatas)):
+        raise ValueError("ids / texts / metadatas / vectors 数量不一致")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = np.ascontiguousarray(matrix / norms, dtype="<f4")
+
+    id_offsets, id_blob = _blob([_id.encode("utf-8") for _id in ids])
+    text_offsets, text_blob = _blob([t.encode("utf-8") for t in texts])
+    meta_offsets, meta_blob = _blob(
+        [json.dumps(m or {}, ensure_ascii=False).encode("utf-8") for m in metadatas]
+    )
+    tokens = np.asarray(
+        [
+            int((m or {}).get("tokens") or count_tokens(t))
+            for t, m in zip(texts, metadatas)
+        ],
+        dtype="<i4",
+    )
+    payloads = {
+        "vectors": matrix.tobytes(),
+        "id_offsets": id_offsets.tobytes(),
+        "ids": id_blob,
+        "text_offsets": text_offsets.tobytes(),
+        "texts": text_blob,
+        "meta_offsets": meta_offsets.tobytes(),
+        "metas": meta_blob,
+        "tokens": tokens.tobytes(),
+    }
+
+    table_end = _HEADER_SIZE + _ENTRY.size * len(_SECTIONS)
+    position = table_end
+    entries = []
+    for name in _SECTIONS:
+        position = -(-position // _ALIGN) * _ALIGN
+        entries.append((position, len(payloads[name])))
+        position += len(payloads[name])
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        header = _HEADER.pack(_MAGIC, _VERSION, n, matrix.shape[1], len(_SECTIONS))
+        f.write(header.ljust(_HEADER_SIZE, b"\0"))
+        for offset, length in entries:
+            f.write(_ENTRY.pack(offset, length))
+        for name, (offset, _length) in zip(_SECTIONS, entries):
+            f.seek(offset)
+            f.write(payloads[name])
+    os.replace(tmp, path)
+    return position
+
+
+def export_snapshot(vector_store, path: str) -> int:
+    """把 numpy 或 Chroma 向量库导出成快照；返回块数。"""
+    state = getattr(vector_store, "_state", None)
+    if state is not None:
+        ids = state.ids[: state.size]
+        texts = state.texts[: state.size]
+        metadatas = state.metadatas[: state.size]
+        vectors = state.matrix[: state.size]
+    else:
+        collection = getattr(vector_store, "_collection", None)
+        if collection is None:
+            raise TypeError(f"不支持导出的向量库: {type(vector_store).__name__}")
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        ids = list(data["ids"])
+        texts = list(data["documents"])
+        metadatas = [m or {} for m in data["metadatas"]]
+        vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    write_snapshot(path, ids, texts, metadatas, vectors)
+    return len(ids)
+
+
+# ------------------------------ 读取 ------------------------------ #
+
+
+class SnapshotIndex:
+    """映射到内存的快照文件；所有数组都是映射上的零拷贝视图。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, dim, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"不是受支持的索引快照: {path}")
+        sections = {}
+        for i, name in enumerate(_SECTIONS[:count]):
+            sections[name] = _ENTRY.unpack_from(self._mm, _HEADER_SIZE + i * _ENTRY.size)
+        self.size = n
+        self.dim = dim
+        self.matrix = self._array(sections["vectors"], "<f4").reshape(n, dim)
+        self._id_offsets = self._array(sections["id_offsets"], "<u8")
+        self._text_offsets = self._array(sections["text_offsets"], "<u8")
+        self._meta_offsets = self._array(sections["meta_offsets"], "<u8")
+        self.tokens = self._array(sections["tokens"], "<i4")
+        self._blobs = {name: sections[name][0] for name in ("ids", "texts", "metas")}
+
+    def _array(self, entry: Tuple[int, int], dtype: str) -> np.ndarray:
+        offset, length = entry
+        itemsize = np.dtype(dtype).itemsize
+        return np.frombuffer(self._mm, dtype=dtype, count=length // itemsize, offset=offset)
+
+    def _string(self, blob: str, offsets: np.ndarray, i: int) -> str:
+        base = self._blobs[blob]
+        return self._mm[base + int(offsets[i]) : base + int(offsets[i + 1])].decode("utf-8")
+
+    def chunk_id(self, i: int) -> str:
+        return self._string("ids", self._id_offsets, i)
+
+    def text(self, i: int) -> str:
+        return self._string("texts", self._text_offsets, i)
+
+    def metadata(self, i: int) -> dict:
+        meta = json.loads(self._string("metas", self._meta_offsets, i))
+        meta.setdefault("tokens", int(self.tokens[i]))
+        return meta
+
+    def document(self, i: int) -> Document:
+        return Document(page_content=self.text(i), metadata=self.metadata(i), id=self.chunk_id(i))
+
+
+class SnapshotVectorStore:
+    """直接在内存映射的快照上做精确余弦检索的只读向量库。
+
+    ``reload`` 发现文件被替换后映射新文件并一次性换入；进行中的检索
+    继续使用旧映射（旧映射在没有引用后随对象回收关闭）。
+    """
+
+    def __init__(self, embedding_function: Embeddings, path: str) -> None:
+        self._embedding_function = embedding_function
+        self.path = path
+        self._index = SnapshotIndex(path)
+        logger.info(
+            "已映射索引快照 %s：%d 块，维度 %d", path, self._index.size, self._index.dim
+        )
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def __len__(self) -> int:
+        return self._index.size
+
+    # ------------------------------ 检索 ------------------------------ #
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if self._index.size == 0:
+            return []
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k)
+
+    def similarity_search_by_vector(
+        self, embedding: Sequence[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)
+        ]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: Sequence[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        index = self._index
+        if index.size == 0 or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+        scores = index.matrix @ query
+        return [(index.document(i), float(scores[i])) for i in top_k_indices(scores, k)]
+
+    # ------------------------------ 只读 ------------------------------ #
+
+    def _read_only(self, *args: Any, **kwargs: Any):
+        raise ReadOnlyIndexError(
+            "索引快照是只读的；请在 numpy 索引上修改后重新导出。"
+        )
+
+    add_texts = add_embeddings = delete = delete_collection = _read_only
+
+    def reload(self) -> bool:
+        """快照文件被替换时重新映射；返回是否换入了新文件。"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if (st.st_size, st.st_mtime_ns, st.st_ino) == self._index.stamp:
+            return False
+        self._index = SnapshotIndex(self.path)
+        logger.info("已重新映射索引快照：%d 块", self._index.size)
+        return True
+
+
+def import_snapshot(path: str, persist_directory: str) -> int:
+    """把快照还原成 ``persist_directory`` 下可写的 numpy 索引；返回块数。"""
+    from .vector_index import NumpyVectorStore
+
+    index = SnapshotIndex(path)
+    store = NumpyVectorStore(
+        embedding_function=None, persist_directory=persist_directory, autosave=False
+    )
+    store.delete_collection()
+    if index.size:
+        store.add_embeddings(
+            [index.text(i) for i in range(index.size)],
+            np.array(index.matrix),
+            metadatas=[index.metadata(i) for i in range(index.size)],
+            ids=[index.chunk_id(i) for i in range(index.size)],
+        )
+    store.persist()
+    return index.size
+
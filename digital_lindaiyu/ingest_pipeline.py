@@ -0,0 +1,503 @@
+"""知识库入库流水线。
+
+原先的入库是严格串行的：逐类型 ``loader.load()`` → 全量切分 →
+每 50 块一次 ``add_texts``（DashScope 内部的 25 条小批也是一批接一批发）。
+这里拆成几级，各级之间用有界队列连接，下游慢时上游自然阻塞（背压）：
+
+    读取（线程池：逐段加载 → 切分，切分可交给进程池）
+        → 嵌入（并发 + 令牌桶限速）→ 写入（单线程）
+
+整个过程是流式的：文件按段（几百 KB 文本 / 若干 PDF 页）读入、切分，
+凑满一批就送去嵌入，任何时刻内存里只有当前各段和队列中的有限几批，
+与语料总量无关——整部《红楼梦》与评注 PDF 也能以平稳的内存入库。
+
+写入只有一个线程，向量库与词法索引无需额外加锁；某个文件的所有批次都写完后
+回调 ``on_file_done``，调用方据此更新入库清单，并按块数 / 时间间隔回调
+``on_checkpoint`` 落盘，中断后重跑会从最后一个检查点继续。
+
+嵌入失败的批次先按指数退避重试，仍失败则逐条嵌入，只有真正嵌不了的块
+才放弃。结束时给出每级、每批的耗时与计数（见 ``profiling``）。
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .config import IngestConfig
+from .manifest import SourceFile
+from .profiling import BatchLog, StageStats, describe_stage
+from .rag import add_precomputed
+from .throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+# 待切分文本小于这个量时进程池的启动开销得不偿失，直接在线程里切
+_PROCESS_SPLIT_MIN_BYTES = 1 << 20
+
+# 嵌入重试的首次退避（秒），之后每次翻倍
+_RETRY_BACKOFF = 0.5
+
+# 嵌入后端的默认 (并发数, 每批条数, 每秒请求数)。DashScope 客户端自己拆批并发、
+# 按配额限速（DASHSCOPE_EMBED_*），这里只需两路交替送批，让它的请求池不断粮
+_EMBED_DEFAULTS = {
+    "dashscope": (2, 50, 0.0),
+    "fastembed": (1, 64, 0.0),
+}
+
+
+def _text_bytes(texts: Iterable[str]) -> int:
+    return sum(len(t.encode("utf-8")) for t in texts)
+
+
+def split_documents(docs: List[Document], splitter_kwargs: dict) -> List[Document]:
+    """切分一个文件的文档；模块级函数，便于在子进程中执行。"""
+    return RecursiveCharacterTextSplitter(**splitter_kwargs).split_documents(docs)
+
+
+@dataclass
+class FileJob:
+    """一个源文件的入库进度。
+
+    文件是流式切分的，批次数要读完整个文件才知道：``total`` 在最后一批
+    发出前才赋值，写入线程写完 ``total`` 批后回调 ``on_file_done``。
+    """
+
+    source: SourceFile
+    ids: List[str] = field(default_factory=list)
+    stale: List[str] = field(default_factory=list)
+    written: int = 0
+    emitted: int = 0
+    done: int = 0
+    total: Optional[int] = None
+    failed: bool = False
+
+
+@dataclass
+class ChunkBatch:
+    job: FileJob
+    ids: List[str]
+    texts: List[str]
+    metadatas: List[dict]
+    vectors: Optional[List[Optional[List[float]]]] = None
+    error: Optional[str] = None
+    nbytes: int = 0
+
+
+# load(source) -> 逐段产出该文件的文档（每段只有几百 KB 文本）
+LoadFn = Callable[[SourceFile], Iterator[List[Document]]]
+# records(chunks, start) -> (id, 文本, metadata)，块从 start 开始编号
+RecordsFn = Callable[
+    [List[Document], int], "tuple[List[str], List[str], List[dict]]"
+]
+# previous(source) -> (上次入库的 chunk id, 这些 chunk 是否已有向量)
+PreviousFn = Callable[[SourceFile], "tuple[set, bool]"]
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        *,
+        load: LoadFn,
+        records: RecordsFn,
+        previous: PreviousFn,
+        on_file_done: Callable[[FileJob], None],
+        vector_store,
+        lexical,
+        splitter_kwargs: dict,
+        config: IngestConfig,
+        embed_backend: str = "",
+        on_checkpoint: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self._load = load
+        self._records = records
+        self._previous = previous
+        self._on_file_done = on_file_done
+        self._on_checkpoint = on_checkpoint
+        self.vector_store = vector_store
+        self.embeddings = getattr(vector_store, "embeddings", None)
+        self.lexical = lexical
+        self.splitter_kwargs = dict(splitter_kwargs)
+        self.config = config
+
+        concurrency, batch_size, rps = _EMBED_DEFAULTS.get(
+            embed_backend, (2, 50, 0.0)
+        )
+        self.embed_concurrency = config.embed_concurrency or concurrency
+        self.embed_batch_size = config.embed_batch_size or batch_size
+        self.bucket = TokenBucket(
+            config.embed_rps or rps, burst=self.embed_concurrency
+        )
+        self.split_workers = config.split_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.stats: List[StageStats] = []
+        self.batches = BatchLog()
+        self.wall = 0.0
+        self.checkpoints = 0
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+    # ------------------------------ 运行 ------------------------------ #
+
+    def run(self, sources: Sequence[SourceFile]) -> List[StageStats]:
+        sources = list(sources)
+        if not sources:
+            return []
+        qsize = self.config.queue_size
+        read_q: queue.Queue = queue.Queue(maxsize=qsize)
+        embed_q: queue.Queue = queue.Queue(maxsize=qsize)
+        write_q: queue.Queue = queue.Queue(maxsize=qsize)
+
+        load_workers = min(self.config.load_workers, len(sources))
+        split_workers = min(self.split_workers, len(sources))
+        embed_workers = self.embed_concurrency if self.embeddings is not None else 1
+        pool = self._process_pool(sources, split_workers)
+
+        # 同一文件的各段必须按顺序切分（块序号连续），所以加载与切分在同一个
+        # 读取线程里交替进行；切分本身仍可交给进程池
+        self._load_stats = StageStats("load", load_workers, "docs")
+        self._split_stats = StageStats(
+            "split", split_workers if pool is not None else load_workers, "chunks"
+        )
+        embed_stats = StageStats("embed", embed_workers, "chunks")
+        write_stats = StageStats("write", 1, "chunks")
+        self.stats = [self._load_stats, self._split_stats, embed_stats, write_stats]
+        self._embed_stats = embed_stats
+        self.batches = BatchLog()
+        self._pool = pool
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+        threads = [
+            *self._stage("read", None, self._read, read_q, embed_q, load_workers, embed_workers),
+            *self._stage("embed", embed_stats, self._embed, embed_q, write_q, embed_workers, 1),
+            *self._stage("write", write_stats, self._write, write_q, None, 1, 0),
+        ]
+        t0 = time.perf_counter()
+        try:
+            for source in sources:
+                read_q.put(source)
+            for _ in range(load_workers):
+                read_q.put(_DONE)
+            for thread in threads:
+                thread.join()
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+            self._pool = None
+        self.wall = time.perf_counter() - t0
+        return self.stats
+
+    def _process_pool(
+        self, sources: Sequence[SourceFile], workers: int
+    ) -> Optional[ProcessPoolExecutor]:
+        if workers <= 1 or sum(s.size for s in sources) < _PROCESS_SPLIT_MIN_BYTES:
+            return None
+        try:
+            # 子进程在首次提交切分时才启动，那时读取、嵌入、写入线程都已在跑
+            # （可能正持有锁与 HTTP 连接），fork 会把这些状态复制进子进程；
+            # spawn 出的子进程只导入本模块，执行模块级的 split_documents
+            return ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        except Exception as e:  # noqa: BLE001
+            logger.warning("无法启动切分进程池，改在线程中切分: %s", e)
+            return None
+
+    def _stage(
+        self,
+        name: str,
+        stats: Optional[StageStats],
+        fn: Callable[[object], Iterator[tuple]],
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue],
+        workers: int,
+        downstream_workers: int,
+    ) -> List[threading.Thread]:
+        """启动一级 worker。``fn`` 是生成器，逐个产出 ``(输出, 单位数, 字节数)``，
+        输出为 None 时不往下游送；向下游阻塞的时间不计入忙碌时间。"""
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def worker() -> None:
+            try:
+                while True:
+                    item = inbox.get()
+                    if item is _DONE:
+                        break
+                    started = time.perf_counter()
+                    busy, units, nbytes, error = 0.0, 0, 0, False
+                    outputs = fn(item)
+                    while True:
+                        t0 = time.perf_counter()
+                        try:
+                            output, n, size = next(outputs)
+                        except StopIteration:
+                            busy += time.perf_counter() - t0
+                            break
+                        except Exception as e:  # noqa: BLE001
+                            busy += time.perf_counter() - t0
+                            logger.warning("入库 %s 阶段出错: %s", name, e)
+                            error = True
+                            break
+                        busy += time.perf_counter() - t0
+                        units += n
+                        nbytes += size
+                        if outbox is not None and output is not None:
+                            outbox.put(output)
+                    if stats is not None:
+                        stats.record(
+                            started, time.perf_counter(), units, error, busy, nbytes
+                        )
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and outbox is not None:
+                    for _ in range(downstream_workers):
+                        outbox.put(_DONE)
+
+        threads = [
+            threading.Thread(target=worker, name=f"ingest-{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    # ------------------------------ 各级 ------------------------------ #
+
+    def _segments(self, source: SourceFile) -> Iterator[List[Document]]:
+        segments = iter(self._load(source))
+        while True:
+            t0 = time.perf_counter()
+            try:
+                docs = next(segments)
+            except StopIteration:
+                return
+            except Exception:
+                self._load_stats.record(t0, time.perf_counter(), 0, True)
+                raise
+            self._load_stats.record(
+                t0,
+                time.perf_counter(),
+                len(docs),
+                nbytes=_text_bytes(d.page_content for d in docs),
+            )
+            yield docs
+
+    def _split(self, docs: List[Document]) -> List[Document]:
+        t0 = time.perf_counter()
+        if self._pool is not None:
+            chunks = self._pool.submit(split_documents, docs, self.splitter_kwargs).result()
+        else:
+            chunks = split_documents(docs, self.splitter_kwargs)
+        self._split_stats.record(
+            t0,
+            time.perf_counter(),
+            len(chunks),
+            nbytes=_text_bytes(d.page_content for d in chunks),
+        )
+        return chunks
+
+    def _read(self, source: SourceFile) -> Iterator[tuple]:
+        """逐段加载、切分一个文件，凑满 ``embed_batch_size`` 就产出一批。
+
+        任何时刻只持有当前一段文本和不足一批的待嵌入块，内存占用与文件大小无关。
+        为了知道哪一批是最后一批，总是压着一批晚一步发出。
+        """
+        job = FileJob(source=source)
+        old_ids, reuse = self._previous(source)
+        size = self.embed_batch_size
+        ids: List[str] = []
+        texts: List[str] = []
+        metadatas: List[dict] = []
+        held: Optional[ChunkBatch] = None
+
+        def take(n: int) -> ChunkBatch:
+            batch = ChunkBatch(job, ids[:n], texts[:n], metadatas[:n])
+            batch.nbytes = _text_bytes(batch.texts)
+            del ids[:n], texts[:n], metadatas[:n]
+            job.emitted += 1
+            return batch
+
+        for docs in self._segments(source):
+            chunks = self._split(docs)
+            seg_ids, seg_texts, seg_metadatas = self._records(chunks, len(job.ids))
+            job.ids.extend(seg_ids)
+            for _id, text, metadata in zip(seg_ids, seg_texts, seg_metadatas):
+                # id 含源文件、序号与内容哈希：相同 id 即相同内容，无需重新嵌入
+                if reuse and _id in old_ids:
+                    continue
+                ids.append(_id)
+                texts.append(text)
+                metadatas.append(metadata)
+            while len(ids) >= size:
+                if held is not None:
+                    yield held, len(held.ids), held.nbytes
+                held = take(size)
+
+        if ids:
+            if held is not None:
+                yield held, len(held.ids), held.nbytes
+            held = take(len(ids))
+        if held is None:
+            # 没有要写的块也走一遍写入线程，由它统一回调 on_file_done
+            held = take(0)
+        current = set(job.ids)
+        job.stale = [_id for _id in old_ids if _id not in current]
+        job.total = job.emitted
+        yield held, len(held.ids), held.nbytes
+
+    def _embed(self, batch: ChunkBatch) -> Iterator[tuple]:
+        if not batch.texts or self.embeddings is None:
+            yield batch, 0, 0
+            return
+        t0 = time.perf_counter()
+        vectors, retries, error = self._embed_with_retry(batch.texts)
+        fallback = vectors is None
+        if fallback:
+            # 整批失败多半是其中个别块有问题（过长、含非法字符），逐条嵌入挽回其余的
+            self._embed_stats.add_fallback()
+            logger.warning(
+                "嵌入 %s 的 %d 块失败（%s），改为逐条嵌入",
+                batch.job.source.path,
+                len(batch.ids),
+                error,
+            )
+            vectors = []
+            for text in batch.texts:
+                vector, _, error = self._embed_with_retry([text], retries=0)
+                vectors.append(vector[0] if vector else None)
+            failed = sum(v is None for v in vectors)
+            if failed:
+                batch.error = error
+                self._embed_stats.add_errors(failed)
+                logger.warning(
+                    "%s 有 %d 块逐条嵌入仍失败，已跳过: %s",
+                    batch.job.source.path,
+                    failed,
+                    error,
+                )
+        batch.vectors = vectors
+        self.batches.add(
+            "embed",
+            batch.job.source.path,
+            len(batch.texts),
+            batch.nbytes,
+            time.perf_counter() - t0,
+            retries=retries,
+            fallback=fallback,
+            error=batch.error is not None,
+        )
+        yield batch, len(batch.texts), batch.nbytes
+
+    def _embed_with_retry(
+        self, texts: List[str], retries: Optional[int] = None
+    ) -> "tuple[Optional[List[List[float]]], int, Optional[str]]":
+        """限速后嵌入，失败按指数退避重试；返回 (向量或 None, 重试次数, 最后的错误)。"""
+        attempts = self.config.embed_retries if retries is None else retries
+        error: Optional[Exception] = None
+        for attempt in range(attempts + 1):
+            if attempt:
+                self._embed_stats.add_retry()
+                time.sleep(_RETRY_BACKOFF * 2 ** (attempt - 1))
+            self._embed_stats.add_throttled(self.bucket.acquire())
+            try:
+                return self.embeddings.embed_documents(texts), attempt, None
+            except Exception as e:  # noqa: BLE001
+                error = e
+        return None, attempts, str(error)
+
+    def _write(self, batch: ChunkBatch) -> Iterator[tuple]:
+        job = batch.job
+        written = 0
+        t0 = time.perf_counter()
+        if batch.ids:
+            # 词法索引与向量库共用同一套 chunk id
+            self.lexical.add(batch.ids, batch.texts, batch.metadatas)
+            if self.vector_store is None:
+                written = len(batch.ids)
+            elif batch.vectors is None:
+                job.failed = True
+            else:
+                keep = [i for i, v in enumerate(batch.vectors) if v is not None]
+                if len(keep) < len(batch.ids):
+                    # 有块没嵌进去：文件记为未完成，下次入库会重试
+                    job.failed = True
+                try:
+                    if keep:
+                        add_precomputed(
+                            self.vector_store,
+                            [batch.texts[i] for i in keep],
+                            [batch.vectors[i] for i in keep],
+                            [batch.metadatas[i] for i in keep],
+                            [batch.ids[i] for i in keep],
+                        )
+                    written = len(keep)
+                except Exception as e:  # noqa: BLE001
+                    job.failed = True
+                    logger.warning("写入 %s 失败: %s", job.source.path, e)
+            self.batches.add(
+                "write",
+                job.source.path,
+                len(batch.ids),
+                batch.nbytes,
+                time.perf_counter() - t0,
+                error=written < len(batch.ids),
+            )
+        job.written += written
+        job.done += 1
+        self._since_checkpoint += written
+        if job.total is not None and job.done == job.total:
+            self._on_file_done(job)
+            self._maybe_checkpoint()
+        yield None, written, batch.nbytes
+
+    def _maybe_checkpoint(self) -> None:
+        """在文件边界上按块数 / 时间间隔落一次检查点（只在写入线程里调用）。"""
+        if self._on_checkpoint is None or not self._since_checkpoint:
+            return
+        cfg = self.config
+        due = (cfg.checkpoint_chunks and self._since_checkpoint >= cfg.checkpoint_chunks) or (
+            cfg.checkpoint_seconds
+            and time.monotonic() - self._last_checkpoint >= cfg.checkpoint_seconds
+        )
+        if not due:
+            return
+        try:
+            self._on_checkpoint()
+            self.checkpoints += 1
+        except Exception as e:  # noqa: BLE001
+            logger.warning("保存入库检查点失败: %s", e)
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+    # ------------------------------ 报告 ------------------------------ #
+
+    def report(self) -> dict:
+        return {
+            "wall_s": round(self.wall, 4),
+            "embed_concurrency": self.embed_concurrency,
+            "embed_batch_size": self.embed_batch_size,
+            "embed_rps": self.bucket.rate or None,
+            "embed_retries": self.config.embed_retries,
+            "checkpoints": self.checkpoints,
+            "stages": [s.as_dict() for s in self.stats],
+            "batches": self.batches.as_dict(),
+        }
+
+    def describe(self) -> Iterable[str]:
+        for s in self.stats:
+            yield describe_stage(s.as_dict())
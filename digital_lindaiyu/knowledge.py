@@ -2,169 +2,421 @@
 
 from __future__ import annotations
 
-import hashlib
+import dataclasses
 import logging
 import os
-from typing import Dict
+import threading
+import time
+from typing import IO, Iterator, List, Optional
 
-from chromadb.config import Settings
-from langchain_chroma import Chroma
 from langchain_community.document_loaders import (
-    DirectoryLoader,
     PyPDFLoader,
-    TextLoader,
     UnstructuredMarkdownLoader,
 )
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 
-from .config import env_flag
+from .config import env_flag, get_embedding_config, get_ingest_config
+from .embedding_cache import content_digest
 from .embeddings import get_embeddings
-from .rag import VECTOR_DIR
+from .ingest_pipeline import FileJob, IngestPipeline
+from .lexical import LexicalIndex, lexical_index_path
+from .manifest import (
+    IngestManifest,
+    SourceFile,
+    manifest_path,
+    open_source,
+    scan_sources,
+    stat_source,
+)
+from .profiling import PhaseTimer
+from .rag import (
+    VECTOR_DIR,
+    bump_index_version,
+    open_vector_store,
+    resolve_vector_backend,
+)
+from .tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
 
 def _stable_id(source: str, chunk_index: int, content: str) -> str:
     """基于源文件、序号和内容哈希生成稳定 ID，便于增量更新。"""
-    digest = hashlib.md5(content.encode("utf-8", errors="ignore")).hexdigest()[:10]
+    digest = content_digest(content)[:10]
     safe_source = source.replace("\\", "/")
     return f"{safe_source}::chunk_{chunk_index}::{digest}"
 
 
-def _build_loaders(base_dirs: Dict[str, str]):
-    loaders = {}
-    for doc_type, dir_path in base_dirs.items():
-        if not (os.path.exists(dir_path) and os.listdir(dir_path)):
-            continue
-        if doc_type == "txt":
-            loaders[doc_type] = DirectoryLoader(
-                dir_path,
-                glob="**/*.txt",
-                loader_cls=TextLoader,
-                loader_kwargs={"encoding": "utf-8"},
-            )
-        elif doc_type == "pdf":
-            loaders[doc_type] = DirectoryLoader(
-                dir_path, glob="**/*.pdf", loader_cls=PyPDFLoader
-            )
-        elif doc_type == "md":
-            loaders[doc_type] = DirectoryLoader(
-                dir_path, glob="**/*.md", loader_cls=UnstructuredMarkdownLoader
-            )
-    return loaders
+_BASE_DIRS = {
+    "txt": "./knowledge/txt",
+    "pdf": "./knowledge/pdf",
+    "md": "./knowledge/md",
+}
+_SPLITTER = {"chunk_size": 500, "chunk_overlap": 50}
+_SEPARATORS = ["\n\n", "\n", "。", "！", "？", ".", "!", "?"]
+
+
+def _iter_text_segments(f: IO[str], segment_chars: int) -> Iterator[str]:
+    """逐行读取文本文件，攒够 ``segment_chars`` 个字符后在空行处断开。
+
+    小于一段的文件与 ``TextLoader`` 读出的全文完全相同，块 id 保持不变；
+    迟迟遇不到空行时到 4 倍段长就在行尾硬断，免得一段无限增长。
+    """
+    buf: List[str] = []
+    size = 0
+    for line in f:
+        buf.append(line)
+        size += len(line)
+        if (size >= segment_chars and not line.strip()) or size >= 4 * segment_chars:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def _iter_source(source: SourceFile, segment_chars: int) -> Iterator[List[Document]]:
+    """按段产出一个源文件的文档：txt 按空行分段，pdf 按页累积，md 整篇。
+
+    顺带把 ``source`` 的大小、mtime 与 md5 更新为这次读到的内容，清单据此记录：
+    txt 边读边算；pdf / md 整文件交给第三方加载器，在加载前重新 stat 并计算。
+    """
+    metadata = {"source": source.path}
+    if source.doc_type == "txt":
+        with open_source(source) as f:
+            for text in _iter_text_segments(f, segment_chars):
+                yield [Document(page_content=text, metadata=dict(metadata))]
+        return
+    if source.doc_type in ("pdf", "md"):
+        stat_source(source)
+    if source.doc_type == "pdf":
+        pages: List[Document] = []
+        size = 0
+        for page in PyPDFLoader(source.path).lazy_load():
+            page.metadata["source"] = source.path
+            pages.append(page)
+            size += len(page.page_content)
+            if size >= segment_chars:
+                yield pages
+                pages, size = [], 0
+        if pages:
+            yield pages
+        return
+    if source.doc_type == "md":
+        docs = UnstructuredMarkdownLoader(source.path).load()
+        for doc in docs:
+            doc.metadata["source"] = source.path
+        yield docs
+        return
+    raise ValueError(f"未知的文档类型: {source.doc_type}")
+
+
+def _chunk_records(chunks: List[Document], start: int = 0):
+    """给一个源文件的一段块编号（从 ``start`` 起）并生成 id / metadata。"""
+    ids, texts, metadatas = [], [], []
+    for chunk_idx, doc in enumerate(chunks, start=start):
+        source = doc.metadata.get("source", "unknown")
+        ids.append(_stable_id(source, chunk_idx, doc.page_content))
+        texts.append(doc.page_content)
+        # 块序号与 token 数供检索时合并相邻块、按预算装填上下文
+        metadatas.append(
+            {
+                **doc.metadata,
+                "chunk_index": chunk_idx,
+                "tokens": count_tokens(doc.page_content),
+            }
+        )
+    return ids, texts, metadatas
 
 
 def load_knowledge_base(
     rebuild: bool | None = None,
     persist_directory: str = VECTOR_DIR,
+    report: Optional[dict] = None,
+    embeddings=None,
 ) -> int:
     """加载 knowledge/ 中的文本到向量库。
 
     Parameters
     ----------
     rebuild : 是否先清空再写入；默认读取 ``DIGITAL_LDY_REBUILD_KB``。
+    embeddings : 复用已加载的嵌入模型（``watch_knowledge_base`` 反复调用时）；
+        默认现场加载。
 
-    Returns 成功写入的 chunk 数量。
+    增量模式按入库清单（``<persist_directory>/manifest.json``）只处理新增或
+    改动的文件，并删除已删除文件的 chunk；``knowledge/`` 没有变化时既不
+    打开嵌入模型也不读文件内容。
+
+    同一批 chunk 会同时写入向量库和二元组 BM25 词法索引
+    （``<persist_directory>/lexical_index.json``）；嵌入模型不可用时只更新词法索引。
+    改动的文件经 ``IngestPipeline`` 流式、并行地加载、切分、嵌入，内存占用
+    与语料大小无关；期间定期落检查点（向量库、词法索引、清单），中断后
+    再次运行会跳过已完成的文件。传入 ``report`` 字典时会填入剖析数据：
+    各串行阶段耗时、流水线每级与每批的耗时 / 吞吐 / 字节 / 重试 / 降级计数
+    （见 ``profiling``）。
+
+    Returns 成功写入向量库的 chunk 数量（无向量库时为写入词法索引的数量）。
+    显式配置了只读的 ``VECTOR_BACKEND=snapshot`` 时抛 ``ReadOnlyIndexError``。
     """
     if rebuild is None:
         rebuild = env_flag("DIGITAL_LDY_REBUILD_KB", False)
+    # 在加载模型之前解析后端：配置错误要直接报出来，
+    # 不能混进下面"嵌入模型不可用"的降级分支里静默只写词法索引
+    backend = resolve_vector_backend(persist_directory=persist_directory, writable=True)
 
-    try:
-        embeddings = get_embeddings()
-    except Exception as e:
-        logger.error("嵌入模型不可用，跳过知识库加载: %s", e)
-        return 0
-
-    settings = Settings(
-        anonymized_telemetry=False,
-        is_persistent=True,
-        chroma_product_telemetry_impl=(
-            "digital_lindaiyu.chroma_noop.NoopTelemetry"
-        ),
-        chroma_telemetry_impl="digital_lindaiyu.chroma_noop.NoopTelemetry",
-    )
-    vector_store = Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embeddings,
-        client_settings=settings,
-    )
+    phases = PhaseTimer()
+    started = time.perf_counter()
+    if report is not None:
+        report["phases"] = phases.as_list()
+        report["total_s"] = 0.0
 
-    if rebuild:
+    for dir_path in _BASE_DIRS.values():
+        os.makedirs(dir_path, exist_ok=True)
+
+    with phases.time("scan"):
+        manifest_file = manifest_path(persist_directory)
+        manifest = IngestManifest() if rebuild else IngestManifest.load(manifest_file)
+        sources = scan_sources(_BASE_DIRS)
+        plan = manifest.plan(sources, _SPLITTER)
+    if report is not None:
+        report.update(
+            files=len(sources),
+            changed=len(plan.changed),
+            removed=len(plan.removed),
+            phases=phases.as_list(),
+            total_s=round(time.perf_counter() - started, 4),
+        )
+    if not rebuild:
+        if plan.is_noop:
+            logger.info("knowledge/ 未变化（%d 个文件），跳过入库。", len(sources))
+            return 0
+        for source in plan.touched:
+            manifest.touch(source)
+        if not (plan.changed or plan.removed):
+            manifest.save(manifest_file)
+            logger.info("仅有 %d 个文件的修改时间变化，内容未变。", len(plan.touched))
+            return 0
+
+    vector_store = None
+    with phases.time("open_store"):
         try:
-            vector_store.delete_collection()
-            vector_store = Chroma(
-                persist_directory=persist_directory,
-                embedding_function=embeddings,
-                client_settings=settings,
+            # 入库马上就要用模型，同步加载，失败时直接走下面的降级分支
+            if embeddings is None:
+                embeddings = get_embeddings(background=False)
+            vector_store = open_vector_store(
+                embeddings, persist_directory, backend=backend, writable=True
             )
-            logger.info("已清空现有向量存储")
         except Exception as e:
-            logger.info("清空向量存储时出错（首次运行可忽略）: %s", e)
+            logger.error("嵌入模型不可用，本次只更新词法索引: %s", e)
+
+        lexical_path = lexical_index_path(persist_directory)
+        lexical = _open_lexical_index(lexical_path, rebuild)
+
+    ingest_cfg = get_ingest_config()
+    if rebuild:
+        if vector_store is not None:
+            try:
+                vector_store.delete_collection()
+                vector_store = open_vector_store(
+                    embeddings, persist_directory, backend=backend, writable=True
+                )
+                logger.info("已清空现有向量存储")
+            except Exception as e:
+                logger.info("清空向量存储时出错（首次运行可忽略）: %s", e)
     else:
         logger.info(
-            "保留现有向量存储（增量模式）；如需重建，设 DIGITAL_LDY_REBUILD_KB=true。"
+            "增量入库：新增/改动 %d 个文件，删除 %d 个，未变 %d 个"
+            "（如需重建，设 DIGITAL_LDY_REBUILD_KB=true）",
+            len(plan.changed),
+            len(plan.removed),
+            len(plan.unchanged) + len(plan.touched),
         )
 
-    base_dirs = {
-        "txt": "./knowledge/txt",
-        "pdf": "./knowledge/pdf",
-        "md": "./knowledge/md",
+    stale: List[str] = []
+    for path in plan.removed:
+        stale.extend(manifest.forget(path))
+
+    # 读取线程只读这份快照；清单本身只在写入线程的回调里修改
+    previous_records = {
+        path: dataclasses.replace(record) for path, record in manifest.files.items()
     }
-    for dir_path in base_dirs.values():
-        os.makedirs(dir_path, exist_ok=True)
+    # 检查点会把清单落盘：待处理文件的旧记录先标成未完成，
+    # 这样中途中断后重跑仍会处理它们（已算过的向量在块向量库里，不必重新嵌入）
+    for source in plan.changed:
+        record = manifest.files.get(source.path)
+        if record is not None:
+            record.embedded = False
+    manifest.splitter = dict(_SPLITTER)
+    if rebuild:
+        # 旧清单描述的是刚清空的库，立即覆盖，免得中断后被当成已完成
+        _save_manifest(manifest, manifest_file)
+
+    def previous(source: SourceFile):
+        record = previous_records.get(source.path)
+        if record is None:
+            return set(), False
+        return set(record.chunk_ids), record.embedded
+
+    total_written = 0
+
+    def on_file_done(job: FileJob) -> None:
+        nonlocal total_written
+        stale.extend(job.stale)
+        total_written += job.written
+        manifest.record(
+            job.source, job.ids, embedded=vector_store is not None and not job.failed
+        )
+        logger.info("%s：%d 块，写入 %d 块", job.source.path, len(job.ids), job.written)
+
+    def checkpoint() -> None:
+        # 先落数据再落清单：清单里记为完成的文件，其 chunk 一定已在磁盘上
+        # （在写入线程里执行，耗时计入 write 阶段，不另计 phases）
+        _delete_stale(vector_store, lexical, manifest, stale, sweep=False)
+        stale.clear()
+        persist = getattr(vector_store, "persist", None)
+        if persist is not None:
+            persist()
+        lexical.save(lexical_path)
+        manifest.save(manifest_file)
+        logger.info("入库检查点：已完成 %d 个文件", len(manifest.files))
+
+    pipeline = IngestPipeline(
+        load=lambda source: _iter_source(source, ingest_cfg.segment_chars),
+        records=_chunk_records,
+        previous=previous,
+        on_file_done=on_file_done,
+        vector_store=vector_store,
+        lexical=lexical,
+        splitter_kwargs={**_SPLITTER, "separators": _SEPARATORS},
+        config=ingest_cfg,
+        embed_backend=get_embedding_config().backend,
+        on_checkpoint=checkpoint,
+    )
+    # numpy 索引每次写入都会整体落盘；批量入库期间关掉，结束时只写一次
+    autosave = getattr(vector_store, "autosave", None)
+    if autosave:
+        vector_store.autosave = False
+    try:
+        with phases.time("pipeline"):
+            pipeline.run(plan.changed)
+        with phases.time("delete_stale"):
+            _delete_stale(vector_store, lexical, manifest, stale)
+    finally:
+        if autosave:
+            with phases.time("persist_vectors"):
+                vector_store.autosave = True
+                vector_store.persist()
+    if plan.changed:
+        for line in pipeline.describe():
+            logger.info("入库流水线 %s", line)
+        logger.info("入库流水线总耗时 %.2fs", pipeline.wall)
 
-    loaders = _build_loaders(base_dirs)
-    documents = []
-    for doc_type, loader in loaders.items():
+    with phases.time("save_lexical"):
         try:
-            docs = loader.load()
-            logger.info("已加载 %s 文件 %d 篇", doc_type, len(docs))
-            documents.extend(docs)
+            lexical.save(lexical_path)
+            logger.info("词法索引已更新，共 %d 块", len(lexical))
         except Exception as e:
-            logger.warning("加载 %s 文档时出错: %s", doc_type, e)
+            logger.warning("保存词法索引失败: %s", e)
+    with phases.time("save_manifest"):
+        _save_manifest(manifest, manifest_file)
+        # 索引内容变了：换版本戳，让检索结果缓存失效
+        bump_index_version(persist_directory)
+    if report is not None:
+        report.update(pipeline.report())
+        report["phases"] = phases.as_list()
+        report["total_s"] = round(time.perf_counter() - started, 4)
 
-    if not documents:
-        logger.warning("没有成功加载任何文档")
-        return 0
+    if not sources:
+        logger.warning("knowledge/ 中没有可加载的文档")
+    if vector_store is None:
+        return total_written
+    describe = getattr(embeddings, "describe_chunk_stats", None)
+    if describe is not None:
+        logger.info(describe())
+    logger.info("向量存储更新完成，新增 %d 块", total_written)
+    return total_written
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
-        separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?"],
-    )
-    splits = splitter.split_documents(documents)
-    logger.info("文档分割完成，共 %d 块", len(splits))
-    if not splits:
-        return 0
-
-    # 给每个源文件分配独立的 chunk 计数器，避免 ID 冲突
-    per_source_index: Dict[str, int] = {}
-    total_added = 0
-    batch_size = 50
-
-    for i in range(0, len(splits), batch_size):
-        batch = splits[i : i + batch_size]
-        ids, texts, metadatas = [], [], []
-        for doc in batch:
-            source = doc.metadata.get("source", "unknown")
-            chunk_idx = per_source_index.get(source, 0)
-            per_source_index[source] = chunk_idx + 1
-            ids.append(_stable_id(source, chunk_idx, doc.page_content))
-            texts.append(doc.page_content)
-            metadatas.append(doc.metadata)
+
+def watch_knowledge_base(
+    persist_directory: str = VECTOR_DIR,
+    interval: float = 2.0,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """轮询 ``knowledge/``，文件有变化时做一次增量入库，直到 ``stop`` 被置位。
+
+    每轮只 stat 一遍源文件；发现变化后再等一个周期确认写入已结束
+    （编辑器保存、批量拷贝），才调用 ``load_knowledge_base``。只有受影响的
+    chunk 会重新嵌入，写出的新一代索引由运行中的 ``ChatEngine`` 自动换入。
+    """
+    stop = stop or threading.Event()
+    # 只读快照后端每轮都会入库失败，启动时就报错退出
+    resolve_vector_backend(persist_directory=persist_directory, writable=True)
+    embeddings = None
+    try:
+        embeddings = get_embeddings(background=False)
+    except Exception as e:
+        logger.error("嵌入模型不可用，监视期间只更新词法索引: %s", e)
+
+    def snapshot():
+        return tuple((s.path, s.size, s.mtime_ns) for s in scan_sources(_BASE_DIRS))
+
+    logger.info("开始监视 knowledge/（每 %.1fs 检查一次）", interval)
+    last = None
+    while True:
+        current = snapshot()
+        if current != last:
+            if last is not None and stop.wait(interval):
+                return
+            if last is not None and snapshot() != current:
+                continue  # 仍在写入，下一轮再看
+            try:
+                count = load_knowledge_base(
+                    persist_directory=persist_directory, embeddings=embeddings
+                )
+                if count:
+                    logger.info("增量入库完成，写入 %d 块", count)
+            except Exception as e:
+                logger.error("增量入库失败，等待下一次变化: %s", e)
+            last = current
+        if stop.wait(interval):
+            return
+
+
+def _save_manifest(manifest: IngestManifest, path: str) -> None:
+    try:
+        manifest.save(path)
+    except Exception as e:
+        logger.warning("保存入库清单失败: %s", e)
+
+
+def _delete_stale(
+    vector_store, lexical: LexicalIndex, manifest, stale, sweep: bool = True
+) -> None:
+    """删除过期 chunk：已删文件、改动文件中消失的块，以及清单之外的旧版本遗留。
+
+    入库进行中（检查点）不做 ``sweep``：正在写的文件还没进清单，其 chunk 不能当遗留删掉。
+    """
+    live = manifest.all_chunk_ids()
+    stale = list(stale)
+    if sweep:
+        stale.extend(_id for _id in lexical.ids() if _id not in live)
+    stale = list(dict.fromkeys(_id for _id in stale if _id not in live))
+    if not stale:
+        return
+    lexical.remove(stale)
+    if vector_store is not None:
         try:
-            vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-            total_added += len(batch)
+            vector_store.delete(ids=stale)
         except Exception as e:
-            logger.warning("批量添加失败 %s；改为逐条添加", e)
-            for text, meta, _id in zip(texts, metadatas, ids):
-                try:
-                    vector_store.add_texts(
-                        texts=[text], metadatas=[meta], ids=[_id]
-                    )
-                    total_added += 1
-                except Exception as inner:
-                    logger.warning("单条添加失败: %s", inner)
-
-    logger.info("向量存储更新完成，新增 %d 块", total_added)
-    return total_added
+            logger.warning("删除过期 chunk 失败: %s", e)
+    logger.info("已删除 %d 个过期 chunk", len(stale))
+
+
+def _open_lexical_index(path: str, rebuild: bool) -> LexicalIndex:
+    """增量模式下在已有词法索引上追加；重建或读取失败时从空索引开始。"""
+    if rebuild or not os.path.exists(path):
+        return LexicalIndex()
+    try:
+        return LexicalIndex.load(path)
+    except Exception as e:
+        logger.warning("读取旧词法索引失败，将重新构建: %s", e)
+        return LexicalIndex()
@@ -0,0 +1,185 @@
+"""逐轮记录 LLM 的 token 用量、上下文缓存命中与首字延迟。
+
+DeepSeek 会把与此前请求相同的提示词前缀缓存在服务端：命中部分既不必重新
+预填充（首字更快），计费也只有未命中部分的零头。流式响应的最后一个分片里带着
+``usage``：
+
+- DeepSeek：``prompt_cache_hit_tokens`` / ``prompt_cache_miss_tokens``；
+- OpenAI 兼容接口：``prompt_tokens_details.cached_tokens``；
+- LangChain：``usage_metadata["input_token_details"]["cache_read"]``。
+
+``parse_usage`` 统一成同一组字段；一轮对话可能包含多次请求（工具调用、续写），
+``TurnUsage`` 把它们累加起来，``UsageLog`` 保留最近若干轮并给出总计。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+# 保留的最近轮数
+_MAX_TURNS = 200
+
+
+def _get(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def parse_usage(usage: Any) -> Optional[Dict[str, int]]:
+    """把各家的 usage 对象 / 字典统一成 prompt / completion / cache_hit / cache_miss。"""
+    if usage is None:
+        return None
+    prompt = _get(usage, "prompt_tokens")
+    if prompt is None:
+        prompt = _get(usage, "input_tokens")  # LangChain usage_metadata
+    completion = _get(usage, "completion_tokens")
+    if completion is None:
+        completion = _get(usage, "output_tokens")
+    prompt = int(prompt or 0)
+    hit = _get(usage, "prompt_cache_hit_tokens")
+    miss = _get(usage, "prompt_cache_miss_tokens")
+    if hit is None:
+        hit = _get(_get(usage, "prompt_tokens_details"), "cached_tokens")
+    if hit is None:
+        hit = _get(_get(usage, "input_token_details"), "cache_read")
+    hit = int(hit or 0)
+    miss = int(miss) if miss is not None else max(0, prompt - hit)
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": int(completion or 0),
+        "cache_hit_tokens": hit,
+        "cache_miss_tokens": miss,
+    }
+
+
+@dataclass
+class TurnUsage:
+    """一轮对话里所有 LLM 请求的用量之和。"""
+
+    thread_id: str
+    path: str                      # "agent"（工具调用链路）/ "rag"（LangGraph 链路）
+    started: float = field(default_factory=time.time)
+    requests: int = 0
+    reported: int = 0              # 其中带回 usage 的请求数
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hit_tokens: int = 0
+    cache_miss_tokens: int = 0
+    ttft: Optional[float] = None   # 第一次请求发出到第一个输出分片（秒）
+    seconds: float = 0.0           # 各次请求耗时之和
+
+    def request_started(self) -> float:
+        self.requests += 1
+        return time.perf_counter()
+
+    def first_token(self, t0: float) -> None:
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - t0
+
+    def request_finished(self, t0: float, usage: Any = None) -> None:
+        self.seconds += time.perf_counter() - t0
+        parsed = parse_usage(usage)
+        if parsed is None:
+            return
+        self.reported += 1
+        self.prompt_tokens += parsed["prompt_tokens"]
+        self.completion_tokens += parsed["completion_tokens"]
+        self.cache_hit_tokens += parsed["cache_hit_tokens"]
+        self.cache_miss_tokens += parsed["cache_miss_tokens"]
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.cache_hit_tokens + self.cache_miss_tokens
+        return self.cache_hit_tokens / total if total else None
+
+    def as_dict(self) -> dict:
+        return {
+            "thread_id": self.thread_id,
+            "path": self.path,
+            "started": round(self.started, 3),
+            "requests": self.requests,
+            "reported": self.reported,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_tokens": self.cache_hit_tokens,
+            "cache_miss_tokens": self.cache_miss_tokens,
+            "cache_hit_rate": (
+                round(self.hit_rate, 4) if self.hit_rate is not None else None
+            ),
+            "ttft_s": round(self.ttft, 4) if self.ttft is not None else None,
+            "seconds": round(self.seconds, 4),
+        }
+
+    def describe(self) -> str:
+        text = f"LLM 请求 {self.requests} 次"
+        if not self.reported:
+            text += "（接口未返回用量）"
+        else:
+            text += f"：提示词 {self.prompt_tokens} token"
+            if self.hit_rate is not None:
+                text += f"，缓存命中 {self.cache_hit_tokens}（{self.hit_rate:.0%}）"
+            text += f"，输出 {self.completion_tokens}"
+        if self.ttft is not None:
+            text += f"，首字 {self.ttft:.2f}s"
+        return text
+
+
+class UsageLog:
+    """最近若干轮的 ``TurnUsage`` 与累计总数（线程安全）。"""
+
+    def __init__(self, limit: int = _MAX_TURNS) -> None:
+        self.turns: Deque[TurnUsage] = deque(maxlen=limit)
+        self._totals = TurnUsage(thread_id="*", path="*")
+        self._ttfts: Deque[float] = deque(maxlen=limit)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def begin(self, thread_id: str, path: str) -> TurnUsage:
+        return TurnUsage(thread_id=thread_id, path=path)
+
+    def finish(self, turn: TurnUsage) -> None:
+        with self._lock:
+            self.turns.append(turn)
+            self._count += 1
+            totals = self._totals
+            totals.requests += turn.requests
+            totals.reported += turn.reported
+            totals.prompt_tokens += turn.prompt_tokens
+            totals.completion_tokens += turn.completion_tokens
+            totals.cache_hit_tokens += turn.cache_hit_tokens
+            totals.cache_miss_tokens += turn.cache_miss_tokens
+            totals.seconds += turn.seconds
+            if turn.ttft is not None:
+                self._ttfts.append(turn.ttft)
+
+    @property
+    def last(self) -> Optional[TurnUsage]:
+        with self._lock:
+            return self.turns[-1] if self.turns else None
+
+    def summary(self) -> dict:
+        with self._lock:
+            totals = self._totals.as_dict()
+            ttfts = sorted(self._ttfts)
+            count = self._count
+        for key in ("thread_id", "path", "started", "ttft_s"):
+            totals.pop(key)
+        totals["turns"] = count
+        totals["ttft_p50_s"] = round(ttfts[len(ttfts) // 2], 4) if ttfts else None
+        return totals
+
+    def describe_totals(self) -> str:
+        s = self.summary()
+        rate = s["cache_hit_rate"]
+        return (
+            f"累计提示词 {s['prompt_tokens']} token，缓存命中 {s['cache_hit_tokens']}"
+            + (f"（{rate:.0%}）" if rate is not None else "")
+            + (f"，首字中位数 {s['ttft_p50_s']:.2f}s" if s["ttft_p50_s"] is not None else "")
+        )
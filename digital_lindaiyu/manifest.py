@@ -0,0 +1,242 @@
+"""知识库入库清单：记录每个源文件的大小、mtime、内容哈希与产出的 chunk id。
+
+``load_knowledge_base`` 据此只处理新增或改动的文件，并删除已删除文件
+（以及改动文件中不再存在）的 chunk。大小与 mtime 都没变的文件连内容都不读，
+因此 ``knowledge/`` 没有变化时一次运行只是若干次 ``stat``。
+
+清单保存在 ``<persist_directory>/manifest.json``。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+_FORMAT_VERSION = 1
+
+
+@dataclass
+class FileRecord:
+    size: int
+    mtime_ns: int
+    md5: str
+    chunk_ids: List[str] = field(default_factory=list)
+    embedded: bool = True   # False：上次只写进了词法索引（嵌入模型不可用）
+
+
+@dataclass
+class SourceFile:
+    """本次扫描到的一个源文件。"""
+
+    path: str          # 作为 chunk metadata["source"] 的路径
+    doc_type: str      # txt / pdf / md
+    size: int
+    mtime_ns: int
+    md5: Optional[str] = None   # 比对时只有 stat 变化才计算；入库时取自实际读到的字节
+
+
+@dataclass
+class IngestPlan:
+    changed: List[SourceFile] = field(default_factory=list)
+    unchanged: List[SourceFile] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # 内容没变、只是 mtime 被碰过的文件：只需更新清单
+    touched: List[SourceFile] = field(default_factory=list)
+
+    @property
+    def is_noop(self) -> bool:
+        return not (self.changed or self.removed or self.touched)
+
+
+class IngestManifest:
+    def __init__(self, splitter: Optional[dict] = None) -> None:
+        self.splitter = dict(splitter or {})
+        self.files: Dict[str, FileRecord] = {}
+
+    # ------------------------------ 持久化 ------------------------------ #
+
+    @classmethod
+    def load(cls, path: str) -> "IngestManifest":
+        manifest = cls()
+        if not os.path.exists(path):
+            return manifest
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != _FORMAT_VERSION:
+                raise ValueError(f"不支持的清单版本: {payload.get('version')}")
+            manifest.splitter = payload.get("splitter") or {}
+            manifest.files = {
+                source: FileRecord(**record)
+                for source, record in payload.get("files", {}).items()
+            }
+        except Exception as e:
+            logger.warning("读取入库清单失败，将按全新入库处理: %s", e)
+            return cls()
+        return manifest
+
+    def save(self, path: str) -> None:
+        payload = {
+            "version": _FORMAT_VERSION,
+            "splitter": self.splitter,
+            "files": {source: asdict(r) for source, r in sorted(self.files.items())},
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    # ------------------------------ 比对 ------------------------------ #
+
+    def plan(self, sources: List[SourceFile], splitter: dict) -> IngestPlan:
+        """把本次扫描结果与清单比对。切分参数变了则全部视为改动。"""
+        plan = IngestPlan()
+        resplit = splitter != self.splitter
+        seen = set()
+        for source in sources:
+            seen.add(source.path)
+            record = self.files.get(source.path)
+            if record is None or resplit or not record.embedded:
+                plan.changed.append(source)
+                continue
+            if record.size == source.size and record.mtime_ns == source.mtime_ns:
+                plan.unchanged.append(source)
+                continue
+            source.md5 = file_md5(source.path)
+            if source.md5 == record.md5:
+                plan.touched.append(source)
+            else:
+                plan.changed.append(source)
+        plan.removed = [path for path in self.files if path not in seen]
+        return plan
+
+    def chunk_ids(self, source: str) -> List[str]:
+        record = self.files.get(source)
+        return list(record.chunk_ids) if record else []
+
+    def all_chunk_ids(self) -> set:
+        ids = set()
+        for record in self.files.values():
+            ids.update(record.chunk_ids)
+        return ids
+
+    def record(
+        self, source: SourceFile, chunk_ids: List[str], embedded: bool = True
+    ) -> None:
+        """记下一个已入库的文件。``source`` 的大小、mtime 与 md5 须由读取阶段
+        （``open_source`` / ``stat_source``）填好，这里不再事后读文件：
+        入库期间文件被改写时，清单记的仍是产出这些 chunk 的那份内容。"""
+        if source.md5 is None:
+            raise ValueError(f"{source.path} 没有读取阶段的 md5，不能记入清单")
+        self.files[source.path] = FileRecord(
+            size=source.size,
+            mtime_ns=source.mtime_ns,
+            md5=source.md5,
+            chunk_ids=list(chunk_ids),
+            embedded=embedded,
+        )
+
+    def touch(self, source: SourceFile) -> None:
+        record = self.files[source.path]
+        record.size = source.size
+        record.mtime_ns = source.mtime_ns
+
+    def forget(self, source: str) -> Tuple[str, ...]:
+        record = self.files.pop(source, None)
+        return tuple(record.chunk_ids) if record else ()
+
+
+def manifest_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, MANIFEST_FILE)
+
+
+def file_md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_source(source: SourceFile) -> None:
+    """重新 stat 并计算 md5，供整文件交给第三方加载器的类型在读取前调用。"""
+    st = os.stat(source.path)
+    source.size, source.mtime_ns = st.st_size, st.st_mtime_ns
+    source.md5 = file_md5(source.path)
+
+
+class _HashingReader(io.RawIOBase):
+    """边读边算 md5；读到文件末尾时把哈希写回 ``source.md5``。"""
+
+    def __init__(self, source: SourceFile) -> None:
+        self._source = source
+        self._file = open(source.path, "rb")
+        st = os.fstat(self._file.fileno())
+        source.size, source.mtime_ns, source.md5 = st.st_size, st.st_mtime_ns, None
+        self._digest = hashlib.md5()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._file.readinto(b)
+        if n:
+            self._digest.update(memoryview(b)[:n])
+        elif self._source.md5 is None:
+            self._source.md5 = self._digest.hexdigest()
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def open_source(source: SourceFile, encoding: str = "utf-8") -> io.TextIOWrapper:
+    """以文本方式打开源文件，大小、mtime 与 md5 都取自这次实际读到的字节。
+
+    md5 只在读到文件末尾时才填上，中途失败的文件不会带着半截哈希记入清单。
+    """
+    return io.TextIOWrapper(io.BufferedReader(_HashingReader(source)), encoding=encoding)
+
+
+_PATTERNS = {"txt": ".txt", "pdf": ".pdf", "md": ".md"}
+
+
+def scan_sources(base_dirs: Dict[str, str]) -> List[SourceFile]:
+    """递归列出各类型目录下的源文件（只 stat，不读内容），按路径排序。"""
+    sources: List[SourceFile] = []
+    for doc_type, dir_path in base_dirs.items():
+        suffix = _PATTERNS.get(doc_type)
+        if suffix is None or not os.path.isdir(dir_path):
+            continue
+        for root, _dirs, files in os.walk(dir_path):
+            for name in files:
+                if not name.lower().endswith(suffix):
+                    continue
+                # 与 DirectoryLoader 产出的 source 写法一致（knowledge/txt/...），
+                # 这样旧库中的 chunk id 保持不变
+                path = os.path.normpath(os.path.join(root, name))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                sources.append(
+                    SourceFile(
+                        path=path,
+                        doc_type=doc_type,
+                        size=st.st_size,
+                        mtime_ns=st.st_mtime_ns,
+                    )
+                )
+    sources.sort(key=lambda s: s.path)
+    return sources
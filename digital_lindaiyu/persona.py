@@ -2,11 +2,12 @@
 
 from __future__ import annotations
 
+import os
 from functools import lru_cache
 
 from .resources import read_text_resource
 
-PROMPT_RESOURCE = r"resources\prompt.txt"
+PROMPT_RESOURCE = os.path.join("resources", "prompt.txt")
 
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,124 @@
+"""用户输入时的投机式知识预取。
+
+工具调用链路要等模型第一轮决定调用 ``search_knowledge_base`` 之后才检索，
+嵌入与检索延迟全落在关键路径上。这里在用户打字时就拿草稿去做
+``embed_query`` + 检索：查询向量进入嵌入缓存，检索结果进入工具结果缓存
+和本地的预取表；真正发送时 ``_node_retrieve`` / 工具调用直接读缓存。
+
+所有工作都在单个后台线程里完成，``submit`` 只改一个变量并唤醒线程，
+不会阻塞 Qt 主线程；草稿一变，进行中的结果即被丢弃。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from langchain_core.documents import Document
+
+from .agent_tools import prime_search_cache
+from .cache import LRUCache, normalize_query
+from .embedding_cache import CachedEmbeddings
+from .rag import index_version, retrieve_documents
+
+logger = logging.getLogger(__name__)
+
+# 太短的草稿（一两个字）检索意义不大
+_MIN_QUERY_CHARS = 2
+
+
+class RetrievalPrefetcher:
+    """后台预取最新草稿的检索结果；只保留最新一份待办草稿。"""
+
+    def __init__(
+        self,
+        vector_store,
+        top_k: Callable[[], int],
+        max_results: int = 8,
+    ) -> None:
+        self.vector_store = vector_store
+        self._top_k = top_k
+        self._results: LRUCache[List[Document]] = LRUCache(maxsize=max_results)
+        self._cond = threading.Condition()
+        self._pending: Optional[str] = None
+        self._generation = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._loop, name="RetrievalPrefetcher", daemon=True
+        )
+        self._thread.start()
+
+    # ---------------------------- public API ---------------------------- #
+
+    def submit(self, draft: str) -> None:
+        """提交最新草稿；旧草稿（含正在处理的）作废。
+
+        清空或过短的草稿（如发送后输入框被清空）只撤销待办，
+        不打断已在进行的预取，刚发送的那句仍能用上结果。
+        """
+        draft = (draft or "").strip()
+        with self._cond:
+            if len(normalize_query(draft)) < _MIN_QUERY_CHARS:
+                self._pending = None
+                return
+            self._generation += 1
+            self._pending = draft
+            self._cond.notify()
+
+    def take(self, query: str, top_k: int) -> Optional[List[Document]]:
+        """若该查询已预取且知识库版本未变，返回检索结果；否则返回 None。"""
+        return self._results.get(self._key(query, top_k))
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify()
+
+    # ---------------------------- worker ---------------------------- #
+
+    @staticmethod
+    def _key(query: str, top_k: int) -> tuple:
+        return (index_version(), normalize_query(query), top_k)
+
+    def _is_current(self, generation: int) -> bool:
+        with self._cond:
+            return generation == self._generation and not self._closed
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                draft = self._pending
+                generation = self._generation
+                self._pending = None
+            try:
+                self._prefetch(draft, generation)
+            except Exception as e:  # noqa: BLE001
+                logger.debug("预取失败（忽略）: %s", e)
+
+    def _prefetch(self, draft: str, generation: int) -> None:
+        top_k = self._top_k()
+        if top_k <= 0:
+            return
+        key = self._key(draft, top_k)
+        if self._results.peek(key) is not None:
+            return
+
+        # 先单独算查询向量：即使检索结果被丢弃，向量也已进入嵌入缓存
+        embeddings = getattr(self.vector_store, "embeddings", None)
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings.embed_query(draft)
+        if not self._is_current(generation):
+            return
+
+        docs = retrieve_documents(self.vector_store, draft, top_k=top_k)
+        if not self._is_current(generation):
+            return
+        self._results.put(key, docs)
+        prime_search_cache(draft, top_k, docs)
+        logger.debug("已预取草稿检索结果: %s", draft[:40])
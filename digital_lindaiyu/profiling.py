@@ -0,0 +1,272 @@
+"""入库剖析：每级、每批的耗时与计数。
+
+``load_knowledge_base`` 慢的时候，单看几行日志分不清是加载、切分、嵌入
+还是向量库写入拖了后腿；某一批嵌入失败后的重试与逐条降级更是悄无声息。
+这里收集三类数据，汇总进 ``load_knowledge_base(report=...)`` 的报告：
+
+- ``StageStats``：流水线每级的件数、块数、字节数、忙碌 / 限速时间、
+  重试与降级次数；
+- ``BatchLog``：每个嵌入 / 写入批次一条记录（文件、块数、字节、耗时、
+  重试次数、是否降级），给出分位数与最慢的几批；
+- ``PhaseTimer``：流水线之外的串行阶段（扫描、打开模型、清理过期块、落盘）。
+
+``format_profile`` 把报告排成可读摘要；``scripts/load_kb.py --profile``
+同时输出摘要与 JSON。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# 每批一条记录；语料极大时只保留前这么多条，其余只计入汇总
+_MAX_BATCH_RECORDS = 5000
+
+
+def _rate(amount: float, seconds: float) -> Optional[float]:
+    return round(amount / seconds, 2) if seconds > 0 else None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    unit: str
+    items: int = 0          # 处理的输入件数
+    units: int = 0          # 产出的文档 / 块数
+    bytes: int = 0          # 处理的文本字节数（UTF-8）
+    busy: float = 0.0       # 各 worker 干活时间之和（秒）
+    throttled: float = 0.0  # 其中因限速等待的时间
+    retries: int = 0        # 失败后重试的请求数
+    fallbacks: int = 0      # 整批失败、改为逐条处理的批数
+    errors: int = 0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(
+        self,
+        t0: float,
+        t1: float,
+        units: int,
+        error: bool = False,
+        busy: Optional[float] = None,
+        nbytes: int = 0,
+    ) -> None:
+        with self._lock:
+            self.items += 1
+            self.units += units
+            self.bytes += nbytes
+            self.busy += t1 - t0 if busy is None else busy
+            self.errors += int(error)
+            self.started = t0 if self.started is None else min(self.started, t0)
+            self.finished = t1 if self.finished is None else max(self.finished, t1)
+
+    def add_throttled(self, seconds: float) -> None:
+        with self._lock:
+            self.throttled += seconds
+
+    def add_retry(self, count: int = 1) -> None:
+        with self._lock:
+            self.retries += count
+
+    def add_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def add_errors(self, count: int) -> None:
+        with self._lock:
+            self.errors += count
+
+    @property
+    def wall(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def as_dict(self) -> dict:
+        wall = self.wall
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "units": self.units,
+            "unit": self.unit,
+            "bytes": self.bytes,
+            "wall_s": round(wall, 4),
+            "busy_s": round(self.busy, 4),
+            "throttled_s": round(self.throttled, 4),
+            "throughput_per_s": _rate(self.units, wall),
+            "bytes_per_s": _rate(self.bytes, wall),
+            "utilization": (
+                round(self.busy / (wall * self.workers), 3) if wall > 0 else None
+            ),
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+        }
+
+
+class BatchLog:
+    """线程安全的逐批记录。"""
+
+    def __init__(self, limit: int = _MAX_BATCH_RECORDS) -> None:
+        self.limit = limit
+        self.records: List[dict] = []
+        self.dropped = 0
+        self._seconds: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        stage: str,
+        source: str,
+        items: int,
+        nbytes: int,
+        seconds: float,
+        retries: int = 0,
+        fallback: bool = False,
+        error: bool = False,
+    ) -> None:
+        record = {
+            "stage": stage,
+            "source": source,
+            "items": items,
+            "bytes": nbytes,
+            "seconds": round(seconds, 4),
+            "retries": retries,
+            "fallback": fallback,
+            "error": error,
+        }
+        with self._lock:
+            self._seconds.setdefault(stage, []).append(seconds)
+            if len(self.records) < self.limit:
+                self.records.append(record)
+            else:
+                self.dropped += 1
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            seconds = {stage: list(v) for stage, v in self._seconds.items()}
+        return {
+            stage: {
+                "batches": len(values),
+                "p50_s": round(_percentile(values, 0.5), 4),
+                "p95_s": round(_percentile(values, 0.95), 4),
+                "max_s": round(max(values), 4),
+            }
+            for stage, values in seconds.items()
+        }
+
+    def slowest(self, n: int = 5) -> List[dict]:
+        with self._lock:
+            records = list(self.records)
+        return sorted(records, key=lambda r: r["seconds"], reverse=True)[:n]
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            records = list(self.records)
+            dropped = self.dropped
+        return {
+            "summary": self.summary(),
+            "slowest": self.slowest(),
+            "records": records,
+            "dropped": dropped,
+        }
+
+
+class PhaseTimer:
+    """按名字累计串行阶段的耗时，保持首次出现的顺序。"""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def as_list(self) -> List[dict]:
+        return [{"phase": k, "seconds": round(v, 4)} for k, v in self.phases.items()]
+
+
+# ------------------------------ 输出 ------------------------------ #
+
+
+def describe_stage(d: dict) -> str:
+    """``StageStats.as_dict()`` 的一行摘要。"""
+    rate = d["throughput_per_s"]
+    return (
+        f"{d['stage']:<5} ×{d['workers']:<2} {d['units']:>6} {d['unit']:<6}"
+        f" {_format_bytes(d.get('bytes', 0)):>8}"
+        f" wall {d['wall_s']:.2f}s busy {d['busy_s']:.2f}s"
+        + (f" 限速 {d['throttled_s']:.2f}s" if d["throttled_s"] else "")
+        + (f" {rate}/s" if rate is not None else "")
+        + (f" 重试 {d['retries']}" if d.get("retries") else "")
+        + (f" 逐条降级 {d['fallbacks']} 批" if d.get("fallbacks") else "")
+        + (f" 错误 {d['errors']}" if d["errors"] else "")
+    )
+
+
+def format_profile(report: dict) -> Iterable[str]:
+    """把 ``load_knowledge_base`` 的报告排成可读摘要。"""
+    total = report.get("total_s")
+    yield f"入库总耗时 {total:.2f}s" if total is not None else "入库剖析"
+    phases = report.get("phases") or []
+    if phases:
+        yield "阶段:"
+        for p in phases:
+            share = f"{p['seconds'] / total:>6.1%}" if total else ""
+            yield f"  {p['phase']:<12} {p['seconds']:>8.3f}s {share}"
+    stages = report.get("stages") or []
+    if stages:
+        yield (
+            f"流水线 {report.get('wall_s', 0.0):.2f}s"
+            f"（嵌入并发 {report.get('embed_concurrency')}，"
+            f"每批 {report.get('embed_batch_size')} 块，"
+            f"检查点 {report.get('checkpoints', 0)} 次）:"
+        )
+        for d in stages:
+            yield "  " + describe_stage(d)
+    batches = report.get("batches") or {}
+    summary = batches.get("summary") or {}
+    if summary:
+        yield "批次耗时:"
+        for stage, s in summary.items():
+            yield (
+                f"  {stage:<5} {s['batches']:>5} 批"
+                f" p50 {s['p50_s'] * 1000:.0f}ms p95 {s['p95_s'] * 1000:.0f}ms"
+                f" max {s['max_s'] * 1000:.0f}ms"
+            )
+    slowest = batches.get("slowest") or []
+    if slowest:
+        yield "最慢的批次:"
+        for r in slowest:
+            yield (
+                f"  {r['stage']:<5} {r['seconds'] * 1000:>7.0f}ms {r['items']:>4} 块"
+                f" {_format_bytes(r['bytes']):>8} {r['source']}"
+                + (f" 重试 {r['retries']}" if r["retries"] else "")
+                + (" 逐条降级" if r["fallback"] else "")
+                + (" 失败" if r["error"] else "")
+            )
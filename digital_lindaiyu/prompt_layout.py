@@ -0,0 +1,61 @@
+"""提示词布局：逐字节稳定的前缀在前，每轮都变的内容在后。
+
+DeepSeek 的上下文缓存按前缀命中：两次请求从第一个字节起相同的部分才算命中。
+原先 LangGraph 链路把本轮检索结果塞进系统消息、放在历史之前，前缀每轮都变，
+缓存几乎从不命中。这里统一按下面的顺序组装：
+
+1. 系统消息：人设 + 链路说明，进程内只拼一次（``lru_cache``）；
+2. 滚动摘要（若有）：单独一条系统消息，只在折叠旧轮次时改变；
+3. 历史：各轮一经发送，之后的请求里原样不变（见 ``history_window``）；
+4. 本轮用户消息，检索到的上下文附在它后面。
+
+于是第 n 轮请求与第 n-1 轮共享「系统 + 摘要 + 之前的历史 + 上一条用户消息」
+这一整段前缀，未命中的只有上一轮的回答与本轮新增的内容。
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Dict
+
+AGENT_INSTRUCTIONS = (
+    "# 可用工具说明 #\n"
+    "你可以调用 search_knowledge_base 在本地知识库中查找人物、情节、诗词、过往对话和风格样例。"
+    "凡用户询问《红楼梦》情节、人物关系、诗词、林黛玉身世、潇湘馆生活，"
+    "或你觉得需要更贴合原著与知识库材料时，应先调用此工具；普通寒暄可不调用。\n\n"
+    "# 回答要求 #\n"
+    "工具结果只作你的内在参照，不要像论文一样罗列来源。"
+    "最终回复要像林黛玉自然开口：先有情绪与场景，再给回答；"
+    "可点到诗意意象，但不要堆砌辞藻；可轻嗔、含蓄、敏感，却不要机械拒绝。"
+)
+
+RAG_INSTRUCTIONS = (
+    "每条用户消息后可能附有「本轮参考资料」，那是为这一问检索到的上下文，"
+    "只作内在参照。请记住用户的话题并保持人物口吻。"
+)
+
+CONTEXT_HEADER = "# 本轮参考资料 #"
+SUMMARY_HEADER = "# 此前对话摘要 #"
+
+
+@lru_cache(maxsize=4)
+def agent_system_prompt(persona: str) -> str:
+    """工具调用链路的系统提示词；同一人设只拼一次，保证逐字节相同。"""
+    return f"{persona}\n\n{AGENT_INSTRUCTIONS}"
+
+
+@lru_cache(maxsize=4)
+def rag_system_prompt(persona: str) -> str:
+    """LangGraph 链路的系统提示词（不含任何逐轮变化的内容）。"""
+    return f"{persona}\n\n{RAG_INSTRUCTIONS}"
+
+
+def summary_message(summary: str) -> Dict[str, Any]:
+    return {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}
+
+
+def with_context(user_message: str, context_text: str) -> str:
+    """把本轮检索上下文附在用户消息之后（只进本轮请求，不写回历史）。"""
+    if not context_text:
+        return user_message
+    return f"{user_message}\n\n{CONTEXT_HEADER}\n{context_text}"
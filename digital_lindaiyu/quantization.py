@@ -0,0 +1,220 @@
+"""向量降维与量化：粗排用紧凑编码，精排回到 float32。
+
+numpy 索引默认把全部 float32 向量常驻内存，语料（整部小说、累积的
+``ai_response``）越多占用越大。开启量化后：
+
+- 向量先按 ``QuantizationConfig.projection`` 降到 ``dims`` 维——截取前几维，
+  或投影到语料二阶矩的主成分上（保留内积最多的子空间）；
+- 再编码成 int8（每维一个缩放系数）或 1 bit 符号位，只有这些编码常驻内存；
+- 查询先在编码上粗排出 ``k × rescore`` 个候选，再从内存映射的 float32
+  矩阵里只读这几行精排，返回的分数是精确余弦相似度。
+
+编码与投影参数随每一代索引存成 ``codes.npz``，打开索引时直接读入，
+不必扫一遍完整矩阵；配置变了或文件缺失时现场重新计算。
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+import numpy as np
+
+from .config import QuantizationConfig
+
+CODES_FILE = "codes.npz"
+
+# 粗排分块计算，临时的 float32 块不超过 _BLOCK 行
+_BLOCK = 4096
+_DEFAULT_RESCORE = {"int8": 4, "binary": 10}
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def parse_spec(spec: str) -> QuantizationConfig:
+    """``"int8"`` / ``"binary@256"`` / ``"int8@128/pca"`` → ``QuantizationConfig``（评测脚本用）。"""
+    spec = spec.strip().lower()
+    projection = "truncate"
+    if "/" in spec:
+        spec, projection = spec.split("/", 1)
+    dims = 0
+    if "@" in spec:
+        spec, dims_text = spec.split("@", 1)
+        dims = int(dims_text)
+    if spec not in {"none", "int8", "binary"} or projection not in {"truncate", "pca"}:
+        raise ValueError(f"无法解析的量化配置: {spec}")
+    return QuantizationConfig(codes=spec, dims=dims, projection=projection)
+
+
+def rescore_factor(config: QuantizationConfig) -> int:
+    return config.rescore or _DEFAULT_RESCORE.get(config.codes, 1)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    bitwise_count = getattr(np, "bitwise_count", None)  # numpy >= 2.0
+    if bitwise_count is not None:
+        return bitwise_count(values)
+    return _POPCOUNT[values]
+
+
+class CompactCodes:
+    """一代索引的紧凑编码及其投影参数。"""
+
+    def __init__(
+        self,
+        kind: str,
+        projection: str,
+        source_dim: int,
+        dims: int,
+        codes: np.ndarray,
+        components: Optional[np.ndarray] = None,
+        scale: Optional[np.ndarray] = None,
+        center: Optional[np.ndarray] = None,
+    ) -> None:
+        self.kind = kind
+        self.projection = projection
+        self.source_dim = source_dim
+        self.dims = dims
+        self.codes = codes
+        self.components = components  # (dims, source_dim)，仅 pca
+        self.scale = scale            # (dims,)，仅 int8
+        self.center = center          # (dims,)，仅 binary：每维的阈值（语料均值）
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        extra = sum(
+            a.nbytes for a in (self.components, self.scale, self.center) if a is not None
+        )
+        return self.codes.nbytes + extra
+
+    # ------------------------------ 构建 ------------------------------ #
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, config: QuantizationConfig) -> "CompactCodes":
+        n, source_dim = matrix.shape
+        dims = min(config.dims or source_dim, source_dim)
+        components = None
+        if config.projection == "pca" and dims < source_dim:
+            # 未中心化的二阶矩：保留内积能量最多的 dims 个方向
+            moment = np.zeros((source_dim, source_dim), dtype=np.float64)
+            for start in range(0, n, _BLOCK):
+                block = np.asarray(matrix[start : start + _BLOCK], dtype=np.float64)
+                moment += block.T @ block
+            _, vectors = np.linalg.eigh(moment)
+            components = vectors[:, ::-1][:, :dims].T
+            if config.codes == "binary":
+                # 主成分方差悬殊，每维 1 bit 时低方差维全是噪声；随机正交旋转把方差摊匀
+                rotation, _ = np.linalg.qr(
+                    np.random.default_rng(0).standard_normal((dims, dims))
+                )
+                components = rotation @ components
+            components = np.ascontiguousarray(components, dtype=np.float32)
+        projection = "pca" if components is not None else "truncate"
+        codes = cls(config.codes, projection, source_dim, dims, np.zeros(0), components)
+        if config.codes not in _DEFAULT_RESCORE:
+            raise ValueError(f"未知的量化编码: {config.codes}")
+
+        # 两遍分块：先统计每维的幅度 / 均值，再逐块编码，不物化降维后的整块矩阵
+        peak = np.zeros(dims, dtype=np.float32)
+        total = np.zeros(dims, dtype=np.float64)
+        for start in range(0, n, _BLOCK):
+            reduced = codes.project(matrix[start : start + _BLOCK])
+            np.maximum(peak, np.abs(reduced).max(axis=0), out=peak)
+            total += reduced.sum(axis=0)
+        peak[peak == 0] = 1.0
+        codes.scale = (peak / 127.0).astype(np.float32) if config.codes == "int8" else None
+        codes.center = (
+            (total / max(n, 1)).astype(np.float32) if config.codes == "binary" else None
+        )
+        blocks = [codes.encode(matrix[s : s + _BLOCK]) for s in range(0, n, _BLOCK)]
+        if blocks:
+            codes.codes = np.concatenate(blocks)
+        else:
+            width = dims if config.codes == "int8" else (dims + 7) // 8
+            dtype = np.int8 if config.codes == "int8" else np.uint8
+            codes.codes = np.zeros((0, width), dtype=dtype)
+        return codes
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        reduced = self.project(vectors)
+        if self.kind == "int8":
+            return np.clip(np.rint(reduced / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(reduced > self.center, axis=-1)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is not None:
+            return vectors @ self.components.T
+        return np.ascontiguousarray(vectors[..., : self.dims])
+
+    def matches(self, config: QuantizationConfig, size: int, source_dim: int) -> bool:
+        dims = min(config.dims or source_dim, source_dim)
+        projection = config.projection if dims < source_dim else "truncate"
+        return (
+            self.kind == config.codes
+            and self.projection == projection
+            and self.dims == dims
+            and self.source_dim == source_dim
+            and len(self) == size
+        )
+
+    # ------------------------------ 检索 ------------------------------ #
+
+    def shortlist(self, query: np.ndarray, n: int) -> np.ndarray:
+        """粗排：按编码上的近似分数取前 n 个下标（升序排列，便于顺序读取原向量）。"""
+        total = len(self)
+        scores = np.empty(total, dtype=np.float32)
+        if self.kind == "int8":
+            # 查询保持 float32（非对称打分），只有库内向量是量化的
+            weights = self.project(query) * self.scale
+            for start in range(0, total, _BLOCK):
+                block = self.codes[start : start + _BLOCK].astype(np.float32)
+                scores[start : start + block.shape[0]] = block @ weights
+        else:
+            bits = self.encode(query)
+            for start in range(0, total, _BLOCK):
+                block = self.codes[start : start + _BLOCK]
+                distance = _popcount(np.bitwise_xor(block, bits)).sum(axis=1)
+                scores[start : start + block.shape[0]] = -distance.astype(np.float32)
+        n = min(n, total)
+        if n < total:
+            return np.sort(np.argpartition(-scores, n - 1)[:n])
+        return np.arange(total)
+
+    # ------------------------------ 落盘 ------------------------------ #
+
+    def save(self, path: str) -> None:
+        arrays = {"codes": self.codes}
+        for name in ("components", "scale", "center"):
+            value = getattr(self, name)
+            if value is not None:
+                arrays[name] = value
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            kind=np.array(self.kind),
+            projection=np.array(self.projection),
+            source_dim=np.array(self.source_dim),
+            dims=np.array(self.dims),
+            **arrays,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CompactCodes"]:
+        try:
+            with np.load(path) as data:
+                return cls(
+                    str(data["kind"]),
+                    str(data["projection"]),
+                    int(data["source_dim"]),
+                    int(data["dims"]),
+                    data["codes"],
+                    data["components"] if "components" in data else None,
+                    data["scale"] if "scale" in data else None,
+                    data["center"] if "center" in data else None,
+                )
+        except (OSError, KeyError, ValueError):
+            return None
@@ -1,35 +1,93 @@
-"""向量库构造与检索辅助。"""
+"""向量库构造与检索辅助（稠密 / BM25 / 混合检索）。"""
 
 from __future__ import annotations
 
 import logging
-from typing import List, Optional
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
-from .config import env_flag
-from .embeddings import get_embeddings
+from .config import env_flag, get_quantization_config, get_retrieval_config
+from .context_packer import pack_documents
+from .embeddings import get_embeddings, wait_for_embeddings
+from .lexical import LexicalIndex, lexical_index_path, reciprocal_rank_fusion
+from .resources import get_resource
 
 logger = logging.getLogger(__name__)
 
 VECTOR_DIR = "./knowledge_base"
 
 
-def build_vector_store(persist_directory: str = VECTOR_DIR):
-    """创建（或打开）持久化的 Chroma 向量库。
+def resolve_vector_backend(
+    backend: Optional[str] = None,
+    persist_directory: str = VECTOR_DIR,
+    writable: bool = False,
+) -> str:
+    """把 ``auto`` 解析成具体后端。
 
-    若检索功能被关闭，或嵌入后端初始化失败，则返回 ``None``，
-    上层调用方应将其视为“无可用知识库”。
+    优先已有的 numpy 索引，其次沿用旧的 Chroma 库，只有索引快照（如打包后的应用）
+    时用快照。快照只读：``auto`` 在 ``writable`` 时落到 numpy，显式指定
+    ``snapshot`` 又要写入则抛 ``ReadOnlyIndexError``。
     """
-    if not env_flag("DIGITAL_LDY_ENABLE_RETRIEVAL", True):
-        logger.info("DIGITAL_LDY_ENABLE_RETRIEVAL=false; 跳过知识库初始化。")
-        return None
+    backend = backend or get_retrieval_config().vector_backend
+    if backend == "snapshot":
+        if writable:
+            from .index_snapshot import ReadOnlyIndexError
 
-    try:
+            raise ReadOnlyIndexError(
+                "VECTOR_BACKEND=snapshot 是只读的索引快照，不能写入；"
+                "入库请改用 numpy 后端（或 auto）后重新导出快照。"
+            )
+        return backend
+    if backend != "auto":
+        return backend
+    from .index_snapshot import snapshot_path
+    from .vector_index import INDEX_SUBDIR
+
+    has_numpy = os.path.isdir(os.path.join(persist_directory, INDEX_SUBDIR))
+    has_chroma = os.path.exists(os.path.join(persist_directory, "chroma.sqlite3"))
+    if has_chroma and not has_numpy:
+        return "chroma"
+    if not (has_numpy or writable) and os.path.exists(snapshot_path(persist_directory)):
+        return "snapshot"
+    return "numpy"
+
+
+def open_vector_store(
+    embeddings: Embeddings,
+    persist_directory: str = VECTOR_DIR,
+    backend: Optional[str] = None,
+    writable: bool = False,
+    **kwargs,
+):
+    """按配置打开向量库；chromadb 只在选中 Chroma 后端时才导入。
+
+    入库等需要写入的调用方传 ``writable=True``，不会打开只读的索引快照。
+    numpy 后端按 ``get_quantization_config()`` 决定是否量化检索。
+    """
+    backend = resolve_vector_backend(backend, persist_directory, writable=writable)
+    if backend == "numpy":
+        from .vector_index import NumpyVectorStore
+
+        kwargs.setdefault("quantization", get_quantization_config())
+        return NumpyVectorStore(
+            embedding_function=embeddings,
+            persist_directory=persist_directory,
+            **kwargs,
+        )
+    if backend == "snapshot":
+        from .index_snapshot import SnapshotVectorStore, snapshot_path
+
+        return SnapshotVectorStore(embeddings, snapshot_path(persist_directory))
+    if backend == "chroma":
         from chromadb.config import Settings
         from langchain_chroma import Chroma
 
-        embeddings = get_embeddings()
         return Chroma(
             persist_directory=persist_directory,
             embedding_function=embeddings,
@@ -44,28 +102,239 @@ def build_vector_store(persist_directory: str = VECTOR_DIR):
                 ),
             ),
         )
+    raise ValueError(f"未知的向量库后端: {backend}")
+
+
+def build_vector_store(persist_directory: str = VECTOR_DIR):
+    """创建（或打开）持久化向量库（numpy 或 Chroma，见 ``VECTOR_BACKEND``）。
+
+    若检索功能被关闭，或嵌入后端初始化失败，则返回 ``None``，
+    上层调用方应将其视为“无可用知识库”。嵌入模型默认在后台加载，
+    这里立即返回；加载失败时检索自动退回词法索引。
+    """
+    if not env_flag("DIGITAL_LDY_ENABLE_RETRIEVAL", True):
+        logger.info("DIGITAL_LDY_ENABLE_RETRIEVAL=false; 跳过知识库初始化。")
+        return None
+
+    try:
+        embeddings = get_embeddings()
+        return open_vector_store(embeddings, persist_directory)
     except Exception as e:
         logger.warning("初始化向量库失败，将以无知识库模式运行: %s", e)
         return None
 
 
+def add_precomputed(
+    vector_store,
+    texts: Sequence[str],
+    vectors: Sequence[Sequence[float]],
+    metadatas: Sequence[dict],
+    ids: Sequence[str],
+) -> List[str]:
+    """写入已算好的向量（upsert）；后端不支持时退回 ``add_texts``（会重新嵌入）。"""
+    add_embeddings = getattr(vector_store, "add_embeddings", None)
+    if add_embeddings is not None:
+        return add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        # langchain_chroma 没有公开"写入现成向量"的接口，直接 upsert 底层集合
+        collection.upsert(
+            ids=list(ids),
+            embeddings=[list(v) for v in vectors],
+            metadatas=list(metadatas),
+            documents=list(texts),
+        )
+        return list(ids)
+    return vector_store.add_texts(
+        texts=list(texts), metadatas=list(metadatas), ids=list(ids)
+    )
+
+
+INDEX_VERSION_FILE = "INDEX_VERSION"
+
+_version_lock = threading.Lock()
+_version_cache: Dict[str, Tuple[int, str]] = {}
+
+
+def bump_index_version(persist_directory: str = VECTOR_DIR) -> str:
+    """知识库内容变化后调用：写入新的版本戳，使依赖它的缓存全部失效。"""
+    version = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    os.makedirs(persist_directory, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, path)
+    return version
+
+
+def index_version(persist_directory: str = VECTOR_DIR) -> str:
+    """当前知识库版本戳；按文件 mtime 缓存，每次调用只多一次 stat。"""
+    path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return ""
+    with _version_lock:
+        cached = _version_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                version = f.read().strip()
+        except OSError:
+            return ""
+        _version_cache[path] = (mtime, version)
+        return version
+
+
+_lexical_lock = threading.Lock()
+_lexical_cache: Dict[str, Tuple[float, Optional[LexicalIndex]]] = {}
+# 由热加载线程负责刷新的索引路径 → 持有它的 IndexReloader 个数：
+# 有持有者时文件变了也先返回旧索引，检索线程不阻塞在重读上
+_lexical_background: Dict[str, int] = {}
+
+
+def load_lexical_index(
+    persist_directory: str = VECTOR_DIR,
+) -> Optional[LexicalIndex]:
+    """读取（并按文件 mtime 缓存）二元组 BM25 索引；不存在时返回 ``None``。"""
+    path = get_resource(lexical_index_path(persist_directory))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lexical_lock:
+        cached = _lexical_cache.get(path)
+        if cached is not None and (cached[0] == mtime or path in _lexical_background):
+            return cached[1]
+        try:
+            index: Optional[LexicalIndex] = LexicalIndex.load(path)
+        except Exception as e:
+            logger.warning("读取词法索引失败: %s", e)
+            index = None
+        _lexical_cache[path] = (mtime, index)
+        return index
+
+
+def refresh_lexical_index(
+    persist_directory: str = VECTOR_DIR,
+) -> Optional[LexicalIndex]:
+    """在调用线程里重读词法索引并整体换入缓存。
+
+    读取不持锁，期间检索照常使用旧索引。
+    """
+    path = get_resource(lexical_index_path(persist_directory))
+    try:
+        mtime = os.path.getmtime(path)
+        index: Optional[LexicalIndex] = LexicalIndex.load(path)
+    except OSError:
+        return None
+    except Exception as e:
+        logger.warning("读取词法索引失败，继续使用旧索引: %s", e)
+        return None
+    with _lexical_lock:
+        _lexical_cache[path] = (mtime, index)
+    return index
+
+
+def hold_lexical_index(persist_directory: str = VECTOR_DIR) -> None:
+    """声明由调用方（热加载线程）负责刷新该词法索引，``load_lexical_index``
+    不再按 mtime 同步重读；须与 ``release_lexical_index`` 成对调用。"""
+    path = get_resource(lexical_index_path(persist_directory))
+    with _lexical_lock:
+        _lexical_background[path] = _lexical_background.get(path, 0) + 1
+
+
+def release_lexical_index(persist_directory: str = VECTOR_DIR) -> None:
+    """撤销 ``hold_lexical_index``；最后一个持有者释放后恢复按 mtime 重读。"""
+    path = get_resource(lexical_index_path(persist_directory))
+    with _lexical_lock:
+        count = _lexical_background.get(path, 0) - 1
+        if count > 0:
+            _lexical_background[path] = count
+        else:
+            _lexical_background.pop(path, None)
+
+
+def retrieval_available(vector_store) -> bool:
+    """是否有任何可用的检索手段（向量库或词法索引）。"""
+    if not env_flag("DIGITAL_LDY_ENABLE_RETRIEVAL", True):
+        return False
+    return vector_store is not None or load_lexical_index() is not None
+
+
+def _dense_ready(vector_store, query: str) -> bool:
+    """查询向量已缓存，或后台加载的嵌入模型在超时前就绪。"""
+    embeddings = getattr(vector_store, "embeddings", None)
+    is_cached = getattr(embeddings, "is_cached", None)
+    if is_cached is not None and is_cached(query):
+        return True
+    return wait_for_embeddings(
+        embeddings, get_retrieval_config().embed_wait_timeout
+    )
+
+
 def retrieve_documents(
     vector_store,
     query: str,
     top_k: int = 3,
+    mode: Optional[str] = None,
+    lexical_index: Optional[LexicalIndex] = None,
+    query_embedding: Optional[Sequence[float]] = None,
 ) -> List[Document]:
-    """对 query 做相似度检索，向量库不可用或检索失败时返回空列表。"""
-    if vector_store is None or not query:
+    """检索与 query 相关的文档。
+
+    ``mode`` 默认取 ``DIGITAL_LDY_RETRIEVAL_MODE``（hybrid / dense / lexical）。
+    向量库不可用、嵌入模型在 ``DIGITAL_LDY_EMBED_WAIT`` 秒内仍未加载好，
+    或稠密检索失败时回退到 BM25；两者都不可用时返回空列表。
+    已有查询向量（如批量嵌入过）时传 ``query_embedding``，跳过再次嵌入。
+    """
+    if not query or top_k <= 0:
         return []
-    try:
-        return vector_store.similarity_search(query, k=top_k)
-    except Exception as e:
-        logger.warning("检索文档时出错: %s", e)
+    if not env_flag("DIGITAL_LDY_ENABLE_RETRIEVAL", True):
         return []
+    mode = mode or get_retrieval_config().mode
+    # 融合前多取一些候选，给另一路排序留出补位空间
+    candidates = top_k if mode == "dense" else max(top_k * 3, 10)
 
+    dense: List[Document] = []
+    dense_ok = False
+    if mode != "lexical" and vector_store is not None:
+        if query_embedding is None and not _dense_ready(vector_store, query):
+            logger.info("嵌入模型尚未就绪，本次只用词法检索。")
+        else:
+            try:
+                if query_embedding is not None:
+                    dense = vector_store.similarity_search_by_vector(
+                        list(query_embedding), k=candidates
+                    )
+                else:
+                    dense = vector_store.similarity_search(query, k=candidates)
+                dense_ok = True
+            except Exception as e:
+                logger.warning("稠密检索出错，回退到词法检索: %s", e)
+    if mode == "dense" and dense_ok:
+        return dense[:top_k]
 
-def format_context(docs: List[Document]) -> str:
-    """将检索结果拼成 system prompt 所需的上下文字符串。"""
+    lexical = lexical_index if lexical_index is not None else load_lexical_index()
+    lexical_hits = lexical.search(query, k=candidates) if lexical is not None else []
+    if not dense_ok:
+        return lexical_hits[:top_k]
+    if not lexical_hits:
+        return dense[:top_k]
+    return reciprocal_rank_fusion([dense, lexical_hits], k=top_k)
+
+
+def format_context(docs: List[Document], max_tokens: Optional[int] = None) -> str:
+    """将检索结果拼成 system prompt 所需的上下文字符串。
+
+    相邻块合并、重叠去重后按 ``max_tokens``（默认取
+    ``DIGITAL_LDY_CONTEXT_TOKENS``）装填。
+    """
     if not docs:
         return "没有找到相关上下文。"
-    return "\n".join(doc.page_content for doc in docs)
+    if max_tokens is None:
+        max_tokens = get_retrieval_config().context_tokens
+    spans = pack_documents(docs, max_tokens)
+    return "\n".join(span.text for span in spans)
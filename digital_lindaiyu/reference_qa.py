@@ -0,0 +1,58 @@
+"""解析知识库自带的参考问答（``参考回答.txt``）。
+
+文件由 ``###`` 分隔成若干段，每段形如::
+
+    用户：……
+    林黛玉：……
+
+既是检索评测的标准问题集，也可直接作为精选回答使用。
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import List
+
+from .resources import read_text_resource
+
+REFERENCE_QA_RESOURCE = "knowledge/txt/人物介绍/参考回答.txt"
+
+_SEPARATOR_RE = re.compile(r"^\s*###\s*$", re.MULTILINE)
+_USER_RE = re.compile(r"^\s*用户\s*[：:]\s*")
+_REPLY_RE = re.compile(r"^\s*林黛玉\s*[：:]\s*")
+
+
+@dataclass(frozen=True)
+class ReferencePair:
+    question: str
+    answer: str
+
+
+def parse_reference_pairs(text: str) -> List[ReferencePair]:
+    """把参考回答文本拆成 (问题, 回答) 列表；缺任一部分的段落跳过。"""
+    pairs: List[ReferencePair] = []
+    for block in _SEPARATOR_RE.split(text or ""):
+        question: List[str] = []
+        answer: List[str] = []
+        current = None
+        for line in block.splitlines():
+            if _USER_RE.match(line):
+                current = question
+                line = _USER_RE.sub("", line, count=1)
+            elif _REPLY_RE.match(line):
+                current = answer
+                line = _REPLY_RE.sub("", line, count=1)
+            if current is not None and line.strip():
+                current.append(line.strip())
+        if question and answer:
+            pairs.append(
+                ReferencePair(question="\n".join(question), answer="\n".join(answer))
+            )
+    return pairs
+
+
+def load_reference_pairs(
+    relative_path: str = REFERENCE_QA_RESOURCE,
+) -> List[ReferencePair]:
+    return parse_reference_pairs(read_text_resource(relative_path))
@@ -0,0 +1,356 @@
+"""无界面的 HTTP / SSE 服务：按 thread_id 提供流式对话轮次。
+
+只用标准库的 ``asyncio`` 流实现一个够用的 HTTP/1.1 服务端（每个请求一个
+连接，``Connection: close``），所有会话共用一个事件循环与一个 ``ChatEngine``：
+
+- ``POST /v1/chat``：请求体 ``{"message": "...", "thread_id": "..."}``，
+  响应为 ``text/event-stream``，依次推送 ``chunk``（片段）、``sentence``（整句）、
+  ``audio``（该句语音的链接）事件，最后是 ``done``（完整回复）或 ``error``；
+- ``GET /v1/audio/<id>``：取回 ``audio`` 事件里引用的音频文件；
+- ``GET /healthz``：并发、排队、拒绝计数与累计 LLM 用量。
+
+准入控制：同时生成的轮次受 ``max_concurrent`` 限制，排队者超过 ``max_queue``
+或等待超过 ``queue_timeout`` 秒返回 503；同一 thread_id 已有一轮在跑时返回 409。
+背压：每次写出后等待发送缓冲降到 ``send_buffer`` 以下，``send_timeout`` 秒内
+写不出去就断开这个慢客户端并取消它的那一轮，不让它拖住其他会话。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import ServerConfig, get_server_config
+from .tts.base import TTSClient, clean_for_tts
+
+logger = logging.getLogger(__name__)
+
+# 请求头与请求体的大小上限
+_MAX_HEADER = 16 * 1024
+_MAX_BODY = 64 * 1024
+_READ_TIMEOUT = 10.0
+# 保留的音频文件数，超出后删除最旧的
+_MAX_AUDIO_FILES = 256
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class _ClientGone(Exception):
+    """客户端断开，或在 send_timeout 内读不走数据。"""
+
+
+class _AudioFiles:
+    """TTS 产出的临时音频：按 id 取回，超出上限时删除最旧的文件。"""
+
+    def __init__(self, limit: int = _MAX_AUDIO_FILES) -> None:
+        self.limit = limit
+        self._paths: "OrderedDict[str, str]" = OrderedDict()
+
+    def add(self, path: str) -> str:
+        audio_id = uuid.uuid4().hex + os.path.splitext(path)[1]
+        self._paths[audio_id] = path
+        while len(self._paths) > self.limit:
+            _, old = self._paths.popitem(last=False)
+            _remove(old)
+        return audio_id
+
+    def get(self, audio_id: str) -> Optional[str]:
+        return self._paths.get(audio_id)
+
+    def clear(self) -> None:
+        while self._paths:
+            _remove(self._paths.popitem()[1])
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _sse(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class ChatServer:
+    """把 ``ChatEngine.astream`` 暴露成 SSE 接口。"""
+
+    def __init__(
+        self,
+        engine,
+        config: Optional[ServerConfig] = None,
+        tts_client: Optional[TTSClient] = None,
+    ) -> None:
+        self.engine = engine
+        self.config = config or get_server_config()
+        self.tts_client = tts_client
+        self.audio = _AudioFiles()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.completed = 0
+        self._slots = asyncio.Semaphore(self.config.max_concurrent)
+        # 单 GPU 的 TTS 服务串行合成，多路并发只会互相拖慢
+        self._tts_slots = asyncio.Semaphore(1)
+        self._busy_threads: set = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(
+            self._handle, self.config.host, self.config.port, limit=_MAX_HEADER
+        )
+        return self._server
+
+    @property
+    def port(self) -> int:
+        assert self._server is not None
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        server = self._server or await self.start()
+        logger.info("对话服务已启动: http://%s:%d", self.config.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.audio.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.config.max_concurrent,
+            "max_queue": self.config.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "usage": self.engine.usage_log.summary(),
+        }
+
+    # ------------------------------ HTTP ------------------------------ #
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.transport.set_write_buffer_limits(high=self.config.send_buffer)
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), _READ_TIMEOUT)
+            if isinstance(request, int):
+                await self._respond(writer, request, {"error": _REASONS[request]})
+                return
+            method, path, body = request
+            if path == "/healthz" and method == "GET":
+                await self._respond(writer, 200, self.stats())
+            elif path.startswith("/v1/audio/") and method == "GET":
+                await self._send_audio(writer, path[len("/v1/audio/") :])
+            elif path == "/v1/chat" and method == "POST":
+                await self._chat(writer, body)
+            elif path in {"/healthz", "/v1/chat"} or path.startswith("/v1/audio/"):
+                await self._respond(writer, 405, {"error": _REASONS[405]})
+            else:
+                await self._respond(writer, 404, {"error": _REASONS[404]})
+        except (_ClientGone, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            writer.transport.abort()
+        except Exception:  # noqa: BLE001
+            logger.exception("处理请求时出错")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, bytes] | int:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            return 413
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        if len(parts) != 3:
+            return 400
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            return 400
+        if length > _MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        return parts[0].upper(), parts[1].split("?", 1)[0], body
+
+    async def _write(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        """写出并等待发送缓冲回落；慢客户端超时即视为断开。"""
+        if writer.transport.is_closing():
+            raise _ClientGone()
+        writer.write(data)
+        try:
+            await asyncio.wait_for(writer.drain(), self.config.send_timeout)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            raise _ClientGone() from e
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._write(
+            writer,
+            _head(status, "application/json; charset=utf-8", len(body), headers) + body,
+        )
+
+    async def _send_audio(self, writer: asyncio.StreamWriter, audio_id: str) -> None:
+        path = self.audio.get(audio_id)
+        if path is None or not os.path.exists(path):
+            await self._respond(writer, 404, {"error": _REASONS[404]})
+            return
+        data = await asyncio.to_thread(_read_file, path)
+        kind = "audio/mpeg" if path.endswith(".mp3") else "audio/wav"
+        await self._write(writer, _head(200, kind, len(data)) + data)
+
+    # ------------------------------ 对话 ------------------------------ #
+
+    async def _chat(self, writer: asyncio.StreamWriter, body: bytes) -> None:
+        try:
+            request = json.loads(body or b"{}")
+            message = str(request.get("message") or "").strip()
+            thread_id = str(request.get("thread_id") or "default")
+        except (ValueError, AttributeError):
+            message = ""
+        if not message:
+            await self._respond(writer, 400, {"error": "需要非空的 message"})
+            return
+        if thread_id in self._busy_threads:
+            self.rejected += 1
+            await self._respond(writer, 409, {"error": f"会话 {thread_id} 正在生成"})
+            return
+
+        # 准入：先排队拿并发名额，排不上就在发出响应头之前拒绝
+        if self._slots.locked() and self.waiting >= self.config.max_queue:
+            self.rejected += 1
+            await self._respond(writer, 503, {"error": "服务繁忙"}, {"Retry-After": "1"})
+            return
+        self._busy_threads.add(thread_id)
+        try:
+            if not self._slots.locked():
+                await self._slots.acquire()  # 有空位时立即拿到，不让出事件循环
+            else:
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), self.config.queue_timeout)
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    await self._respond(writer, 503, {"error": "排队超时"}, {"Retry-After": "1"})
+                    return
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            try:
+                await self._stream_turn(writer, message, thread_id)
+            finally:
+                self.active -= 1
+                self._slots.release()
+        finally:
+            self._busy_threads.discard(thread_id)
+
+    async def _stream_turn(self, writer: asyncio.StreamWriter, message: str, thread_id: str) -> None:
+        lock = asyncio.Lock()
+
+        async def send(event: str, data: Dict[str, Any]) -> None:
+            async with lock:  # 文本与音频两路事件交错写出
+                await self._write(writer, _sse(event, data))
+
+        await self._write(
+            writer,
+            _head(200, "text/event-stream; charset=utf-8", None, {"Cache-Control": "no-cache"}),
+        )
+        sentences: Optional["asyncio.Queue[Optional[str]]"] = None
+        tts_task: Optional[asyncio.Task] = None
+        if self.tts_client is not None:
+            sentences = asyncio.Queue()
+            tts_task = asyncio.ensure_future(self._synthesize(sentences, send))
+
+        events = self.engine.astream(message, thread_id=thread_id)
+        response = ""
+        try:
+            async for event in events:
+                if event.kind == "done":
+                    response = event.text
+                    continue
+                await send(event.kind, {"text": event.text})
+                if event.kind == "sentence" and sentences is not None:
+                    sentences.put_nowait(event.text)
+            if tts_task is not None:
+                sentences.put_nowait(None)
+                await tts_task
+            await send("done", {"thread_id": thread_id, "text": response})
+            self.completed += 1
+        except _ClientGone:
+            self.dropped += 1
+            logger.info("客户端断开或读取过慢，已取消会话 %s 的本轮生成", thread_id)
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning("会话 %s 生成失败: %s", thread_id, e)
+            await send("error", {"error": str(e)})
+        finally:
+            await events.aclose()
+            if tts_task is not None and not tts_task.done():
+                tts_task.cancel()
+
+    async def _synthesize(self, sentences: "asyncio.Queue[Optional[str]]", send) -> None:
+        """按句序逐句合成并推送 ``audio`` 事件。"""
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                return
+            spoken = clean_for_tts(sentence)
+            # 旁白被剥掉后可能只剩 1~2 字标点，太短没必要合成
+            if len(spoken) < 2:
+                continue
+            async with self._tts_slots:
+                try:
+                    path = await asyncio.to_thread(self.tts_client.synthesize, spoken)
+                except Exception as e:  # noqa: BLE001
+                    logger.warning("TTS 合成异常: %s", e)
+                    continue
+            if path:
+                audio_id = self.audio.add(path)
+                await send("audio", {"text": sentence, "url": f"/v1/audio/{audio_id}"})
+
+
+def _head(
+    status: int,
+    content_type: str,
+    length: Optional[int],
+    headers: Optional[Dict[str, str]] = None,
+) -> bytes:
+    lines = [
+        f"HTTP/1.1 {status} {_REASONS[status]}",
+        f"Content-Type: {content_type}",
+        "Connection: close",
+    ]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
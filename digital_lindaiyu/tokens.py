@@ -0,0 +1,81 @@
+"""提示词 token 计数。
+
+优先用 ``tiktoken`` 的 ``cl100k_base``（与 DeepSeek 分词器不完全一致，
+但量级相同，足够做预算）；首次使用需要下载 BPE 文件，离线拿不到时
+退回按字符估算：汉字约 1 token / 字，其余字符约 4 字符 / token。
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import re
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception as e:  # noqa: BLE001
+                _encoding_failed = True
+                logger.warning("tiktoken 不可用，token 数改为按字符估算: %s", e)
+    return _encoding
+
+
+def _estimate(text: str) -> int:
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_tokens(text: str) -> int:
+    """返回 ``text`` 的 token 数（离线时为估算值）。"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return _estimate(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截取 ``text`` 的前缀，使其不超过 ``max_tokens`` 个 token。"""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        used = 0
+        for i, ch in enumerate(text):
+            used_next = used + (4 if _CJK_RE.match(ch) else 1)
+            # 按 1/4 token 为单位累加，避免浮点误差
+            if used_next > max_tokens * 4:
+                return text[:i]
+            used = used_next
+        return text
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 截断处可能落在多字节字符中间，去掉解码出的替换符
+    return encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+
+
+def encoding_name() -> Optional[str]:
+    """实际使用的编码名；离线估算时返回 None。"""
+    return ENCODING_NAME if _get_encoding() is not None else None
@@ -0,0 +1,474 @@
+"""进程内 NumPy 向量索引，作为 Chroma 之外的轻量后端。
+
+知识库只有几百到几千个 chunk 时，全部向量放进一块连续的 float32 矩阵，
+一次矩阵乘 + ``argpartition`` 就能做精确 top-k，比走 chromadb 的
+SQLite + HNSW 查询栈快得多，也省掉了启动时导入 chromadb 的开销。
+
+对外暴露与 ``langchain_chroma.Chroma`` 相同的最小接口
+（``add_texts`` / ``similarity_search`` / ``delete`` / ``delete_collection``），
+``rag`` / ``agent_tools`` / ``knowledge`` 无需区分后端。
+
+开启量化（``QuantizationConfig``，见 ``quantization``）后，float32 矩阵改为
+内存映射、只常驻紧凑编码：粗排在编码上做，精排只读候选的那几行。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .config import QuantizationConfig
+from .quantization import CODES_FILE, CompactCodes, rescore_factor
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUBDIR = "numpy_index"
+_VECTORS_FILE = "vectors.npy"
+_CHUNKS_FILE = "chunks.json"
+_CURRENT_FILE = "CURRENT"
+_KEEP_GENERATIONS = 2
+
+
+@dataclass(frozen=True)
+class _IndexState:
+    """某一时刻索引的只读视图。
+
+    写入只在 ``size`` 之后追加行，或整体换成新的状态对象；
+    检索线程拿到一个状态后即可无锁读取，不会看到写了一半的数据。
+    """
+
+    matrix: np.ndarray  # (capacity, dim)，前 size 行有效，行向量已 L2 归一化
+    size: int
+    ids: List[str]
+    texts: List[str]
+    metadatas: List[dict]
+    # 由上面几项派生、按需计算的数据（量化编码），随状态一起换掉
+    derived: dict = field(default_factory=dict, compare=False, repr=False)
+
+
+def _empty_state() -> _IndexState:
+    return _IndexState(
+        matrix=np.zeros((0, 0), dtype=np.float32),
+        size=0,
+        ids=[],
+        texts=[],
+        metadatas=[],
+    )
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """分数最高的 k 个下标，按分数降序（同分保持原顺序）。"""
+    k = min(k, scores.shape[0])
+    if k < scores.shape[0]:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(scores.shape[0])
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore:
+    """精确余弦检索的内存向量库，可选持久化到 ``<persist_directory>/numpy_index``。"""
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        persist_directory: Optional[str] = None,
+        autosave: bool = True,
+        quantization: Optional[QuantizationConfig] = None,
+    ) -> None:
+        self._embedding_function = embedding_function
+        self.quantization = (
+            quantization if quantization is not None and quantization.enabled else None
+        )
+        self._index_dir = (
+            os.path.join(persist_directory, INDEX_SUBDIR)
+            if persist_directory
+            else None
+        )
+        # 批量写入（如知识库加载）时可关闭，结束后手动 persist()
+        self.autosave = autosave
+        self._lock = threading.RLock()
+        self._state = _empty_state()
+        self._id_index: dict[str, int] = {}
+        self._load()
+
+    # ------------------------------ 属性 ------------------------------ #
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def __len__(self) -> int:
+        return self._state.size
+
+    def resident_bytes(self) -> int:
+        """常驻内存的向量数据字节数（内存映射的矩阵不计，只计量化编码）。"""
+        state = self._state
+        codes = state.derived.get("codes")
+        matrix = 0 if isinstance(state.matrix, np.memmap) else state.matrix.nbytes
+        return matrix + (codes.nbytes if codes is not None else 0)
+
+    # ------------------------------ 写入 ------------------------------ #
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """嵌入并写入文本；已存在的 id 会被覆盖（与 Chroma 的 upsert 语义一致）。"""
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if not (len(ids) == len(texts) == len(metadatas)):
+            raise ValueError("texts / metadatas / ids 长度不一致")
+        vectors = self._embedding_function.embed_documents(texts)
+        self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+        return ids
+
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[dict]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """写入已算好的向量（跳过嵌入）。"""
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise ValueError("嵌入向量数量与文本数量不一致")
+
+        with self._lock:
+            # 同一批里重复的 id 只保留最后一次
+            latest = {_id: i for i, _id in enumerate(ids)}
+            keep = sorted(latest.values())
+            if len(keep) != len(ids):
+                vectors = vectors[keep]
+                texts = [texts[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep]
+                ids = [ids[i] for i in keep]
+
+            existing = [_id for _id in ids if _id in self._id_index]
+            if existing:
+                self._delete_locked(existing)
+            self._append_locked(vectors, ids, texts, metadatas)
+            if self.autosave:
+                self.persist()
+        return ids
+
+    def _append_locked(
+        self,
+        vectors: np.ndarray,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[dict],
+    ) -> None:
+        state = self._state
+        n_new = vectors.shape[0]
+        dim = vectors.shape[1]
+        matrix = state.matrix
+        if state.size and matrix.shape[1] != dim:
+            raise ValueError(
+                f"向量维度不一致（索引 {matrix.shape[1]}，新数据 {dim}）；"
+                "切换嵌入模型后请用 --rebuild 重建知识库。"
+            )
+        needed = state.size + n_new
+        if needed > matrix.shape[0] or matrix.shape[1] != dim:
+            # 容量翻倍增长；旧状态仍引用旧矩阵，读者不受影响
+            capacity = max(needed, 2 * matrix.shape[0], 64)
+            grown = np.zeros((capacity, dim), dtype=np.float32)
+            if state.size:
+                grown[: state.size] = matrix[: state.size]
+            matrix = grown
+        matrix[state.size : needed] = vectors
+
+        state.ids.extend(ids)
+        state.texts.extend(texts)
+        state.metadatas.extend(dict(m or {}) for m in metadatas)
+        for offset, _id in enumerate(ids):
+            self._id_index[_id] = state.size + offset
+        self._state = _IndexState(
+            matrix=matrix,
+            size=needed,
+            ids=state.ids,
+            texts=state.texts,
+            metadatas=state.metadatas,
+        )
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        """按 id 删除；未知 id 忽略。"""
+        if not ids:
+            return
+        with self._lock:
+            if self._delete_locked(ids) and self.autosave:
+                self.persist()
+
+    def _delete_locked(self, ids: Iterable[str]) -> int:
+        drop = {self._id_index[_id] for _id in ids if _id in self._id_index}
+        if not drop:
+            return 0
+        state = self._state
+        keep = [i for i in range(state.size) if i not in drop]
+        self._set_state(
+            matrix=state.matrix[keep].copy() if keep else state.matrix[:0].copy(),
+            ids=[state.ids[i] for i in keep],
+            texts=[state.texts[i] for i in keep],
+            metadatas=[state.metadatas[i] for i in keep],
+        )
+        return len(drop)
+
+    def delete_collection(self) -> None:
+        """清空索引并删除持久化文件。"""
+        with self._lock:
+            self._state = _empty_state()
+            self._id_index = {}
+            if self._index_dir is None or not os.path.isdir(self._index_dir):
+                return
+            for name in os.listdir(self._index_dir):
+                path = os.path.join(self._index_dir, name)
+                if name.startswith("gen-"):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif name in (_VECTORS_FILE, _CHUNKS_FILE, _CURRENT_FILE):
+                    os.remove(path)
+
+    def _set_state(
+        self,
+        matrix: np.ndarray,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[dict],
+    ) -> None:
+        self._state = _IndexState(
+            matrix=matrix,
+            size=len(ids),
+            ids=ids,
+            texts=texts,
+            metadatas=metadatas,
+        )
+        self._id_index = {_id: i for i, _id in enumerate(ids)}
+
+    # ------------------------------ 检索 ------------------------------ #
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """返回 (文档, 余弦相似度)；注意分数越大越相关，与 Chroma 的距离相反。"""
+        if self._state.size == 0:
+            return []
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k)
+
+    def similarity_search_by_vector(
+        self, embedding: Sequence[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)
+        ]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: Sequence[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        state = self._state
+        if state.size == 0 or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+        codes = self._codes_for(state)
+        if codes is None:
+            scores = state.matrix[: state.size] @ query
+            top = top_k_indices(scores, k)
+            top_scores = scores[top]
+        else:
+            # 粗排取 k × rescore 个候选，再用 float32 原向量精排
+            candidates = codes.shortlist(query, k * rescore_factor(self.quantization))
+            exact = state.matrix[candidates] @ query
+            order = top_k_indices(exact, k)
+            top, top_scores = candidates[order], exact[order]
+        return [
+            (
+                Document(
+                    page_content=state.texts[i],
+                    metadata=dict(state.metadatas[i]),
+                    id=state.ids[i],
+                ),
+                float(score),
+            )
+            for i, score in zip(top, top_scores)
+        ]
+
+    def _codes_for(self, state: _IndexState) -> Optional[CompactCodes]:
+        """当前状态的量化编码；未开启量化时返回 None，缺失时现场计算一次。"""
+        if self.quantization is None or state.size == 0:
+            return None
+        codes = state.derived.get("codes")
+        if codes is None:
+            with self._lock:
+                codes = state.derived.get("codes")
+                if codes is None:
+                    codes = CompactCodes.build(state.matrix[: state.size], self.quantization)
+                    state.derived["codes"] = codes
+        return codes
+
+    # ------------------------------ 持久化 ------------------------------ #
+
+    def persist(self) -> None:
+        """把当前状态写成新的一代并切换 ``CURRENT`` 指针。
+
+        每一代是 ``numpy_index/gen-*/`` 下的一对文件，写完后才原子替换指针，
+        其他进程（或 ``reload``）要么读到旧的一代，要么读到完整的新一代。
+        """
+        if self._index_dir is None:
+            return
+        with self._lock:
+            state = self._state
+            name = f"gen-{time.time_ns():x}"
+            gen_dir = os.path.join(self._index_dir, name)
+            os.makedirs(gen_dir, exist_ok=True)
+            with open(os.path.join(gen_dir, _VECTORS_FILE), "wb") as f:
+                np.save(f, np.ascontiguousarray(state.matrix[: state.size]))
+            with open(os.path.join(gen_dir, _CHUNKS_FILE), "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "ids": state.ids[: state.size],
+                        "texts": state.texts[: state.size],
+                        "metadatas": state.metadatas[: state.size],
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            codes = self._codes_for(state)
+            if codes is not None:
+                codes.save(os.path.join(gen_dir, CODES_FILE))
+            pointer = os.path.join(self._index_dir, _CURRENT_FILE)
+            with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+                f.write(name)
+            os.replace(pointer + ".tmp", pointer)
+            self._prune_generations()
+
+    def _prune_generations(self) -> None:
+        """只保留最近几代（刚读到旧指针的读者还能打开上一代）；顺带清掉旧版布局的文件。"""
+        index_dir = self._index_dir
+        generations = sorted(
+            name for name in os.listdir(index_dir) if name.startswith("gen-")
+        )
+        for name in generations[:-_KEEP_GENERATIONS]:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+        for name in (_VECTORS_FILE, _CHUNKS_FILE):
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _current_dir(self) -> str:
+        """当前一代的目录；没有指针时是旧版布局（文件直接放在 numpy_index/ 下）。"""
+        try:
+            with open(
+                os.path.join(self._index_dir, _CURRENT_FILE), "r", encoding="utf-8"
+            ) as f:
+                return os.path.join(self._index_dir, f.read().strip())
+        except FileNotFoundError:
+            return self._index_dir
+
+    def _read_snapshot(self) -> Optional[_IndexState]:
+        """从磁盘读出最新一代；不加锁，读取期间检索照常进行。"""
+        if self._index_dir is None:
+            return None
+        for _attempt in range(3):
+            gen_dir = self._current_dir()
+            vectors_path = os.path.join(gen_dir, _VECTORS_FILE)
+            chunks_path = os.path.join(gen_dir, _CHUNKS_FILE)
+            if not (os.path.exists(vectors_path) and os.path.exists(chunks_path)):
+                if gen_dir != self._index_dir:
+                    continue  # 刚被清理掉，指针已指向更新的一代
+                return None
+            try:
+                # 量化时原向量只在精排时按行读取，映射而不整体读入
+                matrix = np.load(
+                    vectors_path, mmap_mode="r" if self.quantization else None
+                )
+                with open(chunks_path, "r", encoding="utf-8") as f:
+                    chunks = json.load(f)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.warning("读取 numpy 索引失败: %s", e)
+                return None
+            ids = list(chunks.get("ids") or [])
+            if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+                logger.warning("numpy 索引文件不一致，已忽略。")
+                return None
+            if not isinstance(matrix, np.memmap):
+                matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            state = _IndexState(
+                matrix=matrix,
+                size=len(ids),
+                ids=ids,
+                texts=list(chunks.get("texts") or []),
+                metadatas=list(chunks.get("metadatas") or []),
+            )
+            if self.quantization is not None and state.size:
+                # 编码随索引一起落盘；配置变了或是旧索引就现场算一次（仍在锁外）
+                codes = CompactCodes.load(os.path.join(gen_dir, CODES_FILE))
+                if codes is None or not codes.matches(
+                    self.quantization, state.size, matrix.shape[1]
+                ):
+                    codes = CompactCodes.build(matrix, self.quantization)
+                state.derived["codes"] = codes
+            return state
+        return None
+
+    def _install(self, state: _IndexState) -> None:
+        id_index = {_id: i for i, _id in enumerate(state.ids)}
+        with self._lock:
+            # 一次赋值完成切换：检索线程要么拿到旧状态，要么拿到完整的新状态
+            self._state = state
+            self._id_index = id_index
+
+    def reload(self) -> bool:
+        """重新读取磁盘上的最新一代并原子替换；进行中的检索继续读旧快照。"""
+        state = self._read_snapshot()
+        if state is None:
+            return False
+        self._install(state)
+        logger.info("已热加载 numpy 索引：%d 块", state.size)
+        return True
+
+    def _load(self) -> None:
+        state = self._read_snapshot()
+        if state is None:
+            return
+        self._install(state)
+        logger.info(
+            "已载入 numpy 索引：%d 块，维度 %d", state.size, state.matrix.shape[1]
+        )
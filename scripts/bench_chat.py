@@ -0,0 +1,217 @@
+"""CLI: 对 ChatEngine 做并发压测，默认打本地的假 LLM 服务（不消耗 API 额度）。
+
+在一个事件循环里并发跑 ``--sessions`` 个会话，每个会话串行 ``--turns`` 轮，
+全部经 ``ChatEngine.astream``；默认在后台线程里起一个 ``scripts.fake_llm``
+服务（参数同该脚本），``--base-url`` 则改打已有的 OpenAI 兼容服务。
+
+报告（JSON，打到 stdout 或 ``--output``）里的延迟都是 p50 / p95 / p99：
+
+- ``ttft``：发出消息到第一个正文片段（含检索、工具轮）；
+- ``llm_ttft``：每轮第一次 LLM 请求发出到第一个输出分片；
+- ``first_sentence`` / ``sentence_gap``：到第一句可送 TTS 的整句、相邻整句的间隔；
+- ``turn``：整轮耗时；
+- ``tool_round_overhead``：假服务发完工具调用到收到带工具结果的下一次请求，
+  即本地执行工具与重新组装请求的开销（仅内置假服务）；
+- ``throughput``：每秒完成的轮数与输出字符数；``cpu_s`` 为压测期间本进程的
+  CPU 时间，接近 ``elapsed_s`` 说明延迟来自本进程算力不足而不是等待 LLM。
+
+工具调用链路需要可检索的知识库（先跑 ``load_kb``），否则自动退回 LangGraph 链路；
+报告的 ``paths`` 记录各链路实际跑了几轮。
+
+用法:
+    uv run python -m scripts.bench_chat --sessions 50 --turns 3
+    uv run python -m scripts.bench_chat --sessions 200 --ttft 0.5 --tps 30 --tool-rounds 1 \\
+        --parallel-tools 2 --length-limit 40 --output bench_chat.json
+    uv run python -m scripts.bench_chat --path rag --sessions 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from digital_lindaiyu.logging_config import configure_app_logging
+
+configure_app_logging()
+
+from scripts.fake_llm import add_arguments, config_from_args, serve_in_background
+
+_FALLBACK_QUESTIONS = [
+    "你近来身子可好些了？",
+    "宝玉今日可曾来过潇湘馆？",
+    "你最喜欢哪一首自己作的诗？",
+    "大观园里你和谁最说得来？",
+    "下雨天你都做些什么？",
+]
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _latency(samples: List[float]) -> dict:
+    """秒 → 毫秒的分位数摘要。"""
+    if not samples:
+        return {}
+    ms = [s * 1000 for s in samples]
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 2),
+        "p50_ms": round(_percentile(ms, 50), 2),
+        "p95_ms": round(_percentile(ms, 95), 2),
+        "p99_ms": round(_percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2),
+    }
+
+
+def _questions() -> List[str]:
+    try:
+        from digital_lindaiyu.reference_qa import load_reference_pairs
+
+        questions = [p.question for p in load_reference_pairs()]
+    except Exception:  # noqa: BLE001
+        questions = []
+    return questions or _FALLBACK_QUESTIONS
+
+
+class _Samples:
+    def __init__(self) -> None:
+        self.ttft: List[float] = []
+        self.first_sentence: List[float] = []
+        self.sentence_gap: List[float] = []
+        self.turn: List[float] = []
+        self.chars = 0
+        self.turns = 0
+        self.errors: List[str] = []
+
+
+async def _session(engine, index: int, turns: int, questions: List[str], samples: _Samples) -> None:
+    for turn in range(turns):
+        message = questions[(index + turn) % len(questions)]
+        t0 = time.perf_counter()
+        first_chunk: Optional[float] = None
+        last_sentence: Optional[float] = None
+        try:
+            async for event in engine.astream(message, thread_id=f"bench-{index}"):
+                now = time.perf_counter() - t0
+                if event.kind == "chunk":
+                    samples.chars += len(event.text)
+                    if first_chunk is None:
+                        first_chunk = now
+                        samples.ttft.append(now)
+                elif event.kind == "sentence":
+                    if last_sentence is None:
+                        samples.first_sentence.append(now)
+                    else:
+                        samples.sentence_gap.append(now - last_sentence)
+                    last_sentence = now
+        except Exception as e:  # noqa: BLE001
+            samples.errors.append(f"{type(e).__name__}: {e}")
+            continue
+        samples.turn.append(time.perf_counter() - t0)
+        samples.turns += 1
+
+
+async def _run(engine, sessions: int, turns: int, questions: List[str]) -> tuple:
+    samples = _Samples()
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    await asyncio.gather(
+        *(_session(engine, i, turns, questions, samples) for i in range(sessions))
+    )
+    return samples, time.perf_counter() - t0, time.process_time() - cpu0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument(
+        "--path", choices=["agent", "rag"], default="agent",
+        help="agent：工具调用链路（不可用时退回 rag）；rag：LangGraph 链路",
+    )
+    parser.add_argument(
+        "--base-url", default=None,
+        help="改打已有的 OpenAI 兼容服务（默认在本进程内启动假服务）",
+    )
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        fake = serve_in_background(config_from_args(args))
+        base_url = fake.base_url
+    os.environ["CHAT_BASE_URL"] = base_url
+    os.environ.setdefault("CHAT_API_KEY", "fake")
+    os.environ["DIGITAL_LDY_ENABLE_TOOL_CALLS"] = "1" if args.path == "agent" else "0"
+    # 压测不读写真实的对话历史，也不让参考回答缓存、输入预取绕过 LLM
+    history_dir = tempfile.mkdtemp(prefix="bench_chat_")
+    os.environ["DIGITAL_LDY_CONVERSATION_PATH"] = os.path.join(history_dir, "conversations.sqlite3")
+    os.environ["DIGITAL_LDY_ANSWER_CACHE"] = "0"
+    os.environ["DIGITAL_LDY_PREFETCH"] = "0"
+    os.environ["DIGITAL_LDY_INDEX_RELOAD_INTERVAL"] = "0"
+
+    from digital_lindaiyu.chat import ChatEngine
+    from digital_lindaiyu.llm_usage import UsageLog
+
+    engine = ChatEngine()
+    engine.usage_log = UsageLog(limit=max(1, args.sessions) * max(1, args.turns))
+    samples, elapsed, cpu = asyncio.run(
+        _run(engine, max(1, args.sessions), max(1, args.turns), _questions())
+    )
+
+    paths: Dict[str, int] = {}
+    for usage in engine.usage_log.turns:
+        paths[usage.path] = paths.get(usage.path, 0) + 1
+    report = {
+        "base_url": base_url,
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "completed_turns": samples.turns,
+        "errors": len(samples.errors),
+        "error_samples": samples.errors[:5],
+        "paths": paths,
+        "elapsed_s": round(elapsed, 3),
+        # 接近 elapsed_s 时说明瓶颈在本进程的 CPU（内置假服务也算在内）
+        "cpu_s": round(cpu, 3),
+        "throughput": {
+            "turns_per_s": round(samples.turns / elapsed, 3) if elapsed else None,
+            "chars_per_s": round(samples.chars / elapsed, 1) if elapsed else None,
+        },
+        "ttft": _latency(samples.ttft),
+        "llm_ttft": _latency([u.ttft for u in engine.usage_log.turns if u.ttft is not None]),
+        "first_sentence": _latency(samples.first_sentence),
+        "sentence_gap": _latency(samples.sentence_gap),
+        "turn": _latency(samples.turn),
+        "usage": engine.usage_log.summary(),
+    }
+    if fake is not None:
+        stats = fake.stats()
+        report["fake_llm"] = {
+            "requests": stats["requests"],
+            "tool_responses": stats["tool_responses"],
+            "truncated": stats["truncated"],
+        }
+        report["tool_round_overhead"] = _latency(stats["tool_overhead_s"])
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 1 if samples.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
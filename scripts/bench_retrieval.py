@@ -0,0 +1,410 @@
+"""CLI: 用自带的参考问答评测检索质量与延迟。
+
+标准问题集取自 ``knowledge/txt/人物介绍/参考回答.txt`` 中以 ``###`` 分隔的
+``用户：…/林黛玉：…`` 问答对：以"用户"的问题为查询，命中该问答所在的块
+（块内含该问题或回答开头）即视为相关。对每个可用后端 × 检索模式跑
+``retrieve_documents``，输出 recall@k、MRR 与 p50/p95/p99 延迟的 JSON 报告。
+
+- cold：每个后端/模式第一次遍历问题集，查询向量缓存为空（含嵌入耗时）；
+- warm：之后的若干次遍历，查询向量已在内存缓存中。
+
+默认在临时目录里按当前 knowledge/ 重新建库（不动 knowledge_base/）；
+``--index-dir`` 可直接评测已有索引。``--baseline`` 与旧报告比较，
+质量下降超过容差或 warm p95 变慢超过倍数时退出码为 1。
+
+``--quantization`` 对 numpy 后端逐个评测量化配置（``none`` / ``int8`` /
+``binary@256`` / ``int8@128/pca`` …，格式见 ``quantization.parse_spec``），
+报告里附常驻向量内存，以及与未量化结果 top-k 的重合度（``agreement``，
+需把 ``none`` 放在最前），用来权衡内存、延迟与召回。
+
+用法:
+    uv run python -m scripts.bench_retrieval
+    uv run python -m scripts.bench_retrieval --output bench.json
+    uv run python -m scripts.bench_retrieval --baseline bench.json
+    uv run python -m scripts.bench_retrieval --backends numpy --modes dense \
+        --quantization none,int8,int8@128/pca,binary
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# 评测自己管理查询向量缓存，避免读到/写入 knowledge_base/ 里的磁盘缓存
+os.environ["DIGITAL_LDY_EMBED_CACHE"] = "0"
+os.environ["DIGITAL_LDY_CHUNK_EMBED_STORE"] = "0"
+
+from digital_lindaiyu.logging_config import configure_app_logging
+
+configure_app_logging()
+
+from langchain_core.documents import Document
+
+from digital_lindaiyu.config import QuantizationConfig, get_embedding_config
+from digital_lindaiyu.embedding_cache import CachedEmbeddings
+from digital_lindaiyu.embeddings import get_embeddings
+from digital_lindaiyu.knowledge import load_knowledge_base
+from digital_lindaiyu.lexical import LexicalIndex, lexical_index_path
+from digital_lindaiyu.quantization import parse_spec
+from digital_lindaiyu.rag import (
+    VECTOR_DIR,
+    open_vector_store,
+    resolve_vector_backend,
+    retrieve_documents,
+)
+from digital_lindaiyu.reference_qa import (
+    REFERENCE_QA_RESOURCE,
+    ReferencePair,
+    load_reference_pairs,
+)
+
+# 回答开头取多少字作为相关性判据（问答对可能跨块）
+_ANSWER_HEAD_CHARS = 24
+
+
+def _compact(text: str) -> str:
+    return "".join(text.split())
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _latency(samples: List[float]) -> dict:
+    if not samples:
+        return {}
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms": round(_percentile(samples, 50), 4),
+        "p95_ms": round(_percentile(samples, 95), 4),
+        "p99_ms": round(_percentile(samples, 99), 4),
+        "max_ms": round(max(samples), 4),
+    }
+
+
+def _is_relevant(doc: Document, pair: ReferencePair) -> bool:
+    source = str(doc.metadata.get("source") or "").replace("\\", "/")
+    if not source.endswith(REFERENCE_QA_RESOURCE.split("/")[-1]):
+        return False
+    text = _compact(doc.page_content)
+    return (
+        _compact(pair.question) in text
+        or _compact(pair.answer)[:_ANSWER_HEAD_CHARS] in text
+    )
+
+
+def _quality(
+    results: List[List[Document]], pairs: List[ReferencePair], ks: List[int]
+) -> dict:
+    first_hits: List[Optional[int]] = []
+    for docs, pair in zip(results, pairs):
+        rank = next(
+            (i for i, doc in enumerate(docs, start=1) if _is_relevant(doc, pair)),
+            None,
+        )
+        first_hits.append(rank)
+    n = len(pairs) or 1
+    report = {
+        f"recall@{k}": round(
+            sum(1 for r in first_hits if r is not None and r <= k) / n, 4
+        )
+        for k in ks
+    }
+    report["mrr"] = round(sum(1.0 / r for r in first_hits if r) / n, 4)
+    report["misses"] = [
+        pair.question for pair, r in zip(pairs, first_hits) if r is None
+    ]
+    return report
+
+
+def _run_passes(
+    vector_store,
+    lexical: Optional[LexicalIndex],
+    mode: str,
+    pairs: List[ReferencePair],
+    top_k: int,
+    warm_runs: int,
+) -> dict:
+    cold: List[float] = []
+    results: List[List[Document]] = []
+    for pair in pairs:
+        t0 = time.perf_counter()
+        docs = retrieve_documents(
+            vector_store, pair.question, top_k=top_k, mode=mode, lexical_index=lexical
+        )
+        cold.append((time.perf_counter() - t0) * 1000)
+        results.append(docs)
+
+    warm: List[float] = []
+    for _ in range(warm_runs):
+        for pair in pairs:
+            t0 = time.perf_counter()
+            retrieve_documents(
+                vector_store,
+                pair.question,
+                top_k=top_k,
+                mode=mode,
+                lexical_index=lexical,
+            )
+            warm.append((time.perf_counter() - t0) * 1000)
+    return {"results": results, "cold": cold, "warm": warm}
+
+
+def _build_index(backend: str, directory: str) -> dict:
+    """在 ``directory`` 里按当前 knowledge/ 重建 ``backend`` 索引。"""
+    previous = os.environ.get("VECTOR_BACKEND")
+    os.environ["VECTOR_BACKEND"] = backend
+    try:
+        t0 = time.perf_counter()
+        chunks = load_knowledge_base(rebuild=True, persist_directory=directory)
+        build_ms = (time.perf_counter() - t0) * 1000
+    finally:
+        if previous is None:
+            os.environ.pop("VECTOR_BACKEND", None)
+        else:
+            os.environ["VECTOR_BACKEND"] = previous
+    return {"chunks": chunks, "build_ms": round(build_ms, 2)}
+
+
+def _bench_directory(
+    backend: Optional[str],
+    directory: str,
+    inner,
+    modes: List[str],
+    pairs: List[ReferencePair],
+    ks: List[int],
+    warm_runs: int,
+    quantization: Dict[str, QuantizationConfig],
+) -> List[dict]:
+    cfg = get_embedding_config()
+    t0 = time.perf_counter()
+    try:
+        lexical: Optional[LexicalIndex] = LexicalIndex.load(
+            lexical_index_path(directory)
+        )
+    except Exception as e:
+        print(f"读取词法索引失败: {e}", file=sys.stderr)
+        lexical = None
+    lexical_load_ms = (time.perf_counter() - t0) * 1000
+
+    reports = []
+    for mode in modes:
+        if mode != "lexical" and inner is None:
+            continue
+        if mode == "lexical" and lexical is None:
+            continue
+        # 量化只对 numpy 后端的稠密检索有意义
+        variants = (
+            quantization
+            if mode != "lexical" and backend == "numpy"
+            else {"none": QuantizationConfig()}
+        )
+        exact_ids: Optional[List[List[str]]] = None
+        for spec, quant in variants.items():
+            vector_store = None
+            open_ms = 0.0
+            extra: dict = {}
+            if mode != "lexical":
+                # 每个模式一份全新的内存缓存，cold 遍历才真正包含嵌入耗时
+                embeddings = CachedEmbeddings(
+                    inner, backend=cfg.backend, model=cfg.model, cache_path=None
+                )
+                kwargs = {"quantization": quant} if backend == "numpy" else {}
+                t0 = time.perf_counter()
+                vector_store = open_vector_store(
+                    embeddings, directory, backend=backend, **kwargs
+                )
+                open_ms = (time.perf_counter() - t0) * 1000
+            top_k = max(ks)
+            passes = _run_passes(vector_store, lexical, mode, pairs, top_k, warm_runs)
+            resident = getattr(vector_store, "resident_bytes", None)
+            if backend == "numpy" and resident is not None:
+                extra = {"quantization": spec, "resident_bytes": resident()}
+                ids = [[doc.id for doc in docs] for docs in passes["results"]]
+                if not quant.enabled:
+                    exact_ids = ids
+                elif exact_ids is not None:
+                    # 与未量化结果的 top-k 重合度：纯粹衡量量化带来的损失
+                    extra["agreement"] = round(
+                        statistics.fmean(
+                            len(set(a) & set(b)) / max(len(b), 1)
+                            for a, b in zip(ids, exact_ids)
+                        ),
+                        4,
+                    )
+            report = {
+                "backend": "bm25" if mode == "lexical" else backend,
+                "mode": mode,
+                **extra,
+                **_quality(passes["results"], pairs, ks),
+                "open_ms": round(
+                    lexical_load_ms if mode == "lexical" else open_ms, 2
+                ),
+                "first_query_ms": (
+                    round(passes["cold"][0], 4) if passes["cold"] else None
+                ),
+                "cold": _latency(passes["cold"]),
+                "warm": _latency(passes["warm"]),
+            }
+            reports.append(report)
+    return reports
+
+
+def _compare(report: dict, baseline: dict, tolerance: float, slowdown: float) -> List[str]:
+    """返回相对基线的回归描述；空列表表示没有回归。"""
+    def key_of(r: dict) -> tuple:
+        return (r["backend"], r["mode"], r.get("quantization", "none"))
+
+    previous = {key_of(r): r for r in baseline.get("results", [])}
+    problems = []
+    for current in report["results"]:
+        key = key_of(current)
+        old = previous.get(key)
+        if old is None:
+            continue
+        for metric, value in current.items():
+            if not (metric.startswith("recall@") or metric == "mrr"):
+                continue
+            if metric in old and value < old[metric] - tolerance:
+                problems.append(f"{'/'.join(key)} {metric}: {old[metric]} → {value}")
+        old_p95 = old.get("warm", {}).get("p95_ms")
+        new_p95 = current.get("warm", {}).get("p95_ms")
+        if old_p95 and new_p95 and new_p95 > old_p95 * slowdown:
+            problems.append(f"{'/'.join(key)} warm p95: {old_p95}ms → {new_p95}ms")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backends", default="numpy,chroma", help="逗号分隔的向量库后端"
+    )
+    parser.add_argument(
+        "--modes", default="dense,hybrid,lexical", help="逗号分隔的检索模式"
+    )
+    parser.add_argument("-k", default="1,3,5", help="逗号分隔的 recall@k")
+    parser.add_argument("--warm-runs", type=int, default=3, help="warm 遍历次数")
+    parser.add_argument(
+        "--index-dir",
+        default=None,
+        help=f"评测已有索引目录（如 {VECTOR_DIR}），不再临时建库",
+    )
+    parser.add_argument(
+        "--quantization",
+        default="none",
+        help="逗号分隔的 numpy 量化配置，如 none,int8,int8@128/pca,binary",
+    )
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件")
+    parser.add_argument("--baseline", default=None, help="对比的旧报告 JSON")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.02, help="recall/MRR 允许下降的幅度"
+    )
+    parser.add_argument(
+        "--slowdown", type=float, default=2.0, help="warm p95 允许变慢的倍数"
+    )
+    args = parser.parse_args()
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    quantization = {
+        spec.strip(): parse_spec(spec)
+        for spec in args.quantization.split(",")
+        if spec.strip()
+    }
+    pairs = load_reference_pairs()
+    if not pairs:
+        print(f"{REFERENCE_QA_RESOURCE} 中没有解析出问答对", file=sys.stderr)
+        return 1
+
+    cfg = get_embedding_config()
+    inner = None
+    t0 = time.perf_counter()
+    try:
+        inner = get_embeddings(background=False)
+    except Exception as e:
+        print(f"嵌入后端不可用，只评测 BM25: {e}", file=sys.stderr)
+    embeddings_load_ms = (time.perf_counter() - t0) * 1000
+
+    results: List[dict] = []
+    indexes: Dict[str, dict] = {}
+    if args.index_dir:
+        backend = resolve_vector_backend(None, args.index_dir)
+        results.extend(
+            _bench_directory(
+                backend,
+                args.index_dir,
+                inner,
+                modes,
+                pairs,
+                ks,
+                args.warm_runs,
+                quantization,
+            )
+        )
+    else:
+        lexical_done = False
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            if backend == "chroma" and importlib.util.find_spec("chromadb") is None:
+                print(f"跳过 {backend}: 未安装 chromadb", file=sys.stderr)
+                continue
+            with tempfile.TemporaryDirectory(prefix=f"bench_{backend}_") as tmp:
+                indexes[backend] = _build_index(backend, tmp)
+                # BM25 与向量库后端无关，只评测一次
+                backend_modes = [
+                    m for m in modes if m != "lexical" or not lexical_done
+                ]
+                lexical_done = lexical_done or "lexical" in backend_modes
+                results.extend(
+                    _bench_directory(
+                        backend,
+                        tmp,
+                        inner,
+                        backend_modes,
+                        pairs,
+                        ks,
+                        args.warm_runs,
+                        quantization,
+                    )
+                )
+
+    report = {
+        "queries": len(pairs),
+        "k": ks,
+        "warm_runs": args.warm_runs,
+        "embedding": {
+            "backend": cfg.backend if inner is not None else None,
+            "model": cfg.model if inner is not None else None,
+            "load_ms": round(embeddings_load_ms, 2),
+        },
+        "indexes": indexes,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = _compare(report, baseline, args.tolerance, args.slowdown)
+        for problem in problems:
+            print(f"回归: {problem}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
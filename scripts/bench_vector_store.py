@@ -0,0 +1,178 @@
+"""CLI: 对比 numpy 与 Chroma 向量库的检索延迟。
+
+两个后端写入完全相同的向量（随机单位向量，模拟 bge-small-zh 的 512 维），
+查询向量也预先算好，因此测到的只是索引本身的开销，与嵌入模型无关。
+``--rank`` 让向量集中在一个低维子空间附近（更接近真实嵌入的各向异性）。
+
+``--quantization`` 对 numpy 后端逐个评测量化配置，报告常驻向量内存与
+相对未量化结果的 recall@k。
+
+用法:
+    uv run python -m scripts.bench_vector_store
+    uv run python -m scripts.bench_vector_store --chunks 2000 --queries 500
+    uv run python -m scripts.bench_vector_store --backends numpy --chunks 20000 \
+        --rank 64 --quantization none,int8,int8@128/pca,binary
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from digital_lindaiyu.logging_config import configure_app_logging
+
+configure_app_logging()
+
+from digital_lindaiyu.config import QuantizationConfig
+from digital_lindaiyu.quantization import parse_spec
+from digital_lindaiyu.rag import open_vector_store
+
+
+class _PrecomputedEmbeddings(Embeddings):
+    """按文本查表返回预先生成的向量，避免把嵌入耗时算进索引延迟。"""
+
+    def __init__(self, table: Dict[str, List[float]]) -> None:
+        self.table = table
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.table[t] for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.table[text]
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _bench_backend(
+    backend: str,
+    embeddings: Embeddings,
+    texts: List[str],
+    queries: List[str],
+    k: int,
+    quantization: Dict[str, QuantizationConfig],
+) -> List[dict]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix=f"bench_{backend}_") as tmp:
+        t0 = time.perf_counter()
+        store = open_vector_store(embeddings, tmp, backend=backend)
+        open_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        for i in range(0, len(texts), 50):
+            batch = texts[i : i + 50]
+            store.add_texts(texts=batch, ids=[f"id_{i + j}" for j in range(len(batch))])
+        ingest_ms = (time.perf_counter() - t0) * 1000
+
+        variants = quantization if backend == "numpy" else {"none": QuantizationConfig()}
+        exact_ids = None
+        for spec, quant in variants.items():
+            kwargs = {"quantization": quant} if backend == "numpy" else {}
+            t0 = time.perf_counter()
+            store = open_vector_store(embeddings, tmp, backend=backend, **kwargs)
+            reopen_ms = (time.perf_counter() - t0) * 1000
+
+            # 预热一次，排除首查的惰性初始化
+            store.similarity_search(queries[0], k=k)
+            samples = []
+            ids = []
+            for query in queries:
+                t0 = time.perf_counter()
+                docs = store.similarity_search(query, k=k)
+                samples.append((time.perf_counter() - t0) * 1000)
+                ids.append({doc.id for doc in docs})
+
+            result = {
+                "backend": backend,
+                "open_ms": round(open_ms, 2),
+                "reopen_ms": round(reopen_ms, 2),
+                "ingest_ms": round(ingest_ms, 2),
+                "query_mean_ms": round(statistics.fmean(samples), 4),
+                "query_p50_ms": round(_percentile(samples, 50), 4),
+                "query_p95_ms": round(_percentile(samples, 95), 4),
+            }
+            resident = getattr(store, "resident_bytes", None)
+            if resident is not None:
+                result["quantization"] = spec
+                result["resident_bytes"] = resident()
+                if not quant.enabled:
+                    exact_ids = ids
+                elif exact_ids is not None:
+                    result[f"recall@{k}"] = round(
+                        statistics.fmean(
+                            len(a & b) / max(len(b), 1) for a, b in zip(ids, exact_ids)
+                        ),
+                        4,
+                    )
+            results.append(result)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=500, help="索引中的块数")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--dim", type=int, default=512, help="向量维度")
+    parser.add_argument("-k", type=int, default=3, help="top-k")
+    parser.add_argument(
+        "--backends", default="numpy,chroma", help="逗号分隔的后端列表"
+    )
+    parser.add_argument(
+        "--rank", type=int, default=0, help="向量所在低维子空间的秩，0 为各向同性"
+    )
+    parser.add_argument(
+        "--quantization",
+        default="none",
+        help="逗号分隔的 numpy 量化配置，如 none,int8,int8@128/pca,binary（none 放最前）",
+    )
+    args = parser.parse_args()
+    quantization = {
+        spec.strip(): parse_spec(spec)
+        for spec in args.quantization.split(",")
+        if spec.strip()
+    }
+
+    rng = np.random.default_rng(0)
+    table: Dict[str, List[float]] = {}
+    texts = [f"chunk {i}" for i in range(args.chunks)]
+    queries = [f"query {i}" for i in range(args.queries)]
+    basis = (
+        rng.standard_normal((args.rank, args.dim)).astype(np.float32)
+        if args.rank
+        else None
+    )
+    for name in texts + queries:
+        vec = rng.standard_normal(args.dim).astype(np.float32)
+        if basis is not None:
+            vec = rng.standard_normal(args.rank).astype(np.float32) @ basis + 0.5 * vec
+        table[name] = (vec / np.linalg.norm(vec)).tolist()
+    embeddings = _PrecomputedEmbeddings(table)
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        # 只探测、不导入：chromadb 由 open_vector_store 惰性导入，首次导入开销计入 open_ms
+        if backend == "chroma" and importlib.util.find_spec("chromadb") is None:
+            print(f"跳过 {backend}: 未安装 chromadb", file=sys.stderr)
+            continue
+        results.extend(
+            _bench_backend(backend, embeddings, texts, queries, args.k, quantization)
+        )
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+"""CLI: 本地的假 OpenAI 兼容流式 LLM 服务（压测 / 联调用，不消耗 API 额度）。
+
+实现 ``POST /v1/chat/completions`` 的流式与非流式两种响应，行为可脚本化：
+
+- ``--ttft`` / ``--tps``：首个分片前的延迟（秒）与每秒输出的 token 数；
+- ``--reasoning-tokens``：正文之前先流出若干 ``reasoning_content`` 分片；
+- ``--tool-rounds`` / ``--parallel-tools``：请求带 ``tools`` 时，本轮用户消息之后
+  前几次请求先以 ``tool_calls`` 增量（id / 名称 / 分段的参数）作答，
+  ``finish_reason="tool_calls"``，之后才给正文；
+- ``--length-limit``：正文超过这么多 token 时截断并返回 ``finish_reason="length"``，
+  下一次请求若以被截断的回答结尾，就接着流出剩下的部分；
+- ``stream_options.include_usage`` 时最后附一个 usage 分片，前缀缓存命中数按
+  与此前请求逐条消息相同的最长前缀估算（``prompt_cache_hit_tokens``）。
+
+``GET /stats`` 返回请求计数与工具轮开销样本：从工具调用响应发完，到客户端带着
+工具结果发来下一次请求的间隔，即客户端执行工具与重新组装请求的耗时。
+token 一律按两个字符一个估算。
+
+用法:
+    uv run python -m scripts.fake_llm --port 8931 --ttft 0.3 --tps 40 --tool-rounds 1
+    CHAT_BASE_URL=http://127.0.0.1:8931/v1 DEEPSEEK_API_KEY=fake uv run python main.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# 回复正文循环取自这段文字，每两个字符算一个 token
+_CORPUS = (
+    "你这话我已听见了。这几日潇湘馆里竹影横斜，我倚着窗看了半日的雨，倒也清静。"
+    "宝玉前儿来过一回，说了些不相干的话，我便打发他去了。"
+    "花开易见落难寻，阶前愁杀葬花人，这心事原不必说与旁人知道。"
+    "你若真心问我，我便告诉你：凡事若失了真心，再热闹也不过是空的。"
+)
+_REASONING = "先想想用户问的是什么，再想想该用怎样的口吻回答。"
+_SUMMARY = "用户与林黛玉闲谈了潇湘馆近况与宝玉，黛玉语气清冷而真诚。"
+# 记住的消息前缀数（估算缓存命中用）
+_MAX_PREFIXES = 100_000
+
+
+@dataclass(frozen=True)
+class FakeLLMConfig:
+    host: str = "127.0.0.1"
+    port: int = 8931
+    ttft: float = 0.3              # 秒
+    tps: float = 50.0              # 每秒 token 数，0 不限速
+    reply_tokens: int = 60
+    reasoning_tokens: int = 0
+    tool_rounds: int = 0
+    parallel_tools: int = 1
+    length_limit: int = 0          # 0 不截断
+
+
+def _tokens(text: str) -> List[str]:
+    return [text[i : i + 2] for i in range(0, len(text), 2)]
+
+
+def _cycle(source: str, count: int, offset: int = 0) -> List[str]:
+    pieces = _tokens(source)
+    return [pieces[(offset + i) % len(pieces)] for i in range(count)]
+
+
+def _approx_tokens(chars: int) -> int:
+    return (chars + 1) // 2
+
+
+class FakeLLMServer:
+    """asyncio 实现，单线程即可同时保持数百条流。"""
+
+    def __init__(self, config: FakeLLMConfig) -> None:
+        self.config = config
+        self.requests = 0
+        self.tool_responses = 0
+        self.truncated = 0
+        self.tool_overhead: List[float] = []   # 秒
+        self._ids = itertools.count(1)
+        self._tool_sent: Dict[str, float] = {}
+        self._remainders: Dict[str, List[str]] = {}  # 被截断回答的摘要 → 剩余 token
+        self._prefixes: "OrderedDict[bytes, None]" = OrderedDict()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self._handle, self.config.host, self.config.port)
+        return self._server
+
+    @property
+    def port(self) -> int:
+        assert self._server is not None
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.config.host}:{self.port}/v1"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "tool_responses": self.tool_responses,
+            "truncated": self.truncated,
+            "tool_overhead_s": list(self.tool_overhead),
+        }
+
+    # ------------------------------ HTTP ------------------------------ #
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:  # keep-alive：客户端的连接池会复用连接
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, path = lines[0].split()[:2]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+                if method == "POST" and path.endswith("/chat/completions"):
+                    await self._completions(writer, json.loads(body))
+                elif method == "GET" and path == "/stats":
+                    _write_json(writer, 200, self.stats())
+                else:
+                    _write_json(writer, 404, {"error": {"message": "not found"}})
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ------------------------------ 响应 ------------------------------ #
+
+    async def _completions(self, writer: asyncio.StreamWriter, request: Dict[str, Any]) -> None:
+        self.requests += 1
+        arrived = time.perf_counter()
+        messages = request.get("messages") or []
+        self._record_tool_overhead(messages, arrived)
+        prompt_tokens, hit_tokens = self._prompt_usage(messages)
+        model = str(request.get("model") or "fake")
+
+        if not request.get("stream"):
+            content = _SUMMARY
+            _write_json(
+                writer,
+                200,
+                {
+                    "id": f"chatcmpl-{next(self._ids)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": _usage(prompt_tokens, hit_tokens, _approx_tokens(len(content))),
+                },
+            )
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        chunk_id = f"chatcmpl-{next(self._ids)}"
+        created = int(time.time())
+
+        async def send(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> None:
+            event = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            _write_event(writer, json.dumps(event, ensure_ascii=False))
+            await writer.drain()
+
+        await asyncio.sleep(self.config.ttft)
+        pace = 1.0 / self.config.tps if self.config.tps > 0 else 0.0
+        completion = 0
+        await send({"role": "assistant", "content": ""})
+        for piece in _cycle(_REASONING, self.config.reasoning_tokens):
+            await send({"reasoning_content": piece})
+            completion += 1
+            await asyncio.sleep(pace)
+
+        calls = self._scripted_tool_calls(request, messages)
+        if calls:
+            self.tool_responses += 1
+            for index, (call_id, name, arguments) in enumerate(calls):
+                await send(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": index,
+                                "id": call_id,
+                                "type": "function",
+                                "function": {"name": name, "arguments": ""},
+                            }
+                        ]
+                    }
+                )
+                for piece in _tokens(arguments):
+                    await send({"tool_calls": [{"index": index, "function": {"arguments": piece}}]})
+                    completion += 1
+                    await asyncio.sleep(pace)
+            await send({}, "tool_calls")
+            sent = time.perf_counter()
+            for call_id, _, _ in calls:
+                self._tool_sent[call_id] = sent
+        else:
+            pieces, finish_reason = self._reply(messages)
+            for piece in pieces:
+                await send({"content": piece})
+                completion += 1
+                await asyncio.sleep(pace)
+            await send({}, finish_reason)
+
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": _usage(prompt_tokens, hit_tokens, completion),
+            }
+            _write_event(writer, json.dumps(event, ensure_ascii=False))
+        _write_event(writer, "[DONE]")
+        writer.write(b"0\r\n\r\n")
+
+    def _scripted_tool_calls(
+        self, request: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> List[Tuple[str, str, str]]:
+        tools = request.get("tools") or []
+        if not tools or self.config.tool_rounds <= 0:
+            return []
+        last_user = max(
+            (i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1
+        )
+        rounds = sum(1 for m in messages[last_user + 1 :] if m.get("tool_calls"))
+        if rounds >= self.config.tool_rounds:
+            return []
+        name = str((tools[0].get("function") or {}).get("name") or "tool")
+        query = str(messages[last_user].get("content") or "")[:20] if last_user >= 0 else ""
+        return [
+            (
+                f"call_{next(self._ids)}",
+                name,
+                json.dumps({"query": f"{query} {rounds + 1}-{i + 1}"}, ensure_ascii=False),
+            )
+            for i in range(max(1, self.config.parallel_tools))
+        ]
+
+    def _reply(self, messages: List[Dict[str, Any]]) -> Tuple[List[str], str]:
+        """本轮正文；超过 length_limit 时截断，续写请求接着给剩下的部分。"""
+        said, remainder = "", None
+        if len(messages) >= 2 and messages[-2].get("role") == "assistant":
+            said = str(messages[-2].get("content") or "")
+            remainder = self._remainders.pop(_digest(said), None)
+        if remainder is None:
+            said = ""
+        pieces = remainder or _cycle(_CORPUS, self.config.reply_tokens, offset=len(messages))
+        limit = self.config.length_limit
+        if limit <= 0 or len(pieces) <= limit:
+            return pieces, "stop"
+        head, rest = pieces[:limit], pieces[limit:]
+        self.truncated += 1
+        # 客户端续写时会把已说的部分拼成一条 assistant 消息发回来
+        self._remainders[_digest(said + "".join(head))] = rest
+        return head, "length"
+
+    def _record_tool_overhead(self, messages: List[Dict[str, Any]], arrived: float) -> None:
+        sent = [
+            self._tool_sent.pop(m.get("tool_call_id"))
+            for m in messages
+            if m.get("role") == "tool" and m.get("tool_call_id") in self._tool_sent
+        ]
+        if sent:
+            self.tool_overhead.append(arrived - max(sent))
+
+    def _prompt_usage(self, messages: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """提示词 token 数，以及与此前请求逐条消息相同的最长前缀的 token 数。"""
+        digest = hashlib.blake2b(digest_size=16)
+        chars = hit = 0
+        for message in messages:
+            text = json.dumps(message, ensure_ascii=False, sort_keys=True)
+            digest.update(text.encode("utf-8"))
+            chars += len(text)
+            key = digest.copy().digest()
+            if key in self._prefixes:
+                hit = chars
+                self._prefixes.move_to_end(key)
+            else:
+                self._prefixes[key] = None
+        while len(self._prefixes) > _MAX_PREFIXES:
+            self._prefixes.popitem(last=False)
+        return _approx_tokens(chars), _approx_tokens(hit)
+
+
+def _digest(text: Any) -> str:
+    return hashlib.blake2b(str(text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _usage(prompt: int, hit: int, completion: int) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "prompt_cache_hit_tokens": hit,
+        "prompt_cache_miss_tokens": prompt - hit,
+        "prompt_tokens_details": {"cached_tokens": hit},
+    }
+
+
+def _write_event(writer: asyncio.StreamWriter, data: str) -> None:
+    payload = f"data: {data}\n\n".encode("utf-8")
+    writer.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+
+
+def _write_json(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    reason = "OK" if status == 200 else "Not Found"
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+
+
+def serve_in_background(config: FakeLLMConfig) -> FakeLLMServer:
+    """在守护线程自己的事件循环里启动服务，返回已在监听的实例（压测脚本用）。"""
+    server = FakeLLMServer(config)
+    ready = threading.Event()
+
+    def run() -> None:
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="FakeLLM", daemon=True).start()
+    ready.wait()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeLLMConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="首个分片前的延迟（秒）")
+    parser.add_argument("--tps", type=float, default=defaults.tps, help="每秒输出 token 数，0 不限速")
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens, help="每个回答的 token 数")
+    parser.add_argument("--reasoning-tokens", type=int, default=defaults.reasoning_tokens)
+    parser.add_argument(
+        "--tool-rounds", type=int, default=defaults.tool_rounds,
+        help="请求带 tools 时，每轮先返回几次工具调用",
+    )
+    parser.add_argument(
+        "--parallel-tools", type=int, default=defaults.parallel_tools,
+        help="每次工具调用响应里的调用个数",
+    )
+    parser.add_argument(
+        "--length-limit", type=int, default=defaults.length_limit,
+        help="正文超过这么多 token 时以 finish_reason=length 截断，0 不截断",
+    )
+
+
+def config_from_args(args: argparse.Namespace, host: str = "127.0.0.1", port: int = 0) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        host=host,
+        port=port,
+        ttft=max(0.0, args.ttft),
+        tps=max(0.0, args.tps),
+        reply_tokens=max(1, args.reply_tokens),
+        reasoning_tokens=max(0, args.reasoning_tokens),
+        tool_rounds=max(0, args.tool_rounds),
+        parallel_tools=max(1, args.parallel_tools),
+        length_limit=max(0, args.length_limit),
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=FakeLLMConfig.port)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer(config_from_args(args, args.host, args.port))
+
+    async def run() -> None:
+        await server.start()
+        print(f"假 LLM 服务已启动: {server.base_url}", flush=True)
+        await server._server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
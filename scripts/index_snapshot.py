@@ -0,0 +1,83 @@
+"""CLI: 导出 / 导入单文件内存映射索引快照。
+
+快照把向量、块文本、metadata 与 token 数打进 ``knowledge_base/index.snapshot``，
+打包后的应用（``VECTOR_BACKEND=auto`` 且没有 numpy_index/ 时）直接映射它检索，
+启动即可用，只有被访问到的页才占内存。
+
+用法:
+    uv run python -m scripts.index_snapshot export              # 现有索引 → 快照
+    uv run python -m scripts.index_snapshot import SNAPSHOT     # 快照 → 可写的 numpy 索引
+    uv run python -m scripts.index_snapshot info [SNAPSHOT]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+from digital_lindaiyu.logging_config import configure_app_logging
+
+configure_app_logging()
+
+from digital_lindaiyu.config import get_retrieval_config
+from digital_lindaiyu.index_snapshot import (
+    SnapshotIndex,
+    export_snapshot,
+    import_snapshot,
+    snapshot_path,
+)
+from digital_lindaiyu.rag import VECTOR_DIR, bump_index_version, open_vector_store
+
+
+def _export(args) -> int:
+    output = args.output or snapshot_path(args.index_dir)
+    # 导出只读已有向量，不需要嵌入模型；来源是 numpy / Chroma 索引，不是快照本身
+    backend = get_retrieval_config().vector_backend
+    store = open_vector_store(
+        None,
+        args.index_dir,
+        backend="auto" if backend == "snapshot" else backend,
+        writable=True,
+    )
+    count = export_snapshot(store, output)
+    bump_index_version(args.index_dir)
+    size = os.path.getsize(output)
+    print(f"已导出 {count} 块到 {output}（{size / 2**20:.2f} MiB）。")
+    return 0
+
+
+def _import(args) -> int:
+    count = import_snapshot(args.snapshot, args.index_dir)
+    bump_index_version(args.index_dir)
+    print(f"已从 {args.snapshot} 还原 {count} 块到 {args.index_dir}。")
+    return 0
+
+
+def _info(args) -> int:
+    path = args.snapshot or snapshot_path(args.index_dir)
+    index = SnapshotIndex(path)
+    print(f"{path}: {index.size} 块，维度 {index.dim}，{os.path.getsize(path)} 字节")
+    if index.size:
+        print(f"token 合计 {int(index.tokens.sum())}，首块 {index.chunk_id(0)}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--index-dir", default=VECTOR_DIR, help="索引目录（默认 knowledge_base/）"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="把 numpy / Chroma 索引导出为快照")
+    export.add_argument("--output", default=None, help="快照路径，默认 <index-dir>/index.snapshot")
+    imp = sub.add_parser("import", help="把快照还原为可写的 numpy 索引")
+    imp.add_argument("snapshot")
+    info = sub.add_parser("info", help="查看快照概况")
+    info.add_argument("snapshot", nargs="?")
+    args = parser.parse_args()
+    return {"export": _export, "import": _import, "info": _info}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
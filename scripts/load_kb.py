@@ -3,18 +3,39 @@
 用法:
     uv run python -m scripts.load_kb            # 增量
     uv run python -m scripts.load_kb --rebuild  # 清空重建
+    uv run python -m scripts.load_kb --watch    # 监视 knowledge/，有变化就增量入库
+    uv run python -m scripts.load_kb --profile  # 打印各阶段 / 各批次的剖析摘要与 JSON
+    uv run python -m scripts.load_kb --profile ingest_profile.json  # JSON 写入文件
+
+``--watch`` 写出的新一代索引会被运行中的应用自动换入，不必重启。
 """
 
 from __future__ import annotations
 
 import argparse
+import json
 import sys
 
 from digital_lindaiyu.logging_config import configure_app_logging
 
 configure_app_logging()
 
-from digital_lindaiyu.knowledge import load_knowledge_base
+from digital_lindaiyu.index_snapshot import ReadOnlyIndexError
+from digital_lindaiyu.knowledge import load_knowledge_base, watch_knowledge_base
+from digital_lindaiyu.profiling import format_profile
+
+
+def _emit_profile(report: dict, target: str) -> None:
+    """摘要打到 stderr；JSON 写到 ``target``（``-`` 为 stdout）。"""
+    for line in format_profile(report):
+        print(line, file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if target == "-":
+        print(text)
+    else:
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"剖析 JSON 已写入 {target}", file=sys.stderr)
 
 
 def main() -> int:
@@ -22,9 +43,39 @@ def main() -> int:
     parser.add_argument(
         "--rebuild", action="store_true", help="先清空向量库再写入"
     )
+    parser.add_argument(
+        "--watch", action="store_true", help="持续监视 knowledge/，有变化就增量入库"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=2.0, help="--watch 的检查间隔（秒）"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="JSON",
+        help="输出入库剖析：可读摘要打到 stderr，JSON 打到 stdout 或写入给定文件",
+    )
     args = parser.parse_args()
-    count = load_knowledge_base(rebuild=args.rebuild)
-    print(f"共写入 {count} 个文本块到知识库。")
+    try:
+        if args.watch:
+            if args.rebuild:
+                load_knowledge_base(rebuild=True)
+            try:
+                watch_knowledge_base(interval=max(0.2, args.interval))
+            except KeyboardInterrupt:
+                pass
+            return 0
+        report: dict = {}
+        count = load_knowledge_base(rebuild=args.rebuild, report=report)
+    except ReadOnlyIndexError as e:
+        print(f"入库失败: {e}", file=sys.stderr)
+        return 1
+    # JSON 打到 stdout 时其余输出都走 stderr，方便直接重定向 / 管道给 jq
+    out = sys.stderr if args.profile == "-" else sys.stdout
+    print(f"共写入 {count} 个文本块到知识库。", file=out)
+    if args.profile:
+        _emit_profile(report, args.profile)
     return 0
 
 
@@ -0,0 +1,70 @@
+"""CLI: 无界面的 HTTP / SSE 对话服务（自助终端、网页前端用）。
+
+用法:
+    uv run python -m scripts.serve
+    uv run python -m scripts.serve --host 0.0.0.0 --port 8765 --max-concurrent 32 --no-tts
+
+    curl -N http://127.0.0.1:8765/v1/chat \\
+        -d '{"message": "你好", "thread_id": "kiosk-1"}'
+
+不配 ``DEEPSEEK_API_KEY`` 时走本地占位回复；也可把 ``CHAT_BASE_URL`` 指向任意
+OpenAI 兼容的本地桩服务，在本机调试接口与并发行为而不消耗 API 额度。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import logging
+import sys
+
+from digital_lindaiyu.logging_config import configure_app_logging
+
+configure_app_logging(logging.INFO)
+
+from digital_lindaiyu.chat import ChatEngine
+from digital_lindaiyu.config import get_server_config
+from digital_lindaiyu.server import ChatServer
+from digital_lindaiyu.tts import get_tts_client
+
+logger = logging.getLogger("serve")
+
+
+def main() -> int:
+    defaults = get_server_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("--max-concurrent", type=int, default=defaults.max_concurrent)
+    parser.add_argument("--max-queue", type=int, default=defaults.max_queue)
+    parser.add_argument(
+        "--no-tts", dest="tts", action="store_false", default=defaults.tts,
+        help="不合成语音，只推送文本事件",
+    )
+    args = parser.parse_args()
+    config = dataclasses.replace(
+        defaults,
+        host=args.host,
+        port=args.port,
+        max_concurrent=max(1, args.max_concurrent),
+        max_queue=max(0, args.max_queue),
+        tts=args.tts,
+    )
+
+    engine = ChatEngine(log=logger.info)
+    tts_client = get_tts_client() if config.tts else None
+    server = ChatServer(engine, config, tts_client=tts_client)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+        if tts_client is not None:
+            tts_client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
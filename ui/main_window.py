@@ -249,6 +249,12 @@ class ChatWindow(QMainWindow):
             Qt.ScrollBarPolicy.ScrollBarAlwaysOff
         )
         self.message_input.textChanged.connect(self._update_input_height)
+        # 输入停顿后把草稿交给引擎做后台检索预取
+        self._prefetch_timer = QTimer(self)
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(350)
+        self._prefetch_timer.timeout.connect(self._prefetch_draft)
+        self.message_input.textChanged.connect(self._prefetch_timer.start)
         self.message_input.installEventFilter(self)
         self.composer_layout.addWidget(self.message_input, 1)
 
@@ -271,6 +277,9 @@ class ChatWindow(QMainWindow):
         outer.addStretch(1)
         return composer
 
+    def _prefetch_draft(self) -> None:
+        self.engine.prefetch(self.message_input.toPlainText())
+
     def _update_input_height(self) -> None:
         # 根据内容自适应 48 - 120
         doc_h = self.message_input.document().size().height()
@@ -568,6 +577,8 @@ class ChatWindow(QMainWindow):
                 if not self.chat_thread.wait(2000):
                     self.chat_thread.terminate()
                     self.chat_thread.wait(1000)
+            self._prefetch_timer.stop()
+            self.engine.close()
             if self.asr_session is not None:
                 try:
                     self.asr_session.stop()